@@ -0,0 +1,18 @@
+__author__ = "Pierre-Yves Martin <pym.aldebaran@gmail.com>"
+__copyright__ = "Copyright (C) 2017 GIP BULAC"
+__license__ = "GNU AGPL V3"
+
+# This file is part of Mincer.
+#
+# Mincer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mincer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Mincer.  If not, see <http://www.gnu.org/licenses/>.
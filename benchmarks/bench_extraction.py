@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the extraction of results from real Koha pages.
+
+The pages are downloaded once from the BULAC Koha server (or read from local
+files given on the command line) and then each extraction is timed with every
+available HTML engine.
+
+Usage::
+
+    python -m benchmarks.bench_extraction [saved_page.html selector]...
+"""
+
+__author__ = "Pierre-Yves Martin <pym.aldebaran@gmail.com>"
+__copyright__ = "Copyright (C) 2017 GIP BULAC"
+__license__ = "GNU AGPL V3"
+
+# This file is part of Mincer.
+#
+# Mincer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mincer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Mincer.  If not, see <http://www.gnu.org/licenses/>.
+
+# To read the command line
+import sys
+
+# To time the extractions precisely
+import timeit
+
+# HTTP library for Python, safe for human consumption
+# See http://docs.python-requests.org/en/master/
+import requests
+
+# Html extraction tools
+from mincer import utils
+
+"""Real Koha pages used for the benchmark: name, url and result selector."""
+KOHA_PAGES = [
+    ("koha search",
+     "https://koha.bulac.fr/cgi-bin/koha/opac-search.pl?idx=&q=afrique&branch_group_limit=",
+     "#userresults .searchresults #bookbag_form table tr td.bibliocol"),
+    ("koha booklist",
+     "https://koha.bulac.fr/cgi-bin/koha/opac-shelves.pl?op=view&shelfnumber=9896&sortfield=title",
+     "#usershelves .searchresults table tr td:not(.select)"),
+]
+
+"""Number of extractions timed for each page and engine."""
+REPEAT = 20
+
+
+def load_pages(argv):
+    """Retrieve the pages to benchmark.
+
+    Params:
+        argv (list(str)): pairs of path to a saved page and result selector.
+            If empty the real Koha pages are downloaded.
+
+    Returns:
+        list(tuple(str, str, str, str)): name, page, selector and base url of
+        each page.
+    """
+    if argv:
+        return [(path, open(path, encoding="utf-8").read(), selector, "http://localhost")
+                for path, selector in zip(argv[::2], argv[1::2])]
+
+    return [(name,
+             requests.get(url, headers={'accept-language': 'fr-FR'}).text,
+             selector,
+             utils.get_base_url(url))
+            for name, url, selector in KOHA_PAGES]
+
+
+def bench(name, page, selector, base_url):
+    """Time the extraction of a page with every engine and print the result.
+
+    The default engine is timed first and used as reference for the others.
+    """
+    print("{name}: {size} KB".format(name=name, size=len(page) // 1024))
+    reference = None
+    engines = sorted(utils.ENGINES, key=lambda e: e != utils.DEFAULT_ENGINE)
+    for engine in engines:
+        def extract():
+            try:
+                return utils.extract_all_node_from_html(
+                    selector, page, base_url, engine=engine)
+            except utils.NoMatchError:
+                return []
+        count = len(extract())
+        duration = min(timeit.repeat(extract, number=1, repeat=REPEAT))
+        if reference is None:
+            reference = duration
+        print("    {engine:<10} {count:>5} items {ms:>9.2f} ms {ratio:>6.2f}x".format(
+            engine=engine,
+            count=count,
+            ms=duration * 1000,
+            ratio=duration / reference))
+
+
+if __name__ == '__main__':
+    for page in load_pages(sys.argv[1:]):
+        bench(*page)
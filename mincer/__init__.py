@@ -36,6 +36,19 @@ from urllib.parse import quote_plus, unquote_plus
 # To manipulate path
 import os
 
+# To share the searches in progress between threads
+import threading
+
+# To recognize identical remote pages
+import hashlib
+
+# To keep the compressed answers in cache
+import base64
+
+# To query several providers side by side
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
 # To create a web server c.f. http://flask.pocoo.org/
 from flask import Flask
 
@@ -63,14 +76,23 @@ from flask import abort
 # To mark string as safe markup preventing it from being escaped
 from flask import Markup
 
+# To answer with JSON documents
+from flask import jsonify
+
+# To add headers to an answer
+from flask import make_response
+
+# To stream an answer piece by piece
+from flask import Response
+
+# To add commands to the command line interface of Flask
+# See https://click.palletsprojects.com/
+import click
+
 # For easy database ~ python binding c.f. http://www.sqlalchemy.org/
 from flask_sqlalchemy import SQLAlchemy
 import sqlalchemy
 
-# HTTP library for Python, safe for human consumption
-# See http://docs.python-requests.org/en/master/
-import requests
-
 # A Python slugify application that handles unicode.
 # See https://github.com/un33k/python-slugify
 from slugify import slugify
@@ -83,13 +105,25 @@ from dominate.util import raw
 # Convenient constant for HTTP status codes
 try:
     # Python 3.5+ only
-    from HTTPStatus import OK, NOT_FOUND, INTERNAL_SERVER_ERROR, BAD_REQUEST
+    from HTTPStatus import OK, NOT_FOUND, INTERNAL_SERVER_ERROR, BAD_REQUEST, BAD_GATEWAY, SERVICE_UNAVAILABLE, GATEWAY_TIMEOUT
 except Exception as e:
-    from http.client import OK, NOT_FOUND, INTERNAL_SERVER_ERROR, BAD_REQUEST
+    from http.client import OK, NOT_FOUND, INTERNAL_SERVER_ERROR, BAD_REQUEST, BAD_GATEWAY, SERVICE_UNAVAILABLE, GATEWAY_TIMEOUT
 
 # Html extraction tools
 from mincer import utils
 
+# Tools to query the remote providers
+from mincer import remote
+
+# Counters of what happens in the application
+from mincer.metrics import Metrics, Outcome
+
+# To keep the recent answers of the providers
+from mincer import cache as caches
+
+# To share the remote pages between several instances of Mincer
+from mincer import peers
+
 # The web application named after the main file itself
 app = Flask(__name__)
 
@@ -103,12 +137,384 @@ app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///{path}".format(
     path=os.path.join(app.instance_path, 'mincer.db'))
 
+# HTML engine used to analyse the pages of the providers without their own
+# engine (see mincer.utils.ENGINES)
+app.config["MINCER_HTML_ENGINE"] = utils.DEFAULT_ENGINE
+
+# Normalizers applied to the parameters of the requests to the providers
+# without their own normalizers (see mincer.utils.NORMALIZERS)
+app.config["MINCER_PARAM_NORMALIZERS"] = utils.DEFAULT_NORMALIZERS
+
+# Number of processes used to extract results from big pages (0 to disable)
+app.config["MINCER_EXTRACTION_PROCESSES"] = 0
+
+# Size (in characters) from which a page is analysed in the extraction
+# processes
+app.config["MINCER_EXTRACTION_THRESHOLD"] = 1024 * 1024
+
+# Maximum total size (in characters) of the extractions memoized by page
+# content in each process (0 to disable), see mincer.utils.ExtractionMemo
+app.config["MINCER_EXTRACTION_MEMO_SIZE"] = 32 * 1024 * 1024
+
+# Maximum number of simultaneous connections to the providers in the
+# asynchronous pipeline (see mincer.asgi)
+app.config["MINCER_ASYNC_MAX_CONNECTIONS"] = 500
+
+# Maximum number of simultaneous requests to one remote host, so that a slow
+# provider can not use all the workers of Mincer
+app.config["MINCER_HOST_CAPACITY"] = 10
+
+# Specific maximum number of simultaneous requests for some hosts
+# e.g. {"koha.bulac.fr": 20}
+app.config["MINCER_HOST_CAPACITIES"] = {}
+
+# Maximum time (in seconds) to wait for a remote host to be available
+app.config["MINCER_HOST_WAIT"] = 0.5
+
+# Time (in seconds) given to answer a request when the client does not give
+# its own deadline
+app.config["MINCER_DEADLINE"] = 10
+
+# Maximum time (in seconds) to retrieve a remote page, retries included
+app.config["MINCER_REMOTE_TIMEOUT"] = 10
+
+# Number of retries of a remote page after a connection error, a timeout or a
+# server error
+app.config["MINCER_REMOTE_RETRIES"] = 2
+
+# Delay (in seconds) before the first retry, doubled for each retry and
+# randomized
+app.config["MINCER_REMOTE_BACKOFF"] = 0.1
+
+# Maximum delay (in seconds) between two retries
+app.config["MINCER_REMOTE_MAX_BACKOFF"] = 2
+
+# Send a second identical request when a remote page is slower than 95% of
+# the recent pages of the same provider
+app.config["MINCER_REMOTE_HEDGING"] = False
+
+# Where the cache is stored: memory:// (in each process),
+# sqlite:////path/to/cache.db (shared by the processes of a host) or
+# redis://host:port/db (shared by all the hosts), see mincer.cache.from_url
+app.config["MINCER_CACHE_URL"] = caches.DEFAULT_URL
+
+# Time (in seconds) the answer of a provider is kept in cache (0 to disable)
+app.config["MINCER_CACHE_TTL"] = 300
+
+# Time (in seconds) a no result answer is kept in cache
+app.config["MINCER_CACHE_NO_RESULT_TTL"] = 60
+
+# Time (in seconds) a failure of a provider (remote page in error or
+# unparsable) is kept in cache, so that retries do not hammer a failing
+# provider
+app.config["MINCER_CACHE_ERROR_TTL"] = 10
+
+# Maximum number of answers kept in cache
+app.config["MINCER_CACHE_MAX_ENTRIES"] = 1000
+
+# Maximum size (in bytes, compressed) of the entries of a memory:// cache
+app.config["MINCER_CACHE_MAX_SIZE"] = 64 * 1024 * 1024
+
+# Size (in bytes) above which the entries of a memory:// cache are compressed
+app.config["MINCER_CACHE_COMPRESS_THRESHOLD"] = caches.DEFAULT_COMPRESS_THRESHOLD
+
+# Base urls of all the instances of Mincer sharing their remote pages (this
+# one included), e.g. ["http://mincer1:5000", "http://mincer2:5000"]. Each
+# page is fetched by the only instance owning it, the others ask it.
+app.config["MINCER_PEERS"] = []
+
+# Base url of this instance as written in MINCER_PEERS, required with
+# MINCER_PEERS
+app.config["MINCER_PEER_URL"] = None
+
+# Number of threads used to query the providers of a multi-provider search,
+# they keep working after the deadline of the search to fill the cache
+app.config["MINCER_SEARCH_WORKERS"] = 20
+
+# Size (in bytes) above which the HTML and JSON answers are compressed for the
+# clients accepting it (gzip, or brotli if installed)
+app.config["MINCER_COMPRESSION_MIN_SIZE"] = 1024
+
 # If we want to overload the setting with a config file
 app.config.from_envvar('MINCER_SETTINGS', silent=True)
 
+# Bound the memo of the extractions
+utils.extraction_memo.max_size = app.config["MINCER_EXTRACTION_MEMO_SIZE"]
+
 # Add the database support to our application
 db = SQLAlchemy(app)
 
+# Counters of the outcomes of the requests
+metrics = Metrics()
+
+
+# Guards the creation of the tools shared by all the threads below, so that
+# concurrent first requests do not build them twice
+globals_lock = threading.RLock()
+
+# Pool of processes used to extract results from big pages, see
+# get_extraction_pool()
+extraction_pool = None
+
+
+def get_extraction_pool():
+    """Retrieve the pool of processes used to extract results from big pages.
+
+    The pool is created on first use according to the configuration of the
+    application.
+
+    Returns:
+        mincer.utils.ExtractionPool: the pool of the application.
+    """
+    global extraction_pool
+
+    if extraction_pool is None:
+        with globals_lock:
+            if extraction_pool is None:
+                extraction_pool = utils.ExtractionPool(
+                    processes=app.config["MINCER_EXTRACTION_PROCESSES"],
+                    threshold=app.config["MINCER_EXTRACTION_THRESHOLD"])
+
+    return extraction_pool
+
+
+# Limits of concurrent requests to each remote host, see get_bulkheads()
+bulkheads = None
+
+
+def get_bulkheads():
+    """Retrieve the limits of concurrent requests to each remote host.
+
+    They are created on first use according to the configuration of the
+    application.
+
+    Returns:
+        mincer.remote.Bulkheads: the limits of the application.
+    """
+    global bulkheads
+
+    if bulkheads is None:
+        with globals_lock:
+            if bulkheads is None:
+                bulkheads = remote.Bulkheads(**bulkheads_config())
+
+    return bulkheads
+
+
+def bulkheads_config():
+    """Parameters of the limits of concurrent requests to each remote host.
+
+    Returns:
+        dict: the parameters to build :class:`mincer.remote.Bulkheads`.
+    """
+    return dict(
+        capacity=app.config["MINCER_HOST_CAPACITY"],
+        capacities=app.config["MINCER_HOST_CAPACITIES"],
+        timeout=app.config["MINCER_HOST_WAIT"])
+
+
+# Retrieval of the remote pages, see get_fetcher()
+fetcher = None
+
+
+def get_fetcher():
+    """Retrieve the tool used to fetch the remote pages.
+
+    It is created on first use according to the configuration of the
+    application.
+
+    Returns:
+        mincer.remote.Fetcher: the fetcher of the application.
+    """
+    global fetcher
+
+    if fetcher is None:
+        with globals_lock:
+            if fetcher is None:
+                fetcher = remote.Fetcher(get_bulkheads(), **fetcher_config())
+
+    return fetcher
+
+
+def fetcher_config():
+    """Parameters of the retrieval of the remote pages.
+
+    Returns:
+        dict: the parameters to build :class:`mincer.remote.Fetcher` except
+        the bulkheads.
+    """
+    return dict(
+        timeout=app.config["MINCER_REMOTE_TIMEOUT"],
+        retry=remote.RetryPolicy(
+            retries=app.config["MINCER_REMOTE_RETRIES"],
+            backoff=app.config["MINCER_REMOTE_BACKOFF"],
+            max_backoff=app.config["MINCER_REMOTE_MAX_BACKOFF"]),
+        hedging=app.config["MINCER_REMOTE_HEDGING"],
+        headers=REMOTE_HEADERS,
+        # Each search worker may wait for a request and its hedge
+        hedging_workers=2 * app.config["MINCER_SEARCH_WORKERS"])
+
+
+# Recent answers of the providers, see get_cache()
+cache = None
+
+
+def get_cache():
+    """Retrieve the cache of the answers of the providers.
+
+    It is created on first use according to the configuration of the
+    application.
+
+    Returns:
+        mincer.cache.CacheBackend: the cache of the application.
+    """
+    global cache
+
+    if cache is None:
+        with globals_lock:
+            if cache is None:
+                cache = caches.from_url(
+                    app.config["MINCER_CACHE_URL"],
+                    ttl=app.config["MINCER_CACHE_TTL"],
+                    max_entries=app.config["MINCER_CACHE_MAX_ENTRIES"],
+                    max_size=app.config["MINCER_CACHE_MAX_SIZE"],
+                    compress_threshold=app.config[
+                        "MINCER_CACHE_COMPRESS_THRESHOLD"])
+
+    return cache
+
+
+# Group of the instances of Mincer, see get_peer_group()
+peer_group = None
+
+
+def get_peer_group():
+    """Retrieve the group of the instances of Mincer sharing their remote
+    pages.
+
+    It is created on first use according to the configuration of the
+    application.
+
+    Returns:
+        mincer.peers.PeerGroup: the group of the application, ``None`` if
+        this instance works alone.
+
+    Raises:
+        mincer.peers.PeerConfigurationError: ``MINCER_PEER_URL`` is not one
+            of ``MINCER_PEERS``.
+    """
+    global peer_group
+
+    if peer_group is None and app.config["MINCER_PEERS"]:
+        with globals_lock:
+            if peer_group is None:
+                peer_group = peers.PeerGroup(
+                    app.config["MINCER_PEER_URL"], app.config["MINCER_PEERS"])
+
+    return peer_group
+
+
+# Threads querying the providers of multi-provider searches, see
+# get_search_executor()
+search_executor = None
+
+
+def get_search_executor():
+    """Retrieve the threads used to query the providers of multi-provider
+    searches.
+
+    They are created on first use according to the configuration of the
+    application.
+
+    Returns:
+        concurrent.futures.ThreadPoolExecutor: the threads of the
+        application.
+    """
+    global search_executor
+
+    if search_executor is None:
+        with globals_lock:
+            if search_executor is None:
+                search_executor = ThreadPoolExecutor(
+                    max_workers=app.config["MINCER_SEARCH_WORKERS"],
+                    thread_name_prefix="mincer-search")
+
+    return search_executor
+
+
+"""Header a client can use to give its time budget (in seconds)."""
+DEADLINE_HEADER = "X-Mincer-Deadline"
+
+"""Query parameter a client can use to give its time budget (in seconds)."""
+DEADLINE_PARAM = "deadline"
+
+
+def parse_deadline(header, param):
+    """Build the deadline of a request from the time budget of the client.
+
+    Params:
+        header (str|None): value of the :data:`DEADLINE_HEADER` header.
+        param (str|None): value of the :data:`DEADLINE_PARAM` query
+            parameter, used first.
+
+    Returns:
+        mincer.remote.Deadline: the deadline of the request, by default
+        ``MINCER_DEADLINE`` seconds from now.
+
+    Raises:
+        ValueError: the time budget is not a positive number of seconds.
+    """
+    return remote.Deadline.parse(
+        param if param is not None else header,
+        app.config["MINCER_DEADLINE"])
+
+
+"""Query parameter a client can use to get the results as soon as they are
+rendered."""
+STREAM_PARAM = "stream"
+
+"""Query parameter a client can use to get only the first results."""
+LIMIT_PARAM = "limit"
+
+"""Query parameter a client can use to skip the first results."""
+OFFSET_PARAM = "offset"
+
+
+def parse_window(limit, offset):
+    """Build the window of the results a client asked for.
+
+    Params:
+        limit (str|None): value of the :data:`LIMIT_PARAM` query parameter.
+        offset (str|None): value of the :data:`OFFSET_PARAM` query parameter.
+
+    Returns:
+        tuple(int, int|None): the number of results skipped and the maximum
+        number of results given, ``None`` for all of them.
+
+    Raises:
+        ValueError: the limit or the offset is not a positive integer.
+
+    Examples:
+        >>> parse_window("10", None)
+        (0, 10)
+        >>> parse_window(None, None)
+        (0, None)
+    """
+    offset = int(offset) if offset is not None else 0
+    limit = int(limit) if limit is not None else None
+    if offset < 0 or (limit is not None and limit < 0):
+        raise ValueError(
+            "negative window {offset}+{limit}".format(
+                offset=offset, limit=limit))
+
+    return offset, limit
+
+
+"""Headers sent with every request to a provider."""
+# HACK: we force copy the accept-language from the recieved request
+#       see: https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Accept-Language
+REMOTE_HEADERS = {'accept-language': 'fr-FR'}
+
 
 class HtmlClasses(object):
     """HTML classes used when generating returned HTML contents."""
@@ -140,6 +546,22 @@ class HtmlClasses(object):
     """Class used to embed provider name."""
     PROVIDER = "mincer-provider"
 
+    """Class used to embed returned content when the answer of a provider was
+    not ready before the deadline."""
+    PENDING = "mincer-pending"
+
+    @staticmethod
+    def pending_query():
+        return ".{cls}".format(cls=HtmlClasses.PENDING)
+
+    """Class used to embed returned content when the remote page of a provider
+    could not be retrieved."""
+    ERROR = "mincer-error"
+
+    @staticmethod
+    def error_query():
+        return ".{cls}".format(cls=HtmlClasses.ERROR)
+
     @staticmethod
     def provider_query():
         return ".{cls_rslt}>.{cls_prov}, .{cls_no_rslt}>.{cls_prov}".format(
@@ -148,9 +570,6 @@ class HtmlClasses(object):
             cls_prov=HtmlClasses.PROVIDER)
 
 
-# TODO: Add a selectors_to_remove list of selector that target nodes to remove
-
-
 class Provider(db.Model):
     """A web data provider for Mincer.
 
@@ -162,6 +581,16 @@ class Provider(db.Model):
     result_selector = db.Column(db.String, unique=False, nullable=False)
     no_result_selector = db.Column(db.String, unique=False, nullable=False, default="")
     no_result_content = db.Column(db.String, unique=False, nullable=False, default="")
+    html_engine = db.Column(db.String, unique=False, nullable=False, default="")
+    param_normalizers = db.Column(db.String, unique=False, nullable=False, default="")
+    minify = db.Column(db.Boolean, unique=False, nullable=False, default=False)
+    selectors_to_remove = db.Column(db.String, unique=False, nullable=False, default="")
+    title_selector = db.Column(db.String, unique=False, nullable=False, default="")
+    author_selector = db.Column(db.String, unique=False, nullable=False, default="")
+    call_number_selector = db.Column(db.String, unique=False, nullable=False, default="")
+    link_selector = db.Column(db.String, unique=False, nullable=False, default="")
+    cover_selector = db.Column(db.String, unique=False, nullable=False, default="")
+    fallback_result_selectors = db.Column(db.String, unique=False, nullable=False, default="")
 
     def __init__(self, **kwargs):
         assert "slug" not in kwargs, "slug is auto-computed and must not be provided"
@@ -171,6 +600,69 @@ class Provider(db.Model):
 
         super(Provider, self).__init__(**kwargs)
 
+    @property
+    def engine(self):
+        """Name of the HTML engine used to analyse the pages of this provider.
+
+        It is the one of the provider if any or the global one."""
+        return self.html_engine or app.config["MINCER_HTML_ENGINE"]
+
+    @property
+    def selectors_version(self):
+        """Fingerprint of everything used to extract an answer from a page of
+        this provider.
+
+        It changes whenever the answers extracted from the same page may
+        change."""
+        settings = "\0".join([
+            utils.get_base_url(self.remote_url),
+            self.result_selector,
+            self.fallback_result_selectors or "",
+            self.no_result_selector,
+            self.no_result_content,
+            self.engine,
+            "minify" if self.minify else "",
+            self.selectors_to_remove or ""]
+            + [self.field_selectors.get(field, "")
+               for field in utils.RECORD_FIELDS])
+        return hashlib.blake2b(
+            settings.encode("utf-8"), digest_size=8).hexdigest()
+
+    @property
+    def result_selectors(self):
+        """Selectors of the results of this provider: the result selector
+        followed by the fallback ones.
+
+        They are alternatives (e.g. for several versions of a Koha theme), so
+        the results are given by the first one matching, whatever the order
+        they are tried in (see :func:`ordered_result_selectors`)."""
+        return (self.result_selector,)\
+            + utils.parse_selectors(self.fallback_result_selectors or "")
+
+    @property
+    def field_selectors(self):
+        """Selectors of the fields of the records of this provider, relative
+        to its results, by name of field (see
+        :data:`mincer.utils.RECORD_FIELDS`).
+
+        Only the fields with a selector are given."""
+        selectors = {}
+        for field in utils.RECORD_FIELDS:
+            selector = getattr(self, field + "_selector")
+            if selector:
+                selectors[field] = selector
+        return selectors
+
+    @property
+    def normalizers(self):
+        """Names of the normalizers applied to the parameters of the requests
+        to this provider.
+
+        They are the ones of the provider if any or the global ones."""
+        if self.param_normalizers:
+            return utils.parse_normalizers(self.param_normalizers)
+        return app.config["MINCER_PARAM_NORMALIZERS"]
+
 
 class Dependency(db.Model):
     """A javascript or CSS dependency of Mincer app.
@@ -343,12 +835,55 @@ def loadbulacdb_command():
         print('*** Demo providers loaded.')
 
 
+@app.cli.command('cachestats')
+@click.option("--provider", help="Only the entries of this provider.")
+@click.option("--prefix", help="Only the entries whose keys start with it.")
+def cachestats_command(provider, prefix):
+    """Describe the content of the cache via command line.
+
+    Only a cache shared between processes (see ``MINCER_CACHE_URL``) can be
+    inspected this way.
+    """
+    report = cache_report(provider_slug=provider, prefix=prefix)
+
+    for info in report["entries"]:
+        print("{size:>10} {age:>8} {expires:>8} {hits:>6}  {key}".format(
+            size=info["size"],
+            age="-" if info["age"] is None else int(info["age"]),
+            expires=int(info["expires"]),
+            hits="-" if info["hits"] is None else info["hits"],
+            key=info["key"]))
+
+    for slug, summary in sorted(report["providers"].items()):
+        print("*** {slug}: {entries} entries, {size} bytes, {hits} hits".format(
+            slug=slug, **summary))
+
+
+@app.cli.command('cachepurge')
+@click.option("--provider", help="Forget all the entries of this provider.")
+@click.option("--prefix", help="Forget all the entries whose keys start with it.")
+def cachepurge_command(provider, prefix):
+    """Forget some entries of the cache via command line.
+
+    Only a cache shared between processes (see ``MINCER_CACHE_URL``) can be
+    purged this way.
+    """
+    if provider is None and prefix is None:
+        print("*** Nothing purged: give a --provider or a --prefix.")
+        return
+
+    print("*** {purged} entries purged.".format(
+        purged=purge_cache(provider, prefix)))
+
+
 @app.errorhandler(sqlalchemy.exc.OperationalError)
 def handle_db_operational_error(err):
     # Improve the error message with revelent advice
     if "unable to open database file" in str(err)\
             or "no such table" in str(err):
         msg = "{err} - check if you initialized the database using mincer.init_db() function.".format(err=err)
+    elif "no such column" in str(err):
+        msg = "{err} - the database was created by an older version of Mincer, add the missing columns (see the upgrade section of the README) or initialize it again using mincer.init_db() function.".format(err=err)
     else:
         msg = str(err)
 
@@ -453,6 +988,47 @@ def admin():
         dependencies={e.name: e for e in Dependency.query.all()})
 
 
+@app.route("/admin/cache")
+def admin_cache():
+    """
+    Describe the content of the cache as a JSON document, see
+    :func:`cache_report`.
+
+    :query provider: only describe the entries of this provider.
+    :query prefix: only describe the entries whose keys start with it.
+
+    :status 200: everything was ok
+
+    .. :quickref: Admin; Inspect the cache
+    """
+    return jsonify(cache_report(
+        provider_slug=request.args.get("provider"),
+        prefix=request.args.get("prefix")))
+
+
+@app.route("/admin/cache/purge", methods=['POST'])
+def admin_cache_purge():
+    """
+    Forget some entries of the cache, see :func:`purge_cache`.
+
+    :form provider: forget all the entries of this provider.
+    :form prefix: forget all the entries whose keys start with it (an empty
+        prefix forgets everything).
+
+    :status 200: the number of forgotten entries as a JSON document
+    :status 400: when neither a provider nor a prefix is given
+
+    .. :quickref: Admin; Purge the cache
+    """
+    provider_slug = request.form.get("provider")
+    prefix = request.form.get("prefix")
+    if provider_slug is None and prefix is None:
+        app.logger.error("Cache purge requested without provider or prefix.")
+        return "", BAD_REQUEST
+
+    return jsonify({"purged": purge_cache(provider_slug, prefix)})
+
+
 @app.route("/status/<string:provider_slug>")
 def provider_status(provider_slug):
     # Retrieve the provider from database
@@ -493,8 +1069,20 @@ def provider():
         "no-result-selector",
         "no-result-content",
         })
+    OPTIONAL_PROVIDER_KEYS = frozenset({
+        "html-engine",
+        "param-normalizers",
+        "minify",
+        "selectors-to-remove",
+        "fallback-result-selectors",
+        "title-selector",
+        "author-selector",
+        "call-number-selector",
+        "link-selector",
+        "cover-selector",
+        })
     FORM_KEYS = frozenset([k for k in request.form.keys()])
-    if PROVIDER_KEYS != FORM_KEYS:
+    if not PROVIDER_KEYS <= FORM_KEYS <= PROVIDER_KEYS | OPTIONAL_PROVIDER_KEYS:
         app.logger.error(
             "Form data provided %s do not match"
             " form data expected %s.",
@@ -503,25 +1091,96 @@ def provider():
             )
         return "toto", BAD_REQUEST
 
+    html_engine = request.form.get("html-engine", "")
+    if html_engine and html_engine not in utils.ENGINES:
+        app.logger.error(
+            "Unknown HTML engine %s requested for a new provider.",
+            html_engine)
+        return "", BAD_REQUEST
+
+    param_normalizers = request.form.get("param-normalizers", "")
+    try:
+        utils.parse_normalizers(param_normalizers)
+    except utils.UnknownNormalizerError as e:
+        app.logger.error(
+            "Invalid normalizers requested for a new provider: %s", e)
+        return "", BAD_REQUEST
+
+    minify = request.form.get("minify", "")
+    if minify not in ("", "0", "1"):
+        app.logger.error(
+            "Invalid minify setting %s requested for a new provider.", minify)
+        return "", BAD_REQUEST
+
+    selectors_to_remove = request.form.get("selectors-to-remove", "")
+    if selectors_to_remove:
+        try:
+            utils.compile_selector(selectors_to_remove)
+        except utils.SelectorError as e:
+            app.logger.error(
+                "Invalid selectors to remove requested for a new provider: %s",
+                e)
+            return "", BAD_REQUEST
+
+    fallback_result_selectors = request.form.get(
+        "fallback-result-selectors", "")
+    try:
+        utils.parse_selectors(fallback_result_selectors)
+    except utils.SelectorError as e:
+        app.logger.error(
+            "Invalid fallback result selectors requested for a new provider: "
+            "%s", e)
+        return "", BAD_REQUEST
+
+    field_selectors = {}
+    for field in utils.RECORD_FIELDS:
+        selector = request.form.get(
+            field.replace("_", "-") + "-selector", "")
+        if selector:
+            try:
+                utils.compile_selector(selector)
+            except utils.SelectorError as e:
+                app.logger.error(
+                    "Invalid %s selector requested for a new provider: %s",
+                    field, e)
+                return "", BAD_REQUEST
+        field_selectors[field + "_selector"] = selector
+
     # TODO: check for errors
-    # TODO: check for existing provider with same name/slug
 
-    new_provider = Provider(
-        name=request.form["name"],
+    settings = dict(
         remote_url=request.form["remote-url"],
         result_selector=request.form["result-selector"],
         no_result_selector=request.form["no-result-selector"],
-        no_result_content=request.form["no-result-content"])
-
-    # Add them to the database
-    db.session.add(new_provider)
+        no_result_content=request.form["no-result-content"],
+        html_engine=html_engine,
+        param_normalizers=param_normalizers,
+        minify=minify == "1",
+        selectors_to_remove=selectors_to_remove,
+        fallback_result_selectors=fallback_result_selectors,
+        **field_selectors)
+
+    # A provider with the same slug is edited
+    new_provider = Provider.query.filter(
+        Provider.slug == slugify(request.form["name"])).first()
+    if new_provider:
+        for name, value in settings.items():
+            setattr(new_provider, name, value)
+        message = "Provider {name} updated successfully!"
+    else:
+        new_provider = Provider(name=request.form["name"], **settings)
+        # Add them to the database
+        db.session.add(new_provider)
+        message = "Provider {name} added successfully!"
 
     # Commit the transaction
     db.session.commit()
 
+    # The answers of the former settings are obsolete
+    purge_cache(provider_slug=new_provider.slug)
+
     # TODO: send a message and display a result page
-    flash("Provider {name} added successfully!".format(
-        name=new_provider.name), "alert-success")
+    flash(message.format(name=new_provider.name), "alert-success")
 
     return render_template(
         "provider.html",
@@ -592,6 +1251,9 @@ def remove(provider_slug):
         db.session.delete(prov)
         db.session.commit()
 
+        # Nobody can ask for its answers anymore
+        purge_cache(provider_slug=provider_slug)
+
         flash(
             "Provider {slug} removed successfully!".format(slug=provider_slug),
             "alert-success")
@@ -605,98 +1267,1557 @@ def remove(provider_slug):
     return redirect(url_for("home"))
 
 
-@app.route("/providers/<string:provider_slug>/<string:param>")
-@utils.add_response_headers({"Access-Control-Allow-Origin": "*"})
-def providers(provider_slug, param):
+def build_remote_url(provider, param):
+    """Build the url of the remote page of a provider for a given param.
+
+    Params:
+        provider (Provider): the provider to query.
+        param (str): parameter of the request as recieved by
+            :func:`providers`.
+
+    Returns:
+        str: the full remote url, the same for all the equivalent params (see
+        :func:`mincer.utils.normalize_param`).
     """
-    Retrieve a search result list from the KOHA server of the BULAC.
+    # param is weirdly semi encoded so it is decoded before being normalized
+    # and encoded again
+    return provider.remote_url.format(
+        param=quote_plus(utils.normalize_param(param, provider.normalizers)))
 
-    :query string provider_slug: slugified name of the provider as registered
-        in the database in the database.
-    :query string param: parameter of the request already url encoded
-        (meaning space and special char are replaced see `urllib
-        <https://docs.python.org/3.6/library/urllib.html>`_ for reference). It
-        could be a search query, an list id... all depend of the context. It
-        will be transfered to the final provider url registered in the
-        database.
 
-    :status 200: everything was ok
-    :status 404: when no `param` is provided
+def page_cache_key(provider, url):
+    """Key of a remote page in the cache.
 
-    .. :quickref: Search; Extract search results from the provider
+    Params:
+        provider (Provider): the provider the page comes from.
+        url (str): the full remote url.
+
+    Returns:
+        str: the key of the page.
     """
-    # Retrieve the provider from database
-    provider = Provider.query.filter(Provider.slug == provider_slug).first()
-    if not provider:
-        app.logger.error(
-            'Provider %s was asked for "%s" but this provider name '
-            'does not exist.',
-            provider_slug,
-            unquote_plus(param))
-        abort(NOT_FOUND)
+    return "page:{slug}:{url}".format(slug=provider.slug, url=url)
 
-    # Build the full remote url by replacing param
-    # HACK param is weirdly semi encoded so we need to unquote/requote it...
-    full_remote_url = provider.remote_url.format(param=quote_plus(unquote_plus(param)))
 
-    # Extract the base url from the full url
-    remote_host = utils.get_base_url(full_remote_url)
+def error_cache_key(provider, url):
+    """Key of the last failure of a remote page in the cache.
 
-    # Get the content of the page
-    # HACK: we force copy the accept-language from the recieved request
-    #       see: https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Accept-Language
-    page = requests.get(
-        full_remote_url,
-        headers={'accept-language': 'fr-FR'}).text
+    Params:
+        provider (Provider): the provider the page comes from.
+        url (str): the full remote url.
 
-    try:
-        # Search for an answer in the page
-        answer_divs = utils.extract_all_node_from_html(
-            selector=provider.result_selector,
-            html=page,
-            base_url=remote_host)
-        # Generate the result page and return it
-        result = div(_class=HtmlClasses.RESULT, id=provider.slug)
-        with result:
-            div(a(provider.name, href=full_remote_url), _class=HtmlClasses.PROVIDER)
-            for item in answer_divs:
-                div(raw(item), _class=HtmlClasses.RESULT_ITEM)
-        return Markup(result.render())
-    except utils.NoMatchError:
-        app.logger.info(
-            'Provider %s was asked for "%s" but no result structure could be '
-            'found in it\'s result page using matching expr "%s". '
-            'Now searching for a no result '
-            'structure...',
-            provider_slug,
-            unquote_plus(param),
-            provider.result_selector)
-        # app.logger.debug(page)
+    Returns:
+        str: the key of the failure.
+    """
+    return "error:{slug}:{url}".format(slug=provider.slug, url=url)
 
-    # TODO: test test the case where this fails for exemple if we have
-    #   a "loading page"
-    try:
-        # Search for a no answer message in the page
-        no_answer_div = utils.extract_content_from_html(
-            provider.no_result_selector,
-            provider.no_result_content,
-            page)
-        # Generate the result page and return it
-        result = div(_class=HtmlClasses.NO_RESULT, id=provider.slug)
-        with result:
-            div(a(provider.name, href=full_remote_url), _class=HtmlClasses.PROVIDER)
-            raw(no_answer_div)
-        return Markup(result.render())
-    except utils.NoMatchError as e:
-        # TODO: test this behavior
-        msg = 'Provider {prov} was asked for "{query}" but neither result structure nor '\
-              'a no result message could be found in it\'s result page. The '\
-              'remote url used was <{url}>.'.format(
-                prov=provider_slug,
-                query=unquote_plus(param),
-                url=full_remote_url)
-        app.logger.error(msg)
-        # raise e
-        # TODO: replace this with a valide answer
-        # abort(BAD_REQUEST)
-        return Markup(msg)
+
+"""Kinds of the entries of the cache, see :func:`provider_cache_prefixes`."""
+CACHE_KINDS = ("page", "error", "result", "records", "encoded")
+
+
+def provider_cache_prefixes(provider_slug):
+    """Prefixes of the keys of all the entries of a provider in the cache.
+
+    Params:
+        provider_slug (str): slugified name of the provider.
+
+    Returns:
+        list of str: the prefixes.
+
+    Examples:
+        >>> provider_cache_prefixes("koha-search")[:3]
+        ['page:koha-search:', 'error:koha-search:', 'result:koha-search:']
+    """
+    return ["{kind}:{slug}:".format(kind=kind, slug=provider_slug)
+            for kind in CACHE_KINDS]
+
+
+def cache_entry_provider(key):
+    """Slugified name of the provider of an entry of the cache.
+
+    Examples:
+        >>> cache_entry_provider("page:koha-search:http://koha.org/?q=hugo")
+        'koha-search'
+    """
+    return key.split(":", 2)[1]
+
+
+def purge_cache(provider_slug=None, prefix=None):
+    """Forget some entries of the cache.
+
+    Params:
+        provider_slug (str|None): forget all the entries of this provider.
+        prefix (str|None): forget all the entries whose keys start with it.
+
+    Returns:
+        int: the number of forgotten entries.
+    """
+    prefixes = []
+    if provider_slug is not None:
+        prefixes.extend(provider_cache_prefixes(provider_slug))
+    if prefix is not None:
+        prefixes.append(prefix)
+
+    purged = sum(get_cache().delete_prefix(p) for p in prefixes)
+    app.logger.info("%d entries purged from the cache (%s).",
+                    purged, ", ".join(prefixes))
+
+    return purged
+
+
+def cache_hit_rates():
+    """Hit rates of the remote pages in the cache.
+
+    Returns:
+        tuple(dict of str to float|None, float|None): the hit rate of each
+        provider and the hit rate of all of them, ``None`` if no page was
+        asked yet (the other tiers of the cache may have been used though).
+    """
+    counters = metrics.snapshot().get("cache", {})
+
+    hit_rates = {}
+    for slug, counter in counters.items():
+        hits = counter.get("hit", 0)
+        misses = counter.get("miss", 0)
+        hit_rates[slug] = hits / (hits + misses) if hits + misses else None
+
+    hits = sum(counter.get("hit", 0) for counter in counters.values())
+    misses = sum(counter.get("miss", 0) for counter in counters.values())
+    hit_rate = hits / (hits + misses) if hits + misses else None
+
+    return hit_rates, hit_rate
+
+
+def cache_report(provider_slug=None, prefix=None):
+    """Describe the content of the cache.
+
+    Params:
+        provider_slug (str|None): only describe the entries of this provider.
+        prefix (str|None): only describe the entries whose keys start with
+            it.
+
+    Returns:
+        dict: the aggregate ``hit_rate``, a summary of the entries of each
+        provider (number of ``entries``, total ``size`` and ``hits``, and
+        ``hit_rate``) and the details of the ``entries`` (see
+        :meth:`mincer.cache.CacheBackend.info`).
+    """
+    cache = get_cache()
+
+    prefixes = [""]
+    if provider_slug is not None:
+        prefixes = provider_cache_prefixes(provider_slug)
+
+    entries = []
+    for key in sorted(key for p in prefixes for key in cache.keys(p)):
+        if prefix and not key.startswith(prefix):
+            continue
+        info = cache.info(key)
+        # The entry may have expired in the meantime
+        if info is not None:
+            entries.append(info)
+
+    hit_rates, hit_rate = cache_hit_rates()
+    providers = {}
+    for info in entries:
+        slug = cache_entry_provider(info["key"])
+        summary = providers.setdefault(slug, {
+            "entries": 0,
+            "size": 0,
+            "hits": 0,
+            "hit_rate": hit_rates.get(slug),
+            })
+        summary["entries"] += 1
+        summary["size"] += info["size"]
+        summary["hits"] += info["hits"] or 0
+
+    return {"hit_rate": hit_rate, "providers": providers, "entries": entries}
+
+
+def page_hash(page):
+    """Fingerprint of the content of a remote page.
+
+    Params:
+        page (str): the content of the page.
+
+    Returns:
+        str: the fingerprint, the same for identical pages.
+
+    Examples:
+        >>> page_hash("<p>hip</p>") == page_hash("<p>hip</p>")
+        True
+        >>> page_hash("<p>hip</p>") == page_hash("<p>hop</p>")
+        False
+    """
+    return hashlib.blake2b(page.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def result_cache_key(provider, page, offset=0, limit=None):
+    """Key of the answer extracted from a remote page in the cache.
+
+    It depends on the content of the page and on the selectors of the
+    provider, not on the url of the page: a page reached through several
+    params is analysed only once and a change of selectors does not need to
+    fetch the page again.
+
+    Params:
+        provider (Provider): the provider the page comes from.
+        page (str): the content of the page.
+        offset (int): number of results skipped, see :func:`parse_window`.
+        limit (int|None): maximum number of results of the answer.
+
+    Returns:
+        str: the key of the answer, the one of a window of the results
+        differs from the one of all the results.
+    """
+    key = "result:{slug}:{version}:{hash}".format(
+        slug=provider.slug,
+        version=provider.selectors_version,
+        hash=page_hash(page))
+    if offset or limit is not None:
+        key += ":{offset}:{limit}".format(offset=offset, limit=limit)
+
+    return key
+
+
+def records_cache_key(provider, page):
+    """Key of the records extracted from a remote page in the cache.
+
+    Like :func:`result_cache_key` it depends on the content of the page and
+    on the selectors of the provider.
+
+    Params:
+        provider (Provider): the provider the page comes from.
+        page (str): the content of the page.
+
+    Returns:
+        str: the key of the records.
+    """
+    return "records:{slug}:{version}:{hash}".format(
+        slug=provider.slug,
+        version=provider.selectors_version,
+        hash=page_hash(page))
+
+
+def encoded_cache_key(provider_slug, encoding, body):
+    """Key of a compressed answer of a provider in the cache.
+
+    Params:
+        provider_slug (str): slugified name of the provider.
+        encoding (str): the content coding of the answer.
+        body (bytes): the uncompressed answer.
+
+    Returns:
+        str: the key of the compressed answer.
+    """
+    return "encoded:{slug}:{encoding}:{hash}".format(
+        slug=provider_slug,
+        encoding=encoding,
+        hash=hashlib.blake2b(body, digest_size=16).hexdigest())
+
+
+def encode_answer(body, encoding, provider_slug=None):
+    """Compress an answer.
+
+    The compressed answers of the providers are kept in cache, so a big
+    fragment served many times is compressed only once.
+
+    Params:
+        body (bytes): the uncompressed answer.
+        encoding (str): one of :data:`mincer.utils.ENCODINGS`.
+        provider_slug (str|None): slugified name of the provider the answer
+            comes from, if any.
+
+    Returns:
+        bytes: the compressed answer.
+    """
+    if provider_slug is None:
+        return utils.compress(body, encoding)
+
+    key = encoded_cache_key(provider_slug, encoding, body)
+    encoded = get_cache().get(key)
+    if encoded is not None:
+        return base64.b64decode(encoded)
+
+    data = utils.compress(body, encoding)
+    get_cache().set(key, base64.b64encode(data).decode("ascii"))
+
+    return data
+
+
+def outcome_ttl(outcome):
+    """Number of seconds an answer is kept in cache.
+
+    Params:
+        outcome (str): the :class:`mincer.metrics.Outcome` of the answer.
+
+    Returns:
+        float: ``MINCER_CACHE_TTL`` for results, ``MINCER_CACHE_NO_RESULT_TTL``
+        for no results and ``MINCER_CACHE_ERROR_TTL`` for failures.
+    """
+    if outcome == Outcome.RESULT:
+        return app.config["MINCER_CACHE_TTL"]
+    if outcome == Outcome.NO_RESULT:
+        return app.config["MINCER_CACHE_NO_RESULT_TTL"]
+    return app.config["MINCER_CACHE_ERROR_TTL"]
+
+
+def cached_page(provider, url):
+    """Retrieve a remote page from the cache.
+
+    Params:
+        provider (Provider): the provider the page comes from.
+        url (str): the full remote url.
+
+    Returns:
+        str: the content of the page or ``None`` if it is not in cache.
+
+    Raises:
+        mincer.remote.RemoteError: the page failed recently.
+    """
+    page = get_cache().get(page_cache_key(provider, url))
+    if page is not None:
+        metrics.incr("cache", provider.slug, "hit")
+        return page
+
+    metrics.incr("cache", provider.slug, "miss")
+    if get_cache().get(error_cache_key(provider, url)) is not None:
+        metrics.incr("cache", provider.slug, "error_hit")
+        raise remote.RemoteError(
+            "The remote page {url} failed recently.".format(url=url))
+
+    return None
+
+
+def cache_page(provider, url, page):
+    """Keep a remote page in the cache for ``MINCER_CACHE_TTL`` seconds.
+
+    Params:
+        provider (Provider): the provider the page comes from.
+        url (str): the full remote url.
+        page (str): the content of the page.
+    """
+    get_cache().set(page_cache_key(provider, url), page)
+
+
+def cache_error(provider, url, outcome):
+    """Keep the failure of a remote page in the cache for
+    ``MINCER_CACHE_ERROR_TTL`` seconds.
+
+    Params:
+        provider (Provider): the provider the page comes from.
+        url (str): the full remote url.
+        outcome (str): the :class:`mincer.metrics.Outcome` of the failure.
+    """
+    get_cache().set(
+        error_cache_key(provider, url),
+        outcome,
+        app.config["MINCER_CACHE_ERROR_TTL"])
+
+
+def ask_owner(provider, url, deadline=None):
+    """Ask the instance of Mincer owning a remote page for its content.
+
+    Params:
+        provider (Provider): the provider the page comes from.
+        url (str): the full remote url.
+        deadline (mincer.remote.Deadline|None): the deadline of the request.
+
+    Returns:
+        str: the content of the page, ``None`` if this instance owns the page
+        or if its owner did not answer.
+
+    Raises:
+        mincer.remote.BulkheadFullError: the remote host was too busy for the
+            owner.
+        mincer.remote.RemoteError: the owner could not retrieve the page.
+    """
+    group = get_peer_group()
+    if group is None:
+        return None
+    owner = group.owner(page_cache_key(provider, url))
+    if owner is None:
+        return None
+
+    peer_url = "{owner}/peers/{slug}/page?url={url}".format(
+        owner=owner, slug=provider.slug, url=quote_plus(url))
+    deadline = remote.Deadline(app.config["MINCER_REMOTE_TIMEOUT"]).earliest(
+        deadline)
+    try:
+        page = group.fetch(
+            peer_url,
+            {DEADLINE_HEADER: str(deadline.remaining())},
+            deadline)
+    except peers.PeerUnavailableError as e:
+        app.logger.warning(
+            "The owner of %s is unavailable, the page is fetched "
+            "directly: %s", url, e)
+        return None
+
+    metrics.incr("cache", provider.slug, "peer_hit")
+
+    return page
+
+
+def fetch_remote_page(provider, url, deadline=None, from_owner=True):
+    """Get the content of a remote page from its owner in the group of
+    instances (see :func:`ask_owner`) or from the remote host, and keep it in
+    the cache.
+
+    Params and errors: see :func:`fetch_page`.
+    """
+    # Another thread may have just fetched it
+    page = get_cache().get(page_cache_key(provider, url))
+    if page is not None:
+        return page
+
+    try:
+        if from_owner:
+            page = ask_owner(provider, url, deadline)
+        if page is None:
+            page = get_fetcher().fetch(
+                url, key=provider.slug, deadline=deadline)
+    except remote.DeadlineExceededError:
+        # The client was in a hurry, the remote page may be fine
+        raise
+    except remote.RemoteError:
+        cache_error(provider, url, Outcome.REMOTE_ERROR)
+        raise
+
+    cache_page(provider, url, page)
+
+    return page
+
+
+# Remote pages being fetched by key of the cache, see fetch_page()
+fetches = peers.SingleFlight()
+
+
+def fetch_page(provider, url, deadline=None, from_owner=True):
+    """Get the content of a remote page, from the cache if possible.
+
+    Concurrent requests of the same page only fetch it once, within their
+    own deadlines (see :meth:`mincer.peers.SingleFlight.do`).
+
+    Params:
+        provider (Provider): the provider the page comes from.
+        url (str): the full remote url.
+        deadline (mincer.remote.Deadline|None): the deadline of the request.
+        from_owner (bool): if ``False`` the page is never asked to another
+            instance of Mincer.
+
+    Returns:
+        str: the content of the page.
+
+    Raises:
+        mincer.remote.BulkheadFullError: the remote host already has all the
+            concurrent requests it is allowed.
+        mincer.remote.RemoteError: the page could not be retrieved even after
+            some retries, or it already failed recently.
+    """
+    page = cached_page(provider, url)
+    if page is not None:
+        return page
+
+    return fetches.do(
+        page_cache_key(provider, url),
+        fetch_remote_page, provider, url, deadline, from_owner,
+        deadline=deadline)
+
+
+def render_item(item):
+    """Render a result of a provider.
+
+    Params:
+        item (str): the HTML node of the result.
+
+    Returns:
+        str: the rendered result.
+    """
+    return div(raw(item), _class=HtmlClasses.RESULT_ITEM).render(pretty=False)
+
+
+def ordered_result_selectors(provider, page):
+    """Result selectors of a provider worth trying on a remote page.
+
+    The selectors that can not match anything in the raw page are left out
+    (see :func:`mincer.utils.may_match`) and the other ones are sorted by
+    decreasing number of past matches, so the selector of the current theme
+    of the provider is tried first.
+
+    Params:
+        provider (Provider): the provider the page comes from.
+        page (str): the content of the page.
+
+    Returns:
+        tuple(str): the selectors, in the order they are tried.
+    """
+    selectors = [selector for selector in provider.result_selectors
+                 if utils.may_match(selector, page)]
+    selectors.sort(
+        key=lambda selector: -metrics.get("selector", provider.slug, selector))
+
+    return tuple(selectors)
+
+
+def count_selector_match(provider, selectors, index):
+    """Count the match of a result selector of a provider.
+
+    The selectors tried before it for nothing are counted too, as
+    ``selector_misses``.
+
+    Params:
+        provider (Provider): the provider the selectors belong to.
+        selectors (tuple(str)): the selectors, in the order they were tried.
+        index (int): the index of the matching selector.
+    """
+    metrics.incr("selector", provider.slug, selectors[index])
+    if index:
+        metrics.incr("selector_misses", provider.slug, amount=index)
+
+
+def match_results(provider, page, extract):
+    """Extract the results of a provider from a remote page with the first of
+    its result selectors matching something.
+
+    The selectors are tried in the order of :func:`ordered_result_selectors`
+    and the match is counted by :func:`count_selector_match`.
+
+    Params:
+        provider (Provider): the provider the page comes from.
+        page (str): the content of the page.
+        extract (callable): extracts the results from the page with a tuple
+            of selectors tried in order. It gives the index of the matching
+            selector and the results, or raises
+            :class:`mincer.utils.NoMatchError`.
+
+    Returns:
+        list|None: the results, ``None`` if no selector matched anything.
+    """
+    # A quick look at the raw page avoids parsing it when the result
+    # structure can not possibly be in it
+    selectors = ordered_result_selectors(provider, page)
+    if not selectors:
+        return None
+
+    try:
+        index, results = extract(selectors)
+    except utils.NoMatchError:
+        return None
+
+    count_selector_match(provider, selectors, index)
+    return results
+
+
+def extract_page(provider, param, full_remote_url, page, offset=0,
+                 limit=None):
+    """Extract the answer of a provider from a remote page.
+
+    Params:
+        provider (Provider): the provider the page comes from.
+        param (str): parameter of the request as recieved by
+            :func:`providers`.
+        full_remote_url (str): the url of the page.
+        page (str): the content of the page.
+        offset (int): number of results skipped, see :func:`parse_window`.
+        limit (int|None): maximum number of results extracted, the other
+            ones are not even serialized.
+
+    Returns:
+        tuple(str, str|list(str)): the :class:`mincer.metrics.Outcome` of the
+        answer and its HTML content: the list of the rendered results, the no
+        result message or an error message.
+    """
+    # Extract the base url from the full url
+    remote_host = utils.get_base_url(full_remote_url)
+
+    # Search for an answer in the page
+    pool = get_extraction_pool()
+    answer_divs = match_results(
+        provider,
+        page,
+        lambda selectors: pool.extract_first_nodes_from_html(
+            selectors=selectors,
+            html=page,
+            base_url=remote_host,
+            engine=provider.engine,
+            minify=provider.minify,
+            selectors_to_remove=provider.selectors_to_remove,
+            offset=offset,
+            limit=limit))
+    if answer_divs is not None:
+        return Outcome.RESULT, [render_item(item) for item in answer_divs]
+
+    return extract_no_result(provider, param, full_remote_url, page)
+
+
+def extract_no_result(provider, param, full_remote_url, page):
+    """Extract the answer of a provider from a remote page where no result
+    structure was found.
+
+    See :func:`extract_page`.
+    """
+    app.logger.info(
+        'Provider %s was asked for "%s" but no result structure could be '
+        'found in it\'s result page using matching expr "%s". '
+        'Now searching for a no result '
+        'structure...',
+        provider.slug,
+        unquote_plus(param),
+        provider.result_selector)
+    # app.logger.debug(page)
+
+    # TODO: test test the case where this fails for exemple if we have
+    #   a "loading page"
+    try:
+        # Search for a no answer message in the page, without parsing it if
+        # the raw page is explicit enough
+        if all(utils.is_no_result_page(
+                page,
+                result_selector,
+                provider.no_result_selector,
+                provider.no_result_content)
+               for result_selector in provider.result_selectors):
+            no_answer_div = "<div>{content}</div>".format(
+                content=provider.no_result_content)
+        else:
+            no_answer_div = utils.extract_content_from_html(
+                provider.no_result_selector,
+                provider.no_result_content,
+                page,
+                engine=provider.engine)
+        return Outcome.NO_RESULT, no_answer_div
+    except utils.NoMatchError as e:
+        # TODO: test this behavior
+        msg = 'Provider {prov} was asked for "{query}" but neither result structure nor '\
+              'a no result message could be found in it\'s result page. The '\
+              'remote url used was <{url}>.'.format(
+                prov=provider.slug,
+                query=unquote_plus(param),
+                url=full_remote_url)
+        app.logger.error(msg)
+        # raise e
+        # TODO: replace this with a valide answer
+        # abort(BAD_REQUEST)
+        return Outcome.UNPARSABLE, msg
+
+
+def cache_extraction(provider, full_remote_url, page, outcome, content,
+                     offset=0, limit=None):
+    """Keep the answer extracted from a remote page in the cache.
+
+    The page itself is not kept longer than its answer.
+
+    Params:
+        provider (Provider): the provider the page comes from.
+        full_remote_url (str): the url of the page.
+        page (str): the content of the page.
+        outcome (str): the :class:`mincer.metrics.Outcome` of the answer.
+        content (str|list(str)): the HTML content of the answer, see
+            :func:`extract_page`.
+        offset (int): number of results skipped in the answer.
+        limit (int|None): maximum number of results of the answer.
+    """
+    ttl = outcome_ttl(outcome)
+    # An answer without result is the same for every window
+    if outcome != Outcome.RESULT:
+        offset, limit = 0, None
+    get_cache().set(
+        result_cache_key(provider, page, offset, limit), (outcome, content), ttl)
+    if outcome != Outcome.RESULT:
+        get_cache().set(page_cache_key(provider, full_remote_url), page, ttl)
+
+
+def cached_extraction(provider, page, offset=0, limit=None):
+    """Retrieve the answer extracted from a remote page from the cache.
+
+    A window of the results is taken from all the results when they are in
+    cache, otherwise from the same window extracted before.
+
+    Params:
+        provider (Provider): the provider the page comes from.
+        page (str): the content of the page.
+        offset (int): number of results skipped, see :func:`parse_window`.
+        limit (int|None): maximum number of results of the answer.
+
+    Returns:
+        tuple(str, str|list(str)): the outcome and the content of the answer
+        (see :func:`extract_page`) or ``None`` if it is not in cache.
+    """
+    extraction = get_cache().get(result_cache_key(provider, page))
+    if extraction is not None:
+        outcome, content = extraction
+        if outcome == Outcome.RESULT:
+            extraction = outcome, utils.window(content, offset, limit)
+    elif offset or limit is not None:
+        extraction = get_cache().get(
+            result_cache_key(provider, page, offset, limit))
+
+    if extraction is None:
+        metrics.incr("cache", provider.slug, "result_miss")
+        return None
+
+    metrics.incr("cache", provider.slug, "result_hit")
+    return tuple(extraction)
+
+
+def extract_records(provider, param, full_remote_url, page):
+    """Extract the records of the results of a provider from a remote page.
+
+    Params:
+        provider (Provider): the provider the page comes from.
+        param (str): parameter of the request as recieved by
+            :func:`providers`.
+        full_remote_url (str): the url of the page.
+        page (str): the content of the page.
+
+    Returns:
+        tuple(str, list(mincer.utils.Record)): the
+        :class:`mincer.metrics.Outcome` of the answer and its records, none
+        when there is no result.
+    """
+    records = match_results(
+        provider,
+        page,
+        lambda selectors: utils.extract_first_records_from_html(
+            selectors=selectors,
+            html=page,
+            field_selectors=provider.field_selectors,
+            base_url=utils.get_base_url(full_remote_url),
+            engine=provider.engine))
+    if records is not None:
+        return Outcome.RESULT, records
+
+    outcome, _ = extract_no_result(provider, param, full_remote_url, page)
+    return outcome, []
+
+
+def page_records(provider, param, full_remote_url, page):
+    """Give the records of the results of a provider in a remote page.
+
+    The records are kept in cache as lists of values, see
+    :meth:`mincer.utils.Record.values`.
+
+    Params: see :func:`extract_records`.
+
+    Returns:
+        tuple(str, list(mincer.utils.Record)): see :func:`extract_records`.
+    """
+    key = records_cache_key(provider, page)
+    cached = get_cache().get(key)
+    if cached is not None:
+        metrics.incr("cache", provider.slug, "records_hit")
+        outcome, values = cached
+        return outcome, [utils.Record.from_values(v) for v in values]
+
+    metrics.incr("cache", provider.slug, "records_miss")
+    outcome, records = extract_records(provider, param, full_remote_url, page)
+    get_cache().set(
+        key,
+        (outcome, [record.values() for record in records]),
+        outcome_ttl(outcome))
+    if outcome != Outcome.RESULT:
+        get_cache().set(
+            page_cache_key(provider, full_remote_url),
+            page,
+            outcome_ttl(outcome))
+
+    return outcome, records
+
+
+def answer_opening(cls, provider, full_remote_url):
+    """Render the beginning of the answer of a provider.
+
+    Params:
+        cls (str): the HTML class of the answer (see :class:`HtmlClasses`).
+        provider (Provider): the provider queried.
+        full_remote_url (str): the url of the page.
+
+    Returns:
+        Markup: the opening tag of the answer and the provider.
+    """
+    return Markup('<div class="{cls}" id="{id}">').format(
+        cls=cls, id=provider.slug) + Markup(div(
+            a(provider.name, href=full_remote_url),
+            _class=HtmlClasses.PROVIDER).render(pretty=False))
+
+
+def render_answer(provider, full_remote_url, outcome, content):
+    """Render the answer of a provider as an HTML fragment.
+
+    Params:
+        provider (Provider): the provider queried.
+        full_remote_url (str): the url of the page.
+        outcome (str): the :class:`mincer.metrics.Outcome` of the answer.
+        content (str|list(str)): the HTML content of the answer, see
+            :func:`extract_page`.
+
+    Returns:
+        Markup: the rendered fragment.
+    """
+    if isinstance(content, list):
+        content = "".join(content)
+
+    if outcome == Outcome.UNPARSABLE:
+        return Markup(content)
+
+    cls = HtmlClasses.RESULT if outcome == Outcome.RESULT\
+        else HtmlClasses.NO_RESULT
+    return answer_opening(cls, provider, full_remote_url)\
+        + Markup(content) + Markup("</div>")
+
+
+def render_page(provider, param, full_remote_url, page, offset=0, limit=None):
+    """Extract the results of a remote page and render them as an HTML
+    fragment.
+
+    This is where all the CPU-bound work of :func:`providers` is done, so it
+    can be run in an executor by the asynchronous pipeline too (see
+    :mod:`mincer.asgi`). The extracted answer is kept in cache, see
+    :func:`result_cache_key`.
+
+    Params:
+        provider (Provider): the provider the page comes from.
+        param (str): parameter of the request as recieved by
+            :func:`providers`.
+        full_remote_url (str): the url of the page.
+        page (str): the content of the page.
+        offset (int): number of results skipped, see :func:`parse_window`.
+        limit (int|None): maximum number of results rendered.
+
+    Returns:
+        Markup: the rendered fragment.
+    """
+    extraction = cached_extraction(provider, page, offset, limit)
+    if extraction is None:
+        extraction = extract_page(
+            provider, param, full_remote_url, page, offset, limit)
+        cache_extraction(
+            provider, full_remote_url, page, *extraction, offset, limit)
+
+    outcome, content = extraction
+    metrics.incr("outcome", provider.slug, outcome)
+
+    return render_answer(provider, full_remote_url, outcome, content)
+
+
+def stream_page(provider, param, full_remote_url, page, offset=0, limit=None):
+    """Same as :func:`render_page` but the results are rendered one by one
+    while the answer is sent.
+
+    The page is parsed and searched right away, only the serialization of
+    the results is done on the fly. The extraction processes are never used
+    since the results can not be streamed from another process.
+
+    Returns:
+        iterator(str): the pieces of the rendered fragment.
+    """
+    extraction = cached_extraction(provider, page, offset, limit)
+    selectors = ordered_result_selectors(provider, page)\
+        if extraction is None else ()
+
+    if selectors:
+        try:
+            index, items = utils.iter_first_nodes_from_html(
+                selectors=selectors,
+                html=page,
+                base_url=utils.get_base_url(full_remote_url),
+                engine=provider.engine,
+                minify=provider.minify,
+                selectors_to_remove=provider.selectors_to_remove,
+                offset=offset,
+                limit=limit)
+        except utils.NoMatchError:
+            pass
+        else:
+            count_selector_match(provider, selectors, index)
+            metrics.incr("outcome", provider.slug, Outcome.RESULT)
+            return stream_result(
+                provider, full_remote_url, page, items, offset, limit)
+
+    if extraction is None:
+        extraction = extract_no_result(provider, param, full_remote_url, page)
+        cache_extraction(provider, full_remote_url, page, *extraction)
+
+    outcome, content = extraction
+    metrics.incr("outcome", provider.slug, outcome)
+
+    return iter([render_answer(provider, full_remote_url, outcome, content)])
+
+
+def stream_result(provider, full_remote_url, page, items, offset=0,
+                  limit=None):
+    """Generate the answer of a provider around its results.
+
+    The results are kept in cache once they are all generated.
+
+    Params:
+        provider (Provider): the provider the results come from.
+        full_remote_url (str): the url of the page.
+        page (str): the content of the page.
+        items (iterator(str)): the results.
+        offset (int): number of results skipped before the first one.
+        limit (int|None): maximum number of results.
+
+    Yields:
+        str: the opening tag of the answer with the provider, each result and
+        the closing tag.
+    """
+    yield answer_opening(HtmlClasses.RESULT, provider, full_remote_url)
+
+    pieces = []
+    for item in items:
+        piece = render_item(item)
+        pieces.append(piece)
+        yield piece
+
+    yield "</div>"
+
+    cache_extraction(
+        provider, full_remote_url, page, Outcome.RESULT, pieces, offset, limit)
+
+
+def deadline_exceeded(provider_slug, param):
+    """Give up a request to a provider because its deadline is over.
+
+    Params:
+        provider_slug (str): slugified name of the provider.
+        param (str): parameter of the request.
+    """
+    app.logger.error(
+        'Provider %s was asked for "%s" but the deadline of the request was '
+        'over before the answer was ready.',
+        provider_slug,
+        unquote_plus(param))
+    metrics.incr("outcome", provider_slug, Outcome.DEADLINE_EXCEEDED)
+    abort(GATEWAY_TIMEOUT)
+
+
+@app.route("/providers/<string:provider_slug>/<string:param>")
+@utils.add_response_headers({"Access-Control-Allow-Origin": "*"})
+def providers(provider_slug, param):
+    """
+    Retrieve a search result list from the KOHA server of the BULAC.
+
+    :query string provider_slug: slugified name of the provider as registered
+        in the database in the database.
+    :query string param: parameter of the request already url encoded
+        (meaning space and special char are replaced see `urllib
+        <https://docs.python.org/3.6/library/urllib.html>`_ for reference). It
+        could be a search query, an list id... all depend of the context. It
+        will be transfered to the final provider url registered in the
+        database.
+    :query deadline: optional number of seconds the client is ready to wait
+        for the answer (``MINCER_DEADLINE`` by default).
+    :query stream: if not empty, the results are sent one by one while they
+        are rendered (useful for very big booklists).
+    :query limit: optional maximum number of results given (useful for small
+        widgets over big booklists).
+    :query offset: optional number of results skipped (0 by default).
+
+    :reqheader X-Mincer-Deadline: same as the ``deadline`` query parameter.
+
+    :status 200: everything was ok
+    :status 400: when the deadline is not a positive number of seconds or
+        the limit or offset is not a positive integer
+    :status 404: when no `param` is provided
+    :status 502: when the remote page could not be retrieved
+    :status 503: when the remote host is already too busy with other
+        requests
+    :status 504: when the deadline was over before the answer was ready
+
+    .. :quickref: Search; Extract search results from the provider
+    """
+    offset, limit = request_window()
+
+    provider = requested_provider(provider_slug, param)
+    full_remote_url, page = provider_page(provider, param)
+
+    # Big booklists are sent while their results are rendered
+    if request.args.get(STREAM_PARAM):
+        return Response(
+            stream_page(
+                provider, param, full_remote_url, page, offset, limit),
+            mimetype="text/html")
+
+    return render_page(provider, param, full_remote_url, page, offset, limit)
+
+
+@app.route("/providers/<string:provider_slug>/<string:param>/records")
+@utils.add_response_headers({"Access-Control-Allow-Origin": "*"})
+def provider_records(provider_slug, param):
+    """
+    Extract the results of a provider as structured records.
+
+    Each result is reduced to the fields the provider has a selector for
+    (``title``, ``author``, ``call_number``, ``link`` and ``cover``), missing
+    fields are left out of the records::
+
+        {"outcome": "result",
+         "records": [{"title": "...", "link": "http://..."}, ...]}
+
+    The parameters are the same as the ones of :func:`providers`, except
+    ``stream`` which is not supported.
+
+    :status 200: everything was ok
+    :status 400: when the deadline is not a positive number of seconds or
+        the limit or offset is not a positive integer
+    :status 404: when the provider does not exist or has no field selector
+    :status 502: when the remote page could not be retrieved
+    :status 503: when the remote host is already too busy with other
+        requests
+    :status 504: when the deadline was over before the answer was ready
+
+    .. :quickref: Search; Extract records from the provider
+    """
+    offset, limit = request_window()
+
+    provider = requested_provider(provider_slug, param)
+    # The remote page is not even fetched for nothing
+    if not provider.field_selectors:
+        app.logger.error(
+            'Provider %s was asked for the records of "%s" but it has no '
+            'field selector.',
+            provider_slug,
+            unquote_plus(param))
+        abort(NOT_FOUND)
+
+    full_remote_url, page = provider_page(provider, param)
+
+    outcome, records = page_records(provider, param, full_remote_url, page)
+    metrics.incr("outcome", provider.slug, outcome)
+
+    return jsonify({
+        "outcome": outcome,
+        "records": [record.to_dict()
+                    for record in utils.window(records, offset, limit)]})
+
+
+def request_window():
+    """The window of the results the client of the current request is
+    interested in, see :func:`parse_window`.
+
+    An invalid window aborts the request.
+
+    Returns:
+        tuple(int, int|None): the offset and the limit of the window.
+    """
+    try:
+        return parse_window(
+            request.args.get(LIMIT_PARAM),
+            request.args.get(OFFSET_PARAM))
+    except ValueError as e:
+        app.logger.error('Invalid window: %s', e)
+        abort(BAD_REQUEST)
+
+
+def requested_provider(provider_slug, param):
+    """Retrieve the provider the current request is about.
+
+    An unknown provider aborts the request.
+
+    Params:
+        provider_slug (str): slugified name of the provider.
+        param (str): parameter of the request.
+
+    Returns:
+        Provider: the provider.
+    """
+    provider = Provider.query.filter(Provider.slug == provider_slug).first()
+    if not provider:
+        app.logger.error(
+            'Provider %s was asked for "%s" but this provider name '
+            'does not exist.',
+            provider_slug,
+            unquote_plus(param))
+        abort(NOT_FOUND)
+
+    return provider
+
+
+def provider_page(provider, param):
+    """Retrieve the remote page the current request to a provider is about.
+
+    Any failure aborts the request, see :func:`providers`.
+
+    Params:
+        provider (Provider): the provider.
+        param (str): parameter of the request.
+
+    Returns:
+        tuple(str, str): the full remote url and the content of the page.
+    """
+    provider_slug = provider.slug
+
+    # The time left to answer the client
+    try:
+        deadline = parse_deadline(
+            request.headers.get(DEADLINE_HEADER),
+            request.args.get(DEADLINE_PARAM))
+    except ValueError as e:
+        app.logger.error('Invalid deadline: %s', e)
+        abort(BAD_REQUEST)
+
+    # Build the full remote url by replacing param
+    full_remote_url = build_remote_url(provider, param)
+
+    # Get the content of the page
+    try:
+        page = fetch_page(provider, full_remote_url, deadline)
+    except remote.BulkheadFullError as e:
+        app.logger.error(
+            'Provider %s was asked for "%s" but its remote host is busy: %s',
+            provider_slug,
+            unquote_plus(param),
+            e)
+        metrics.incr("outcome", provider_slug, Outcome.BUSY)
+        abort(SERVICE_UNAVAILABLE)
+    except remote.RemoteError as e:
+        if deadline.expired():
+            deadline_exceeded(provider_slug, param)
+        app.logger.error(
+            'Provider %s was asked for "%s" but its remote page could not be '
+            'retrieved: %s',
+            provider_slug,
+            unquote_plus(param),
+            e)
+        metrics.incr("outcome", provider_slug, Outcome.REMOTE_ERROR)
+        abort(BAD_GATEWAY)
+
+    # Nobody is waiting for the results anymore
+    if deadline.expired():
+        deadline_exceeded(provider_slug, param)
+
+    return full_remote_url, page
+
+
+def is_provider_url(provider, url):
+    """Tell if a remote url was built from the remote url of a provider.
+
+    Params:
+        provider (Provider): a provider.
+        url (str): a full remote url.
+
+    Returns:
+        bool: ``True`` if ``url`` is a page of the provider.
+    """
+    prefix, _, suffix = provider.remote_url.partition("{param}")
+
+    return len(url) >= len(prefix) + len(suffix) \
+        and url.startswith(prefix) and url.endswith(suffix)
+
+
+@app.route("/peers/<string:provider_slug>/page")
+def peer_page(provider_slug):
+    """
+    Retrieve a remote page for another instance of Mincer (see
+    ``MINCER_PEERS``), from the cache if possible.
+
+    :query string provider_slug: slugified name of the provider as registered
+        in the database.
+    :query url: the full remote url of the page.
+
+    :reqheader X-Mincer-Deadline: number of seconds the other instance is
+        ready to wait for the page.
+
+    :status 200: the raw content of the page
+    :status 400: when the deadline is not a positive number of seconds
+    :status 404: when the provider or its page does not exist
+    :status 502: when the remote page could not be retrieved
+    :status 503: when the remote host is already too busy with other
+        requests
+    :status 504: when the deadline was over before the page was retrieved
+
+    .. :quickref: Peers; Retrieve a remote page for another instance
+    """
+    try:
+        deadline = parse_deadline(request.headers.get(DEADLINE_HEADER), None)
+    except ValueError as e:
+        app.logger.error('Invalid deadline: %s', e)
+        abort(BAD_REQUEST)
+
+    url = request.args.get("url", "")
+    provider = Provider.query.filter(Provider.slug == provider_slug).first()
+    if not provider or not is_provider_url(provider, url):
+        app.logger.error(
+            'Provider %s was asked for the page %s by another instance but '
+            'this page does not exist.',
+            provider_slug,
+            url)
+        abort(NOT_FOUND)
+
+    # This instance is the owner, it never asks another one
+    try:
+        page = fetch_page(provider, url, deadline, from_owner=False)
+    except remote.BulkheadFullError:
+        abort(SERVICE_UNAVAILABLE)
+    except remote.RemoteError:
+        abort(GATEWAY_TIMEOUT if deadline.expired() else BAD_GATEWAY)
+
+    return Response(page, mimetype="text/plain")
+
+
+"""Types of the answers that are compressed, see :func:`compress_response`."""
+COMPRESSED_MIMETYPES = frozenset({"text/html", "application/json"})
+
+
+@app.after_request
+def compress_response(response):
+    """Compress the HTML and JSON answers for the clients accepting it.
+
+    Streamed answers are sent as they are.
+
+    Params:
+        response (flask.Response): the answer.
+
+    Returns:
+        flask.Response: the answer, compressed if possible.
+    """
+    if response.status_code != OK \
+            or response.is_streamed \
+            or response.mimetype not in COMPRESSED_MIMETYPES \
+            or "Content-Encoding" in response.headers:
+        return response
+
+    response.vary.add("Accept-Encoding")
+
+    encoding = utils.negotiate_encoding(request.headers.get("Accept-Encoding"))
+    if encoding is None:
+        return response
+
+    body = response.get_data()
+    if len(body) < app.config["MINCER_COMPRESSION_MIN_SIZE"]:
+        return response
+
+    provider_slug = None
+    if request.endpoint == "providers":
+        provider_slug = request.view_args["provider_slug"]
+
+    response.set_data(encode_answer(body, encoding, provider_slug))
+    response.headers["Content-Encoding"] = encoding
+
+    return response
+
+
+def provider_fragment(cls, provider, url, message):
+    """Render the answer of a provider which has no result to show.
+
+    Params:
+        cls (str): the HTML class of the answer (see :class:`HtmlClasses`).
+        provider (Provider): the provider queried.
+        url (str): the full remote url.
+        message (str): text explaining the answer.
+
+    Returns:
+        Markup: the rendered fragment.
+    """
+    result = div(_class=cls, id=provider.slug)
+    with result:
+        div(a(provider.name, href=url), _class=HtmlClasses.PROVIDER)
+        div(message)
+    return Markup(result.render())
+
+
+def search_provider(provider, param):
+    """Retrieve the answer of a provider for a multi-provider search.
+
+    The answer is kept in cache, so it is useful even when it comes after
+    the deadline of the search.
+
+    Params:
+        provider (Provider): the provider to query.
+        param (str): parameter of the request as recieved by :func:`search`.
+
+    Returns:
+        Markup: the rendered fragment.
+    """
+    full_remote_url = build_remote_url(provider, param)
+
+    try:
+        page = fetch_page(provider, full_remote_url)
+    except remote.BulkheadFullError as e:
+        app.logger.error(
+            'Provider %s was asked for "%s" but its remote host is busy: %s',
+            provider.slug,
+            unquote_plus(param),
+            e)
+        metrics.incr("outcome", provider.slug, Outcome.BUSY)
+        return provider_fragment(
+            HtmlClasses.ERROR, provider, full_remote_url,
+            "This provider is too busy to answer.")
+    except remote.RemoteError as e:
+        app.logger.error(
+            'Provider %s was asked for "%s" but its remote page could not be '
+            'retrieved: %s',
+            provider.slug,
+            unquote_plus(param),
+            e)
+        metrics.incr("outcome", provider.slug, Outcome.REMOTE_ERROR)
+        return provider_fragment(
+            HtmlClasses.ERROR, provider, full_remote_url,
+            "This provider could not be reached.")
+
+    return render_page(provider, param, full_remote_url, page)
+
+
+def pending_fragment(provider, param):
+    """Render the placeholder of a provider whose answer was not ready before
+    the deadline of a multi-provider search.
+
+    Params:
+        provider (Provider): the provider queried.
+        param (str): parameter of the request as recieved by :func:`search`.
+
+    Returns:
+        Markup: the rendered fragment.
+    """
+    metrics.incr("outcome", provider.slug, Outcome.PENDING)
+    return provider_fragment(
+        HtmlClasses.PENDING, provider, build_remote_url(provider, param),
+        "This provider is still searching.")
+
+
+# Searches in progress by key of their answer, see submit_search()
+searches = {}
+searches_lock = threading.Lock()
+
+
+def submit_search(provider, param):
+    """Start the search of a provider in the background.
+
+    A search already in progress for the same answer is reused, so a client
+    retrying a slow search does not query the provider again.
+
+    Params:
+        provider (Provider): the provider to query.
+        param (str): parameter of the request as recieved by :func:`search`.
+
+    Returns:
+        concurrent.futures.Future: the answer (see :func:`search_provider`).
+    """
+    key = "{slug}:{url}".format(
+        slug=provider.slug, url=build_remote_url(provider, param))
+
+    with searches_lock:
+        future = searches.get(key)
+        if future is not None:
+            return future
+        future = get_search_executor().submit(search_provider, provider, param)
+        searches[key] = future
+
+    def forget(done):
+        with searches_lock:
+            if searches.get(key) is done:
+                del searches[key]
+
+    future.add_done_callback(forget)
+
+    return future
+
+
+"""Query parameter giving the slugs of the providers of a search."""
+PROVIDERS_PARAM = "providers"
+
+"""Header listing the providers whose answer was not ready in time."""
+PENDING_HEADER = "X-Mincer-Pending"
+
+
+def start_search(param):
+    """Start the searches of the providers of a multi-provider request.
+
+    Params:
+        param (str): parameter of the request as recieved by :func:`search`.
+
+    Returns:
+        tuple(mincer.remote.Deadline, list(tuple(Provider, Future))): the
+        deadline of the request and the searches in progress of the
+        providers.
+    """
+    # The time left to answer the client
+    try:
+        deadline = parse_deadline(
+            request.headers.get(DEADLINE_HEADER),
+            request.args.get(DEADLINE_PARAM))
+    except ValueError as e:
+        app.logger.error('Invalid deadline: %s', e)
+        abort(BAD_REQUEST)
+
+    # Retrieve the providers from database
+    query = Provider.query.order_by(Provider.slug)
+    slugs = request.args.get(PROVIDERS_PARAM)
+    if slugs:
+        wanted_slugs = frozenset(slugs.split(","))
+        query = query.filter(Provider.slug.in_(wanted_slugs))
+    searched_providers = query.all()
+    if slugs and len(searched_providers) != len(wanted_slugs):
+        app.logger.error(
+            'Providers %s were asked for "%s" but some of these provider names '
+            'do not exist.',
+            slugs,
+            unquote_plus(param))
+        abort(NOT_FOUND)
+
+    # Query all the providers side by side
+    return deadline, [
+        (prov, submit_search(prov, param)) for prov in searched_providers]
+
+
+@app.route("/search/<string:param>")
+@utils.add_response_headers({"Access-Control-Allow-Origin": "*"})
+def search(param):
+    """
+    Query several providers at once and return every answer ready before the
+    deadline.
+
+    The providers still working at the deadline are replaced by a
+    placeholder with the ``mincer-pending`` class and listed in the
+    ``X-Mincer-Pending`` header. They keep working in the background so their
+    answer is in cache for the next request.
+
+    :query string param: parameter of the request already url encoded, see
+        :func:`providers`.
+    :query providers: optional comma separated slugs of the providers to
+        query (all the providers by default).
+    :query deadline: optional number of seconds the client is ready to wait
+        for the answers (``MINCER_DEADLINE`` by default).
+
+    :reqheader X-Mincer-Deadline: same as the ``deadline`` query parameter.
+
+    :resheader X-Mincer-Pending: comma separated slugs of the providers whose
+        answer was not ready in time.
+
+    :status 200: everything was ok, maybe partially
+    :status 400: when the deadline is not a positive number of seconds
+    :status 404: when one of the providers does not exist
+
+    .. :quickref: Search; Extract search results from several providers
+    """
+    deadline, searches = start_search(param)
+
+    # Wait for all the providers until the deadline
+    wait([future for _, future in searches], timeout=deadline.remaining())
+
+    fragments = []
+    pending_slugs = []
+    for prov, future in searches:
+        if future.done():
+            fragments.append(future.result())
+        else:
+            pending_slugs.append(prov.slug)
+            fragments.append(pending_fragment(prov, param))
+
+    response = make_response(Markup("").join(fragments))
+    if pending_slugs:
+        response.headers[PENDING_HEADER] = ",".join(pending_slugs)
+
+    return response
+
+
+def stream_search(searches, param, deadline):
+    """Generate the answers of a multi-provider search as Server-Sent Events
+    as soon as each of them is ready.
+
+    Each answer is an ``answer`` event, each provider still working at the
+    deadline gives a ``pending`` event and the stream ends with an ``end``
+    event.
+
+    Params:
+        searches (list(tuple(Provider, Future))): the searches in progress
+            (see :func:`start_search`).
+        param (str): parameter of the request.
+        deadline (mincer.remote.Deadline): the deadline of the request.
+
+    Yields:
+        str: the events of the stream.
+    """
+    providers_by_future = {future: prov for prov, future in searches}
+    try:
+        for future in as_completed(
+                providers_by_future, timeout=deadline.remaining()):
+            del providers_by_future[future]
+            yield utils.sse_event("answer", future.result())
+    except FuturesTimeoutError:
+        for prov in providers_by_future.values():
+            yield utils.sse_event("pending", pending_fragment(prov, param))
+
+    yield utils.sse_event("end", "")
+
+
+@app.route("/search/<string:param>/stream")
+@utils.add_response_headers({"Access-Control-Allow-Origin": "*"})
+def search_stream(param):
+    """
+    Query several providers at once and stream each answer as soon as it is
+    ready, as `Server-Sent Events
+    <https://developer.mozilla.org/en-US/docs/Web/API/Server-sent_events>`_.
+
+    Every answer of a provider is sent in an ``answer`` event. At the
+    deadline, each provider still working is sent in a ``pending`` event and
+    keeps working in the background to fill the cache. The last event is an
+    ``end`` event.
+
+    :query string param: parameter of the request already url encoded, see
+        :func:`providers`.
+    :query providers: optional comma separated slugs of the providers to
+        query (all the providers by default).
+    :query deadline: optional number of seconds the client is ready to wait
+        for the answers (``MINCER_DEADLINE`` by default).
+
+    :reqheader X-Mincer-Deadline: same as the ``deadline`` query parameter.
+
+    :status 200: everything was ok
+    :status 400: when the deadline is not a positive number of seconds
+    :status 404: when one of the providers does not exist
+
+    .. :quickref: Search; Stream search results from several providers
+    """
+    deadline, searches = start_search(param)
+
+    return Response(
+        stream_search(searches, param, deadline),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Do not let a reverse proxy buffer the events
+            "X-Accel-Buffering": "no"})
+
+
+@app.route("/search")
+def search_page():
+    """
+    Provide a page to search all the providers at once, displaying each
+    answer as soon as it is ready.
+
+    .. :quickref: Search; Search all the providers
+    """
+    return render_template(
+        "search.html",
+        dependencies={e.name: e for e in Dependency.query.all()},
+        title="Mincer",
+        subtitle="Search")
+
+
+@app.route("/metrics")
+def show_metrics():
+    """
+    Give the counters of the application as a JSON document.
+
+    The ``outcome`` counters give, for each provider, how many requests ended
+    with each :class:`mincer.metrics.Outcome`. The ``cache`` counters give,
+    for each provider, how many remote pages were found (``hit``) or not
+    (``miss``) in cache, how many of them failed recently (``error_hit``) and
+    how many answers were found (``result_hit``) or not (``result_miss``) in
+    cache. ``cache_hit_rate`` gives the resulting hit rate of the remote
+    pages.
+
+    :status 200: everything was ok
+
+    .. :quickref: Metrics; Counters of the application
+    """
+    snapshot = metrics.snapshot()
+
+    hit_rates, _ = cache_hit_rates()
+    if hit_rates:
+        snapshot["cache_hit_rate"] = hit_rates
+
+    return jsonify(snapshot)
@@ -0,0 +1,393 @@
+"""
+ASGI entry point of Mincer.
+
+The provider pipeline (see :func:`mincer.providers`) is served asynchronously:
+the remote page is fetched with a non-blocking HTTP client and the database
+lookup and the extraction are run in an executor. This way one process can
+keep hundreds of remote requests in flight at once. Every other url is served
+by the regular Flask application.
+
+Run it with any ASGI server, for example::
+
+    uvicorn mincer.asgi:application
+"""
+
+__author__ = "Pierre-Yves Martin <pym.aldebaran@gmail.com>"
+__copyright__ = "Copyright (C) 2017 GIP BULAC"
+__license__ = "GNU AGPL V3"
+
+# This file is part of Mincer.
+#
+# Mincer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mincer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Mincer.  If not, see <http://www.gnu.org/licenses/>.
+
+# To run coroutines and offload blocking work
+import asyncio
+
+# To route the recieved requests
+import re
+
+# To encode/decode form-encoded values
+from urllib.parse import unquote_plus, parse_qs
+
+# Asynchronous HTTP client
+# See https://www.python-httpx.org/
+import httpx
+
+# To serve the Flask application from an ASGI server
+# See https://github.com/django/asgiref
+from asgiref.wsgi import WsgiToAsgi
+
+# Convenient constant for HTTP status codes
+try:
+    # Python 3.5+ only
+    from HTTPStatus import OK, NOT_FOUND, INTERNAL_SERVER_ERROR, BAD_GATEWAY, SERVICE_UNAVAILABLE, GATEWAY_TIMEOUT, BAD_REQUEST
+except Exception as e:
+    from http.client import OK, NOT_FOUND, INTERNAL_SERVER_ERROR, BAD_GATEWAY, SERVICE_UNAVAILABLE, GATEWAY_TIMEOUT, BAD_REQUEST
+
+# The Mincer application and its provider pipeline
+import mincer
+from mincer import app, Provider
+
+# Tools to query the remote providers
+from mincer import remote
+
+# To fetch each remote page once
+from mincer.peers import AsyncSingleFlight
+
+# Outcomes of the requests to the providers
+from mincer.metrics import Outcome
+
+"""Urls served by the asynchronous provider pipeline."""
+PROVIDERS_PATH = re.compile(
+    r"^/providers/(?P<provider_slug>[^/]+)/(?P<param>[^/]+)$")
+
+
+"""Fetches of remote pages in progress, by key of the page in the cache."""
+fetches = AsyncSingleFlight()
+
+
+def find_provider(provider_slug):
+    """Retrieve a provider from the database.
+
+    This is blocking and must be run in an executor.
+
+    Params:
+        provider_slug (str): slugified name of the provider.
+
+    Returns:
+        Provider: the provider or ``None`` if it does not exist.
+    """
+    with app.app_context():
+        return Provider.query.filter(Provider.slug == provider_slug).first()
+
+
+def scope_deadline(scope):
+    """Deadline of a request given by an ASGI scope.
+
+    See :func:`mincer.parse_deadline`.
+    """
+    header = dict(scope.get("headers", [])).get(
+        mincer.DEADLINE_HEADER.lower().encode("latin-1"))
+    params = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+
+    return mincer.parse_deadline(
+        header.decode("latin-1") if header is not None else None,
+        params.get(mincer.DEADLINE_PARAM, [None])[-1])
+
+
+def scope_window(scope):
+    """Window of the results asked for by an ASGI scope.
+
+    See :func:`mincer.parse_window`.
+    """
+    params = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+
+    return mincer.parse_window(
+        params.get(mincer.LIMIT_PARAM, [None])[-1],
+        params.get(mincer.OFFSET_PARAM, [None])[-1])
+
+
+def scope_encoding(scope):
+    """Content coding accepted by the client of an ASGI scope.
+
+    See :func:`mincer.utils.negotiate_encoding`.
+    """
+    header = dict(scope.get("headers", [])).get(b"accept-encoding")
+
+    return mincer.utils.negotiate_encoding(
+        header.decode("latin-1") if header is not None else None)
+
+
+def deadline_exceeded(provider_slug, param):
+    """Same as :func:`mincer.deadline_exceeded`."""
+    app.logger.error(
+        'Provider %s was asked for "%s" but the deadline of the request was '
+        'over before the answer was ready.',
+        provider_slug,
+        unquote_plus(param))
+    mincer.metrics.incr("outcome", provider_slug, Outcome.DEADLINE_EXCEEDED)
+
+    return GATEWAY_TIMEOUT, ""
+
+
+async def fetch_page(fetcher, provider, url, deadline):
+    """Asynchronous version of :func:`mincer.fetch_page`.
+
+    The cache and the owner of the page in the group of instances of Mincer
+    are used in an executor since they may block (and pages are compressed
+    in the cache), the remote host is queried asynchronously. Concurrent
+    requests of the same page only fetch it once, see :data:`fetches`.
+
+    Params:
+        fetcher (mincer.remote.AsyncFetcher): the tool used to retrieve the
+            remote pages.
+        provider (Provider): the provider the page comes from.
+        url (str): the full remote url.
+        deadline (mincer.remote.Deadline): the deadline of the request.
+
+    Returns:
+        str: the content of the page.
+    """
+    loop = asyncio.get_running_loop()
+
+    page = await loop.run_in_executor(None, mincer.cached_page, provider, url)
+    if page is not None:
+        return page
+
+    return await fetches.do(
+        mincer.page_cache_key(provider, url),
+        fetch_remote_page, fetcher, provider, url, deadline,
+        deadline=deadline)
+
+
+async def fetch_remote_page(fetcher, provider, url, deadline):
+    """Asynchronous version of :func:`mincer.fetch_remote_page`.
+
+    See :func:`fetch_page`.
+    """
+    loop = asyncio.get_running_loop()
+
+    # The page may have been fetched while this fetch was waiting to start
+    page = await loop.run_in_executor(None, mincer.cached_page, provider, url)
+    if page is not None:
+        return page
+
+    try:
+        page = await loop.run_in_executor(
+            None, mincer.ask_owner, provider, url, deadline)
+        if page is None:
+            page = await fetcher.fetch(
+                url, key=provider.slug, deadline=deadline)
+    except remote.DeadlineExceededError:
+        # The client was in a hurry, the remote page may be fine
+        raise
+    except remote.RemoteError:
+        await loop.run_in_executor(
+            None, mincer.cache_error, provider, url, Outcome.REMOTE_ERROR)
+        raise
+
+    await loop.run_in_executor(None, mincer.cache_page, provider, url, page)
+
+    return page
+
+
+async def providers(fetcher, deadline, provider_slug, param, offset=0,
+                    limit=None):
+    """Asynchronous version of :func:`mincer.providers`.
+
+    Params:
+        fetcher (mincer.remote.AsyncFetcher): the tool used to retrieve the
+            remote pages.
+        deadline (mincer.remote.Deadline): the deadline of the request.
+        provider_slug (str): slugified name of the provider.
+        param (str): parameter of the request.
+        offset (int): number of results skipped, see
+            :func:`mincer.parse_window`.
+        limit (int|None): maximum number of results given.
+
+    Returns:
+        tuple(int, str): the HTTP status and the body of the answer.
+    """
+    loop = asyncio.get_running_loop()
+
+    # Retrieve the provider from database
+    provider = await loop.run_in_executor(None, find_provider, provider_slug)
+    if not provider:
+        app.logger.error(
+            'Provider %s was asked for "%s" but this provider name '
+            'does not exist.',
+            provider_slug,
+            unquote_plus(param))
+        return NOT_FOUND, ""
+
+    # Build the full remote url by replacing param
+    full_remote_url = mincer.build_remote_url(provider, param)
+
+    # Get the content of the page
+    try:
+        page = await fetch_page(fetcher, provider, full_remote_url, deadline)
+    except remote.BulkheadFullError as e:
+        app.logger.error(
+            'Provider %s was asked for "%s" but its remote host is busy: %s',
+            provider_slug,
+            unquote_plus(param),
+            e)
+        mincer.metrics.incr("outcome", provider_slug, Outcome.BUSY)
+        return SERVICE_UNAVAILABLE, ""
+    except remote.RemoteError as e:
+        if deadline.expired():
+            return deadline_exceeded(provider_slug, param)
+        app.logger.error(
+            'Provider %s was asked for "%s" but its remote page could not be '
+            'retrieved: %s',
+            provider_slug,
+            unquote_plus(param),
+            e)
+        mincer.metrics.incr("outcome", provider_slug, Outcome.REMOTE_ERROR)
+        return BAD_GATEWAY, ""
+
+    # Nobody is waiting for the results anymore
+    if deadline.expired():
+        return deadline_exceeded(provider_slug, param)
+
+    # Extract the results without blocking the event loop
+    result = await loop.run_in_executor(
+        None, mincer.render_page, provider, param, full_remote_url, page,
+        offset, limit)
+
+    return OK, str(result)
+
+
+class Application(object):
+    """ASGI application serving the provider pipeline asynchronously and
+    everything else through a WSGI application.
+
+    Arguments:
+        wsgi_app (flask.Flask): the application serving all the other urls.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.asgi_wsgi_app = WsgiToAsgi(wsgi_app)
+        self.fetcher = None
+
+    def get_fetcher(self):
+        """Retrieve the tool used to fetch the remote pages, shared by all
+        the requests.
+
+        It is created on first use so that its HTTP client belongs to the
+        running event loop. Its limits of concurrent requests to each remote
+        host are shared with the Flask application.
+        """
+        if self.fetcher is None:
+            max_connections = self.wsgi_app.config["MINCER_ASYNC_MAX_CONNECTIONS"]
+            self.fetcher = remote.AsyncFetcher(
+                httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=max_connections)),
+                remote.AsyncBulkheads.sharing(mincer.get_bulkheads()),
+                **mincer.fetcher_config())
+
+        return self.fetcher
+
+    async def close(self):
+        """Close the shared HTTP client."""
+        if self.fetcher is not None:
+            await self.fetcher.client.aclose()
+            self.fetcher = None
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+
+        match = PROVIDERS_PATH.match(scope.get("path", ""))
+        if scope["type"] != "http" or not match:
+            return await self.asgi_wsgi_app(scope, receive, send)
+
+        try:
+            deadline = scope_deadline(scope)
+        except ValueError as e:
+            app.logger.error('Invalid deadline: %s', e)
+            return await self.send_response(send, BAD_REQUEST, "")
+
+        try:
+            offset, limit = scope_window(scope)
+        except ValueError as e:
+            app.logger.error('Invalid window: %s', e)
+            return await self.send_response(send, BAD_REQUEST, "")
+
+        try:
+            status, body = await providers(
+                self.get_fetcher(), deadline, offset=offset, limit=limit,
+                **match.groupdict())
+        except Exception:
+            app.logger.exception(
+                "Error while serving %s asynchronously.", scope["path"])
+            status, body = INTERNAL_SERVER_ERROR, ""
+
+        data = body.encode("utf-8")
+        encoding = scope_encoding(scope)
+        if status != OK or len(data) < app.config["MINCER_COMPRESSION_MIN_SIZE"]:
+            encoding = None
+        if encoding is not None:
+            # Compressing a big answer takes some time
+            data = await asyncio.get_running_loop().run_in_executor(
+                None,
+                mincer.encode_answer,
+                data,
+                encoding,
+                match.group("provider_slug"))
+
+        await self.send_response(send, status, data, encoding)
+
+    async def send_response(self, send, status, body, encoding=None):
+        """Send a whole HTML answer to the client.
+
+        Params:
+            send (callable): the ASGI send function.
+            status (int): the HTTP status of the answer.
+            body (str|bytes): the answer, already compressed if it is bytes.
+            encoding (str|None): the content coding of ``body``.
+        """
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+
+        headers = [
+            (b"content-type", b"text/html; charset=utf-8"),
+            (b"access-control-allow-origin", b"*"),
+            (b"vary", b"Accept-Encoding"),
+            ]
+        if encoding is not None:
+            headers.append((b"content-encoding", encoding.encode("latin-1")))
+
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": headers})
+        await send({
+            "type": "http.response.body",
+            "body": body})
+
+
+"""The ASGI application of Mincer."""
+application = Application(app)
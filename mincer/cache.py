@@ -0,0 +1,742 @@
+__author__ = "Pierre-Yves Martin <pym.aldebaran@gmail.com>"
+__copyright__ = "Copyright (C) 2017 GIP BULAC"
+__license__ = "GNU AGPL V3"
+
+# This file is part of Mincer.
+#
+# Mincer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mincer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Mincer.  If not, see <http://www.gnu.org/licenses/>.
+
+# To share the cache between threads
+import threading
+
+# To know when the entries expire
+import time
+
+# To forget the least recently used entries first
+from collections import OrderedDict, Counter
+
+# To store the entries outside of the process
+import json
+
+# To keep more entries in the same memory
+import zlib
+import sqlite3
+import socket
+
+# To choose a backend from an url
+from urllib.parse import urlparse
+
+# To report a shared cache out of order
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownCacheBackendError(Exception):
+    """Raised by :func:`from_url` when the url gives an unknown backend."""
+    pass
+
+
+class CacheError(Exception):
+    """Raised by :class:`RedisCache` when the server can not be understood."""
+    pass
+
+
+class CacheReplyError(CacheError):
+    """Raised by :class:`RedisCache` when the server answers with an error."""
+    pass
+
+
+class CacheBackend(object):
+    """Interface of the caches whose entries expire after some time.
+
+    The values of the entries are strings or lists (and tuples) of strings,
+    so that they can be stored by any backend.
+
+    Arguments:
+        ttl (float): number of seconds an entry is kept by default.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def get(self, key):
+        """Value of an entry.
+
+        Params:
+            key (str): the key of the entry.
+
+        Returns:
+            the value of the entry or ``None`` if it is unknown or expired.
+        """
+        raise NotImplementedError()
+
+    def set(self, key, value, ttl=None):
+        """Add or replace an entry.
+
+        Params:
+            key (str): the key of the entry.
+            value: the value of the entry, anything but ``None``.
+            ttl (float|None): number of seconds the entry is kept, the default
+                one of the cache if ``None``. An entry with no time to live is
+                forgotten right away.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            self.delete(key)
+        else:
+            self.store(key, value, ttl)
+
+    def store(self, key, value, ttl):
+        """Add or replace an entry with a positive time to live, see
+        :meth:`set`."""
+        raise NotImplementedError()
+
+    def delete(self, key):
+        """Forget an entry if it exists.
+
+        Params:
+            key (str): the key of the entry.
+        """
+        raise NotImplementedError()
+
+    def keys(self, prefix=""):
+        """Keys of the entries which are not expired.
+
+        Params:
+            prefix (str): only the keys starting with it are given.
+
+        Returns:
+            list of str: the keys.
+        """
+        raise NotImplementedError()
+
+    def info(self, key):
+        """Details about an entry.
+
+        Params:
+            key (str): the key of the entry.
+
+        Returns:
+            dict: the ``key``, the ``size`` of the stored value (in bytes),
+            its ``age`` and the time before it ``expires`` (in seconds) and
+            the number of ``hits`` of the entry, ``None`` when the backend does
+            not know it. ``None`` if the entry is unknown or expired.
+        """
+        raise NotImplementedError()
+
+    def delete_prefix(self, prefix):
+        """Forget all the entries whose keys start with a prefix.
+
+        Params:
+            prefix (str): the prefix of the keys.
+
+        Returns:
+            int: the number of forgotten entries.
+        """
+        keys = self.keys(prefix)
+        for key in keys:
+            self.delete(key)
+        return len(keys)
+
+    def clear(self):
+        """Forget all the entries."""
+        raise NotImplementedError()
+
+    def __len__(self):
+        raise NotImplementedError()
+
+
+"""Default size (in bytes) above which an entry is compressed."""
+DEFAULT_COMPRESS_THRESHOLD = 1024
+
+
+def pack(value, threshold=DEFAULT_COMPRESS_THRESHOLD):
+    """Encode the value of an entry, compressed if it is big enough to be
+    worth it.
+
+    Params:
+        value: the value of the entry (see :class:`CacheBackend`).
+        threshold (int): size (in bytes) above which the value is compressed.
+
+    Returns:
+        tuple(bool, bytes): if the value is compressed and the encoded value.
+
+    Examples:
+        >>> pack("<div>Hugo</div>")
+        (False, b'"<div>Hugo</div>"')
+        >>> compressed, data = pack(["result", "<div>Hugo</div>" * 1000])
+        >>> compressed, len(data) < 1000
+        (True, True)
+    """
+    data = json.dumps(value).encode("utf-8")
+    if len(data) < threshold:
+        return False, data
+
+    return True, zlib.compress(data)
+
+
+def unpack(compressed, data):
+    """Decode the value of an entry encoded by :func:`pack`.
+
+    Examples:
+        >>> unpack(*pack(["result", "<div>Hugo</div>" * 1000]))[0]
+        'result'
+    """
+    if compressed:
+        data = zlib.decompress(data)
+
+    return json.loads(data.decode("utf-8"))
+
+
+class MemoryCache(CacheBackend):
+    """In-memory cache whose entries expire after some time.
+
+    The entries are encoded by :func:`pack`: big pages and fragments are kept
+    compressed and the size of the cache is the size of the encoded entries.
+    When the cache is full, the least recently used entries are forgotten.
+    The cache is not shared between processes.
+
+    Arguments:
+        ttl (float): number of seconds an entry is kept by default.
+        max_entries (int): maximum number of entries kept.
+        max_size (int|None): maximum size (in bytes) of the entries kept,
+            ``None`` for no limit.
+        compress_threshold (int): size (in bytes) above which an entry is
+            compressed.
+
+    Examples:
+        >>> cache = MemoryCache(ttl=60, max_entries=2)
+        >>> cache.set("koha-search:victor", "<div>Hugo</div>")
+        >>> cache.get("koha-search:victor")
+        '<div>Hugo</div>'
+        >>> cache.get("koha-search:emile") is None
+        True
+        >>> cache.set("koha-search:emile", "<div>Zola</div>")
+        >>> cache.set("koha-search:honore", "<div>Balzac</div>")
+        >>> cache.get("koha-search:victor") is None
+        True
+        >>> len(cache)
+        2
+        >>> cache.info("koha-search:emile")["hits"]
+        0
+    """
+
+    class Entry(object):
+        """An entry of the cache, encoded by :func:`pack`."""
+        __slots__ = ("expires", "created", "compressed", "data", "hits")
+
+        def __init__(self, expires, compressed, data):
+            self.created = time.monotonic()
+            self.expires = expires
+            self.compressed = compressed
+            self.data = data
+            self.hits = 0
+
+    def __init__(self, ttl, max_entries, max_size=None,
+                 compress_threshold=DEFAULT_COMPRESS_THRESHOLD):
+        super(MemoryCache, self).__init__(ttl)
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.compress_threshold = compress_threshold
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remove(self, key):
+        """Forget an entry, the lock must be held."""
+        self.size -= len(self._entries.pop(key).data)
+
+    def _live(self, key):
+        """The entry of a key if it is not expired, the lock must be held."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        if entry.expires <= time.monotonic():
+            self._remove(key)
+            return None
+
+        return entry
+
+    def _full(self):
+        """Tell if some entries must be forgotten, the lock must be held."""
+        return len(self._entries) > self.max_entries or (
+            self.max_size is not None and self.size > self.max_size)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                return None
+
+            entry.hits += 1
+            self._entries.move_to_end(key)
+
+        return unpack(entry.compressed, entry.data)
+
+    def store(self, key, value, ttl):
+        # Encoding is done outside of the lock, it may take some time
+        compressed, data = pack(value, self.compress_threshold)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = self.Entry(
+                time.monotonic() + ttl, compressed, data)
+            self.size += len(data)
+            while self._full():
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def keys(self, prefix=""):
+        with self._lock:
+            return [key for key in list(self._entries)
+                    if key.startswith(prefix) and self._live(key) is not None]
+
+    def info(self, key):
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                return None
+
+            now = time.monotonic()
+            return {
+                "key": key,
+                "size": len(entry.data),
+                "age": now - entry.created,
+                "expires": entry.expires - now,
+                "hits": entry.hits,
+                }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class SqliteCache(CacheBackend):
+    """Cache stored in a SQLite database, shared by all the processes of a
+    host (e.g. the workers of a WSGI server).
+
+    When the cache is full, the entries closest to their expiration are
+    forgotten first. Reading an entry is a plain read: its hits are counted
+    in memory and written in batches.
+
+    Arguments:
+        path (str): path of the database file, created if needed.
+        ttl (float): number of seconds an entry is kept by default.
+        max_entries (int): maximum number of entries kept.
+
+    Examples:
+        >>> cache = SqliteCache(":memory:", ttl=60, max_entries=10)
+        >>> cache.set("koha-search:victor", ["result", "<div>Hugo</div>"])
+        >>> cache.get("koha-search:victor")
+        ['result', '<div>Hugo</div>']
+    """
+
+    """Number of additions between two checks of the size of the cache."""
+    EVICTION_PERIOD = 100
+
+    """Number of hits counted in memory before they are written."""
+    HITS_PERIOD = 100
+
+    def __init__(self, path, ttl, max_entries):
+        super(SqliteCache, self).__init__(ttl)
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._additions = 0
+        self._hits = Counter()
+        self._hits_lock = threading.Lock()
+        self.connection().execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, expires REAL NOT NULL, value TEXT NOT NULL, "
+            "created REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)")
+
+    def connection(self):
+        """The connection of the current thread to the database."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None)
+            # Readers do not block the writer
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        row = self.connection().execute(
+            "SELECT value FROM entries WHERE key = ? AND expires > ?",
+            (key, time.time())).fetchone()
+        if row is None:
+            return None
+
+        with self._hits_lock:
+            self._hits[key] += 1
+            flush = sum(self._hits.values()) >= self.HITS_PERIOD
+        if flush:
+            self.write_hits()
+
+        return json.loads(row[0])
+
+    def write_hits(self):
+        """Write the hits counted in memory to the database."""
+        with self._hits_lock:
+            hits, self._hits = self._hits, Counter()
+        if hits:
+            self.connection().executemany(
+                "UPDATE entries SET hits = hits + ? WHERE key = ?",
+                [(count, key) for key, count in hits.items()])
+
+    def store(self, key, value, ttl):
+        connection = self.connection()
+        now = time.time()
+        connection.execute(
+            "INSERT OR REPLACE INTO entries (key, expires, value, created) "
+            "VALUES (?, ?, ?, ?)",
+            (key, now + ttl, json.dumps(value), now))
+
+        self._additions += 1
+        if self._additions % self.EVICTION_PERIOD == 0:
+            self.evict()
+
+    def evict(self):
+        """Forget the expired entries and the entries above the maximum
+        number of entries."""
+        connection = self.connection()
+        connection.execute(
+            "DELETE FROM entries WHERE expires <= ?", (time.time(),))
+        connection.execute(
+            "DELETE FROM entries WHERE key IN ("
+            "SELECT key FROM entries ORDER BY expires LIMIT max(0, "
+            "(SELECT COUNT(*) FROM entries) - ?))",
+            (self.max_entries,))
+
+    def delete(self, key):
+        self.connection().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def keys(self, prefix=""):
+        rows = self.connection().execute(
+            "SELECT key FROM entries WHERE substr(key, 1, ?) = ? "
+            "AND expires > ? ORDER BY key",
+            (len(prefix), prefix, time.time()))
+        return [key for key, in rows]
+
+    def info(self, key):
+        self.write_hits()
+        now = time.time()
+        row = self.connection().execute(
+            "SELECT length(CAST(value AS BLOB)), created, expires, hits "
+            "FROM entries WHERE key = ? AND expires > ?",
+            (key, now)).fetchone()
+        if row is None:
+            return None
+
+        size, created, expires, hits = row
+        return {
+            "key": key,
+            "size": size,
+            "age": now - created,
+            "expires": expires - now,
+            "hits": hits,
+            }
+
+    def delete_prefix(self, prefix):
+        return self.connection().execute(
+            "DELETE FROM entries WHERE substr(key, 1, ?) = ?",
+            (len(prefix), prefix)).rowcount
+
+    def clear(self):
+        self.connection().execute("DELETE FROM entries")
+
+    def __len__(self):
+        return self.connection().execute(
+            "SELECT COUNT(*) FROM entries WHERE expires > ?",
+            (time.time(),)).fetchone()[0]
+
+
+class RedisCache(CacheBackend):
+    """Cache stored in a server speaking the Redis protocol, shared by all the
+    Mincer instances of all the hosts.
+
+    The expiration and the eviction of the entries are left to the server.
+    Only the basic commands ``GET``, ``SET``, ``DEL``, ``SCAN``, ``STRLEN``
+    and ``PTTL`` are used, so any server speaking the protocol will do. The
+    age and the hits of the entries are unknown. An unreachable server is
+    just a cache without any entry.
+
+    See `Redis serialization protocol
+    <https://redis.io/docs/reference/protocol-spec/>`_
+
+    Arguments:
+        host (str): the host of the server.
+        port (int): the port of the server.
+        ttl (float): number of seconds an entry is kept by default.
+        db (int): the number of the database used on the server.
+        prefix (str): prefix of the keys of Mincer on the server.
+        timeout (float): maximum time (in seconds) to wait for the server.
+    """
+
+    def __init__(self, host, port, ttl, db=0, prefix="mincer:", timeout=1.0):
+        super(RedisCache, self).__init__(ttl)
+        self.host = host
+        self.port = port
+        self.db = db
+        self.prefix = prefix
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def connect(self):
+        """The connection of the current thread to the server."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            sock = socket.create_connection(
+                (self.host, self.port), timeout=self.timeout)
+            connection = (sock, sock.makefile("rb"))
+            self._local.connection = connection
+            if self.db:
+                try:
+                    self.command("SELECT", str(self.db))
+                except CacheError:
+                    # Never use the wrong database
+                    self.disconnect()
+                    raise
+        return connection
+
+    def disconnect(self):
+        """Close the connection of the current thread to the server."""
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection is not None:
+            sock, reader = connection
+            reader.close()
+            sock.close()
+
+    def command(self, *args):
+        """Send a command to the server.
+
+        Params:
+            args (str): the command and its arguments.
+
+        Returns:
+            the reply of the server.
+
+        Raises:
+            CacheReplyError: the server answered with an error.
+            CacheError: the reply of the server could not be understood, the
+                connection is closed.
+            OSError: the server could not be reached, the connection is
+                closed.
+        """
+        sock, reader = self.connect()
+
+        request = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg.encode("utf-8")
+            request.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        try:
+            sock.sendall(b"".join(request))
+            return self.read_reply(reader)
+        except CacheReplyError:
+            # The whole reply has been read, the connection can be reused
+            raise
+        except (OSError, CacheError):
+            self.disconnect()
+            raise
+        except ValueError as e:
+            # Whatever is left of the reply would be read by the next command
+            self.disconnect()
+            raise CacheError(
+                "Unexpected reply from the cache server: {}".format(e))
+
+    def read_reply(self, reader):
+        """Read a reply of the server.
+
+        Params:
+            reader (file): the stream of the server.
+
+        Returns:
+            str|int|list|None: the reply.
+        """
+        line = reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by the cache server.")
+        kind, data = line[:1], line[1:-2]
+
+        if kind == b"+":
+            return data.decode("utf-8")
+        if kind == b"-":
+            raise CacheReplyError(data.decode("utf-8"))
+        if kind == b":":
+            return int(data)
+        if kind == b"$":
+            length = int(data)
+            if length < 0:
+                return None
+            return reader.read(length + 2)[:-2].decode("utf-8")
+        if kind == b"*":
+            length = int(data)
+            if length < 0:
+                return None
+            return [self.read_reply(reader) for _ in range(length)]
+
+        raise CacheError("Unexpected reply from the cache server.")
+
+    def get(self, key):
+        try:
+            value = self.command("GET", self.prefix + key)
+        except (OSError, CacheError) as e:
+            logger.warning("Cache server unavailable: %s", e)
+            return None
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def store(self, key, value, ttl):
+        try:
+            self.command(
+                "SET", self.prefix + key, json.dumps(value),
+                "PX", str(max(1, int(ttl * 1000))))
+        except (OSError, CacheError) as e:
+            logger.warning("Cache server unavailable: %s", e)
+
+    def delete(self, key):
+        try:
+            self.command("DEL", self.prefix + key)
+        except (OSError, CacheError) as e:
+            logger.warning("Cache server unavailable: %s", e)
+
+    def server_keys(self, prefix=""):
+        """The keys of Mincer on the server starting with a prefix, with the
+        prefix of the server."""
+        pattern = self.prefix + "".join(
+            "\\" + char if char in "*?[]\\" else char for char in prefix)
+
+        cursor = "0"
+        keys = []
+        while True:
+            cursor, batch = self.command(
+                "SCAN", cursor, "MATCH", pattern + "*", "COUNT", "1000")
+            keys.extend(batch)
+            if cursor == "0":
+                return keys
+
+    def keys(self, prefix=""):
+        try:
+            keys = self.server_keys(prefix)
+        except (OSError, CacheError) as e:
+            logger.warning("Cache server unavailable: %s", e)
+            return []
+        return [key[len(self.prefix):] for key in keys]
+
+    def info(self, key):
+        try:
+            size = self.command("STRLEN", self.prefix + key)
+            expires = self.command("PTTL", self.prefix + key)
+        except (OSError, CacheError) as e:
+            logger.warning("Cache server unavailable: %s", e)
+            return None
+        # Negative values when the key does not exist or does not expire
+        if expires < 0:
+            return None
+
+        return {
+            "key": key,
+            "size": size,
+            "age": None,
+            "expires": expires / 1000,
+            "hits": None,
+            }
+
+    def delete_prefix(self, prefix):
+        try:
+            keys = self.server_keys(prefix)
+            if keys:
+                self.command("DEL", *keys)
+        except (OSError, CacheError) as e:
+            logger.warning("Cache server unavailable: %s", e)
+            return 0
+        return len(keys)
+
+    def clear(self):
+        self.delete_prefix("")
+
+    def __len__(self):
+        return len(self.keys())
+
+
+"""Default url of the cache."""
+DEFAULT_URL = "memory://"
+
+
+def from_url(url, ttl, max_entries, max_size=None,
+             compress_threshold=DEFAULT_COMPRESS_THRESHOLD):
+    """Build a cache according to an url.
+
+    The available urls are:
+
+    - ``memory://`` for a :class:`MemoryCache`,
+    - ``sqlite:///relative/file.db`` or ``sqlite:////absolute/file.db`` for
+      a :class:`SqliteCache` (like SQLAlchemy urls),
+    - ``redis://host:port/db`` for a :class:`RedisCache`.
+
+    Params:
+        url (str): the url of the cache.
+        ttl (float): number of seconds an entry is kept by default.
+        max_entries (int): maximum number of entries kept, if the backend
+            handles it.
+        max_size (int|None): maximum size (in bytes) of the entries kept by a
+            :class:`MemoryCache`.
+        compress_threshold (int): size (in bytes) above which the entries of
+            a :class:`MemoryCache` are compressed.
+
+    Returns:
+        CacheBackend: the cache.
+
+    Raises:
+        UnknownCacheBackendError: there is no backend for this url.
+
+    Examples:
+        >>> from_url("memory://", ttl=60, max_entries=10).__class__.__name__
+        'MemoryCache'
+    """
+    parsed = urlparse(url)
+
+    if parsed.scheme == "memory":
+        return MemoryCache(
+            ttl=ttl,
+            max_entries=max_entries,
+            max_size=max_size,
+            compress_threshold=compress_threshold)
+    if parsed.scheme == "sqlite":
+        return SqliteCache(parsed.path[1:], ttl=ttl, max_entries=max_entries)
+    if parsed.scheme == "redis":
+        return RedisCache(
+            parsed.hostname or "localhost",
+            parsed.port or 6379,
+            ttl=ttl,
+            db=int(parsed.path.strip("/") or 0))
+
+    raise UnknownCacheBackendError(
+        "Unknown cache backend for {url}. Available backends are: memory://, "
+        "sqlite:// and redis://.".format(url=url))
@@ -0,0 +1,114 @@
+__author__ = "Pierre-Yves Martin <pym.aldebaran@gmail.com>"
+__copyright__ = "Copyright (C) 2017 GIP BULAC"
+__license__ = "GNU AGPL V3"
+
+# This file is part of Mincer.
+#
+# Mincer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mincer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Mincer.  If not, see <http://www.gnu.org/licenses/>.
+
+# To share the counters between threads
+import threading
+
+# To count easily
+from collections import Counter
+
+
+class Outcome(object):
+    """Possible outcomes of a request to a provider."""
+
+    """Some results were found."""
+    RESULT = "result"
+
+    """The provider explicitly found no result."""
+    NO_RESULT = "no_result"
+
+    """Neither results nor a no result message were found in the page."""
+    UNPARSABLE = "unparsable"
+
+    """The remote host had too many requests in progress."""
+    BUSY = "busy"
+
+    """The remote page could not be retrieved."""
+    REMOTE_ERROR = "remote_error"
+
+    """The deadline of the request was over before the answer was ready."""
+    DEADLINE_EXCEEDED = "deadline_exceeded"
+
+    """The answer was not ready before the deadline of a multi-provider
+    search, it is still being prepared in the background."""
+    PENDING = "pending"
+
+
+class Metrics(object):
+    """Thread safe counters identified by a path of labels.
+
+    Examples:
+        >>> metrics = Metrics()
+        >>> metrics.incr("outcome", "koha-search", Outcome.RESULT)
+        >>> metrics.incr("outcome", "koha-search", Outcome.RESULT)
+        >>> metrics.incr("outcome", "koha-booklist", Outcome.NO_RESULT)
+        >>> metrics.get("outcome", "koha-search", Outcome.RESULT)
+        2
+        >>> metrics.snapshot()
+        {'outcome': {'koha-search': {'result': 2}, 'koha-booklist': {'no_result': 1}}}
+    """
+
+    def __init__(self):
+        self._counters = Counter()
+        self._lock = threading.Lock()
+
+    def incr(self, *path, amount=1):
+        """Increment a counter.
+
+        Params:
+            path (str): the labels identifying the counter.
+            amount (int): how much to add to the counter.
+        """
+        with self._lock:
+            self._counters[path] += amount
+
+    def get(self, *path):
+        """Value of a counter.
+
+        Params:
+            path (str): the labels identifying the counter.
+
+        Returns:
+            int: the value of the counter, ``0`` if it was never incremented.
+        """
+        with self._lock:
+            return self._counters[path]
+
+    def snapshot(self):
+        """All the counters as nested dicts of labels.
+
+        Returns:
+            dict: the counters.
+        """
+        with self._lock:
+            items = list(self._counters.items())
+
+        res = {}
+        for path, value in items:
+            node = res
+            for label in path[:-1]:
+                node = node.setdefault(label, {})
+            node[path[-1]] = value
+
+        return res
+
+    def reset(self):
+        """Set all the counters back to ``0``."""
+        with self._lock:
+            self._counters.clear()
@@ -0,0 +1,342 @@
+__author__ = "Pierre-Yves Martin <pym.aldebaran@gmail.com>"
+__copyright__ = "Copyright (C) 2017 GIP BULAC"
+__license__ = "GNU AGPL V3"
+
+# This file is part of Mincer.
+#
+# Mincer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mincer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Mincer.  If not, see <http://www.gnu.org/licenses/>.
+
+# To place the keys on the hash ring
+import hashlib
+from bisect import bisect
+
+# To share the fetches in progress between threads
+import threading
+
+# To share calls between coroutines
+import asyncio
+
+# To ask the other instances of the group
+import requests
+
+# Convenient constant for HTTP status codes
+try:
+    # Python 3.5+ only
+    from HTTPStatus import OK, BAD_GATEWAY, SERVICE_UNAVAILABLE, GATEWAY_TIMEOUT
+except Exception as e:
+    from http.client import OK, BAD_GATEWAY, SERVICE_UNAVAILABLE, GATEWAY_TIMEOUT
+
+# To report the failures of the owner the same way as a remote host
+from mincer import remote
+
+
+class PeerUnavailableError(Exception):
+    """
+    Raised by :class:`PeerGroup` when the owner of a key could not answer
+    at all, so the page must be fetched without it.
+    """
+    pass
+
+
+class PeerConfigurationError(Exception):
+    """
+    Raised by :class:`PeerGroup` when this instance is not one of the
+    instances of the group.
+    """
+    pass
+
+
+def key_hash(key):
+    """Position of a key on a :class:`HashRing`.
+
+    Params:
+        key (str): any key.
+
+    Returns:
+        int: the position, the same on every instance of Mincer.
+
+    Examples:
+        >>> key_hash("page:http://host.org/") == key_hash("page:http://host.org/")
+        True
+    """
+    return int.from_bytes(
+        hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing(object):
+    """Consistent hashing of keys over a set of nodes.
+
+    Every node is placed at several points of a ring and a key belongs to the
+    first node after its own position. Adding or removing a node only moves
+    the keys of its neighbours.
+
+    Arguments:
+        nodes (list of str): the names of the nodes.
+        replicas (int): number of points of each node on the ring, more
+            points give a fairer share of the keys.
+
+    Examples:
+        >>> ring = HashRing(["http://a:5000", "http://b:5000"])
+        >>> ring.owner("page:http://host.org/") in ring.nodes
+        True
+        >>> ring.owner("page:http://host.org/") == HashRing(
+        ...     ["http://b:5000", "http://a:5000"]).owner("page:http://host.org/")
+        True
+    """
+
+    def __init__(self, nodes, replicas=64):
+        self.nodes = sorted(set(nodes))
+        self.points = sorted(
+            (key_hash("{node}#{i}".format(node=node, i=i)), node)
+            for node in self.nodes
+            for i in range(replicas))
+        self.positions = [position for position, _ in self.points]
+
+    def owner(self, key):
+        """The node a key belongs to.
+
+        Params:
+            key (str): any key.
+
+        Returns:
+            str|None: the name of the node, ``None`` if the ring is empty.
+        """
+        if not self.points:
+            return None
+
+        index = bisect(self.positions, key_hash(key)) % len(self.points)
+        return self.points[index][1]
+
+
+class SingleFlight(object):
+    """Share a call in progress between all the threads asking for the same
+    key.
+
+    Examples:
+        >>> flight = SingleFlight()
+        >>> flight.do("key", lambda: "page")
+        'page'
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, deadline=None, **kwargs):
+        """Call a function unless a call for the same key is already in
+        progress, in which case its outcome is awaited and shared.
+
+        A caller never waits longer than its own deadline, and the deadline
+        of another caller being exceeded is not shared: the call is made
+        again by the callers that still have time.
+
+        Params:
+            key (str): what identifies the call.
+            function (callable): the function to call.
+            deadline (mincer.remote.Deadline|None): the deadline of the
+                caller, ``None`` to wait as long as needed.
+
+        Returns:
+            the value returned by the call.
+
+        Raises:
+            mincer.remote.DeadlineExceededError: the deadline of the caller
+                was over before the call in progress ended.
+            Exception: the one raised by the call.
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = {"done": threading.Event()}
+
+            if leader:
+                break
+
+            timeout = deadline.remaining() if deadline is not None else None
+            if not call["done"].wait(timeout):
+                raise remote.DeadlineExceededError(
+                    "deadline exceeded while waiting for {key}".format(
+                        key=key))
+            error = call.get("error")
+            if error is None:
+                return call["value"]
+            if not isinstance(error, remote.DeadlineExceededError)\
+                    or deadline is None or deadline.expired():
+                raise error
+            # Only the deadline of the caller in progress was too short
+
+        try:
+            call["value"] = function(*args, **kwargs)
+            return call["value"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+
+class AsyncSingleFlight(object):
+    """Same as :class:`SingleFlight` but shares a coroutine in progress
+    between all the coroutines of an event loop asking for the same key.
+
+    Examples:
+        >>> async def fetch():
+        ...     return "page"
+        >>> asyncio.run(AsyncSingleFlight().do("key", fetch))
+        'page'
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, function, *args, deadline=None, **kwargs):
+        """Await a coroutine function unless a call for the same key is
+        already in progress, in which case its outcome is awaited and shared.
+
+        See :meth:`SingleFlight.do`.
+        """
+        while True:
+            call = self._calls.get(key)
+            if call is None:
+                break
+
+            timeout = deadline.remaining() if deadline is not None else None
+            try:
+                return await asyncio.wait_for(asyncio.shield(call), timeout)
+            except asyncio.TimeoutError:
+                raise remote.DeadlineExceededError(
+                    "deadline exceeded while waiting for {key}".format(
+                        key=key))
+            except remote.DeadlineExceededError:
+                # Only the deadline of the caller in progress may have been
+                # too short
+                if deadline is None or deadline.expired():
+                    raise
+
+        call = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await function(*args, **kwargs)
+            call.set_result(value)
+            return value
+        except BaseException as e:
+            # A cancelled call is made again by the callers still waiting
+            call.set_exception(
+                e if isinstance(e, Exception) else
+                remote.DeadlineExceededError("call cancelled"))
+            # Nobody may be waiting for the error
+            call.exception()
+            raise
+        finally:
+            del self._calls[key]
+
+
+class PeerGroup(object):
+    """A group of Mincer instances sharing the remote pages.
+
+    Each key of the cache is owned by one instance of the group, chosen by
+    consistent hashing. An instance missing a page asks its owner, which is
+    the only one to fetch it from the remote host. The cache capacity of the
+    group grows with the number of instances.
+
+    Arguments:
+        self_url (str): base url of this instance as listed in ``urls``.
+        urls (list of str): base urls of all the instances of the group.
+        replicas (int): see :class:`HashRing`.
+
+    Raises:
+        PeerConfigurationError: ``self_url`` is not one of ``urls``, so the
+            instances would not agree on the owners of the keys.
+
+    Examples:
+        >>> group = PeerGroup("http://a:5000", ["http://a:5000"])
+        >>> group.owner("page:http://host.org/") is None
+        True
+    """
+
+    def __init__(self, self_url, urls, replicas=64):
+        urls = [url.rstrip("/") for url in urls]
+        if not self_url:
+            raise PeerConfigurationError(
+                "The base url of this instance is needed to join the group "
+                "{urls}.".format(urls=urls))
+        self.self_url = self_url.rstrip("/")
+        if self.self_url not in urls:
+            raise PeerConfigurationError(
+                "The base url {url} of this instance is not one of the group "
+                "{urls}.".format(url=self.self_url, urls=urls))
+
+        self.ring = HashRing(urls, replicas)
+
+    def owner(self, key):
+        """The instance a key belongs to.
+
+        Params:
+            key (str): the key of the cache.
+
+        Returns:
+            str|None: the base url of the owner, ``None`` if this instance
+            owns the key.
+        """
+        owner = self.ring.owner(key)
+        return None if owner == self.self_url else owner
+
+    def fetch(self, url, headers, deadline):
+        """Ask the owner of a page for its content.
+
+        Params:
+            url (str): the url of the page on the owner.
+            headers (dict): headers of the request.
+            deadline (mincer.remote.Deadline): the deadline of the request.
+
+        Returns:
+            str: the content of the page.
+
+        Raises:
+            mincer.remote.DeadlineExceededError: the deadline was over before
+                the owner answered.
+            mincer.remote.BulkheadFullError: the remote host was too busy for
+                the owner.
+            mincer.remote.RemoteError: the owner could not retrieve the page.
+            PeerUnavailableError: the owner did not answer.
+        """
+        try:
+            response = requests.get(
+                url, headers=headers, timeout=deadline.remaining())
+        except requests.RequestException as e:
+            if deadline.expired():
+                raise remote.DeadlineExceededError(
+                    "The deadline of {url} was over before it answered.".format(
+                        url=url)) from e
+            raise PeerUnavailableError(
+                "{url} could not be retrieved: {err}".format(url=url, err=e)) from e
+
+        if response.status_code == OK:
+            return response.text
+        if response.status_code == GATEWAY_TIMEOUT:
+            raise remote.DeadlineExceededError(
+                "The deadline of {url} is over.".format(url=url))
+        if response.status_code == SERVICE_UNAVAILABLE:
+            raise remote.BulkheadFullError(
+                "The remote host of {url} is busy.".format(url=url))
+        if response.status_code == BAD_GATEWAY:
+            raise remote.RemoteError(
+                "The owner of {url} could not retrieve it.".format(url=url))
+
+        raise PeerUnavailableError(
+            "{url} answered with the status {status}.".format(
+                url=url, status=response.status_code))
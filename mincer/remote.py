@@ -0,0 +1,693 @@
+__author__ = "Pierre-Yves Martin <pym.aldebaran@gmail.com>"
+__copyright__ = "Copyright (C) 2017 GIP BULAC"
+__license__ = "GNU AGPL V3"
+
+# This file is part of Mincer.
+#
+# Mincer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mincer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Mincer.  If not, see <http://www.gnu.org/licenses/>.
+
+# To manipulate urls easily
+from urllib.parse import urlparse
+
+# To share the limits between threads
+import threading
+
+# To share the limits between coroutines
+import asyncio
+
+# To create context managers easily
+from contextlib import contextmanager, asynccontextmanager
+
+# To measure latencies and wait between retries
+import time
+
+# To add some jitter to the retries
+import random
+
+# To keep only the most recent latencies
+from collections import deque, defaultdict
+
+# To run hedged requests side by side
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# HTTP library for Python, safe for human consumption
+# See http://docs.python-requests.org/en/master/
+import requests
+
+"""First HTTP status of the server errors, worth a retry."""
+SERVER_ERROR = 500
+
+
+class BulkheadFullError(Exception):
+    """
+    Raised by :class:`Bulkheads` and :class:`AsyncBulkheads` when a remote host
+    already has all the concurrent requests it is allowed.
+    """
+    pass
+
+
+class RemoteError(Exception):
+    """
+    Raised by :class:`Fetcher` and :class:`AsyncFetcher` when a remote page
+    could not be retrieved (connection error, timeout or server error) even
+    after all the retries.
+    """
+    pass
+
+
+class DeadlineExceededError(RemoteError):
+    """
+    Raised by :class:`Fetcher` and :class:`AsyncFetcher` when the deadline of
+    a remote page is over before it was retrieved.
+    """
+    pass
+
+
+def get_host(url):
+    """Returns the host of a given ``url``, used to group remote requests.
+
+    Params:
+        url (str): a valid fullpath url.
+
+    Returns:
+        str: the netloc of the url.
+
+    Examples:
+        >>> get_host("http://mybase.org:8080/evil/dude/plan.html")
+        'mybase.org:8080'
+    """
+    return urlparse(url).netloc
+
+
+class Bulkheads(object):
+    """Limit the number of concurrent requests to each remote host.
+
+    Each host has its own share of the concurrency of Mincer, so a slow host
+    can only block its own requests while the requests to the other hosts
+    keep their normal latency.
+
+    Arguments:
+        capacity (int): maximum number of concurrent requests to a host.
+        capacities (dict of str to int): capacity of some specific hosts, used
+            instead of ``capacity``.
+        timeout (float|None): maximum time (in seconds) to wait for a free
+            slot. ``None`` means waiting forever.
+
+    Examples:
+        >>> bulkheads = Bulkheads(capacity=1, timeout=0)
+        >>> with bulkheads.slot("http://host.org/page.html"):
+        ...     with bulkheads.slot("http://host.org/other.html"):
+        ...         pass # doctest: +IGNORE_EXCEPTION_DETAIL
+        Traceback (most recent call last):
+        BulkheadFullError
+    """
+
+    def __init__(self, capacity, capacities=None, timeout=None):
+        self.capacity = capacity
+        self.capacities = dict(capacities or {})
+        self.timeout = timeout
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def capacity_for(self, host):
+        """Maximum number of concurrent requests to a host.
+
+        Params:
+            host (str): the host as returned by :func:`get_host`.
+
+        Returns:
+            int: the capacity of the host.
+        """
+        return self.capacities.get(host, self.capacity)
+
+    def new_semaphore(self, host):
+        return threading.BoundedSemaphore(self.capacity_for(host))
+
+    def semaphore(self, host):
+        """The semaphore guarding the requests to a host."""
+        with self._lock:
+            try:
+                return self._semaphores[host]
+            except KeyError:
+                sem = self._semaphores[host] = self.new_semaphore(host)
+                return sem
+
+    def full_error(self, host):
+        return BulkheadFullError(
+            "All the {capacity} slots for {host} are in use.".format(
+                capacity=self.capacity_for(host), host=host))
+
+    def wait_time(self, wait, deadline):
+        """Maximum time (in seconds) to wait for a free slot, ``None``
+        meaning forever."""
+        if not wait:
+            return 0
+        if deadline is None:
+            return self.timeout
+        if self.timeout is None:
+            return deadline.remaining()
+        return min(self.timeout, deadline.remaining())
+
+    def wait_error(self, url, host, deadline):
+        """The error to raise when no slot was freed in time."""
+        if deadline is not None and deadline.expired():
+            return DeadlineExceededError(
+                "The deadline of {url} was over while waiting for a slot "
+                "for {host}.".format(url=url, host=host))
+
+        return self.full_error(host)
+
+    @contextmanager
+    def slot(self, url, wait=True, deadline=None):
+        """Reserve a slot for a request to the host of an url.
+
+        Params:
+            url (str): the url about to be requested.
+            wait (bool): if ``False`` only a slot that is free right now is
+                taken.
+            deadline (Deadline|None): the deadline of the request, no slot
+                is awaited after it.
+
+        Raises:
+            BulkheadFullError: no slot was freed in time.
+            DeadlineExceededError: the deadline was over before a slot was
+                freed.
+        """
+        host = get_host(url)
+        sem = self.semaphore(host)
+
+        if not sem.acquire(timeout=self.wait_time(wait, deadline)):
+            raise self.wait_error(url, host, deadline)
+        try:
+            yield
+        finally:
+            sem.release()
+
+
+class AsyncBulkheads(Bulkheads):
+    """Same as :class:`Bulkheads` for coroutines running in one event loop.
+
+    They may share the slots of the :class:`Bulkheads` of the threads of the
+    same process, see :meth:`sharing`.
+    """
+
+    """Delay (in seconds) between two attempts to take a shared slot."""
+    POLL_INTERVAL = 0.01
+
+    def __init__(self, capacity, capacities=None, timeout=None):
+        super(AsyncBulkheads, self).__init__(capacity, capacities, timeout)
+        self.shared = None
+
+    @classmethod
+    def sharing(cls, bulkheads):
+        """Build bulkheads sharing the slots of some threads.
+
+        The requests of the coroutines and of the threads to a host are then
+        limited together by the capacity of the host. A busy shared slot is
+        awaited by polling it every :attr:`POLL_INTERVAL` seconds, so the
+        event loop is never blocked.
+
+        Params:
+            bulkheads (Bulkheads): the bulkheads of the threads.
+
+        Returns:
+            AsyncBulkheads: bulkheads with the same limits and slots.
+        """
+        shared = cls(bulkheads.capacity, bulkheads.capacities,
+                     bulkheads.timeout)
+        shared.shared = bulkheads
+        return shared
+
+    def new_semaphore(self, host):
+        return asyncio.BoundedSemaphore(self.capacity_for(host))
+
+    def semaphore(self, host):
+        if self.shared is not None:
+            return self.shared.semaphore(host)
+        return super(AsyncBulkheads, self).semaphore(host)
+
+    async def acquire_shared(self, url, host, sem, wait, deadline):
+        """Take a slot of the shared bulkheads without blocking the event
+        loop, see :meth:`Bulkheads.slot`."""
+        timeout = self.wait_time(wait, deadline)
+        start = time.monotonic()
+        while not sem.acquire(blocking=False):
+            if timeout is not None and time.monotonic() - start >= timeout:
+                raise self.wait_error(url, host, deadline)
+            await asyncio.sleep(self.POLL_INTERVAL)
+
+    @asynccontextmanager
+    async def slot(self, url, wait=True, deadline=None):
+        host = get_host(url)
+        sem = self.semaphore(host)
+
+        if self.shared is not None:
+            await self.acquire_shared(url, host, sem, wait, deadline)
+        # A free slot is taken right away even with a null timeout
+        elif not sem.locked():
+            await sem.acquire()
+        elif not wait:
+            raise self.full_error(host)
+        else:
+            try:
+                await asyncio.wait_for(
+                    sem.acquire(), self.wait_time(wait, deadline))
+            except asyncio.TimeoutError:
+                raise self.wait_error(url, host, deadline)
+        try:
+            yield
+        finally:
+            sem.release()
+
+
+class Deadline(object):
+    """A point in time after which a request is useless.
+
+    Arguments:
+        timeout (float): number of seconds before the deadline.
+
+    Examples:
+        >>> Deadline(10).expired()
+        False
+        >>> Deadline(0).remaining()
+        0
+    """
+
+    def __init__(self, timeout):
+        self.expires = time.monotonic() + timeout
+
+    def remaining(self):
+        """Number of seconds before the deadline (never negative)."""
+        return max(0, self.expires - time.monotonic())
+
+    def expired(self):
+        """Tell if the deadline is over."""
+        return self.remaining() <= 0
+
+    def earliest(self, other):
+        """The earliest of two deadlines.
+
+        Params:
+            other (Deadline|None): another deadline, ``None`` meaning never.
+
+        Returns:
+            Deadline: ``self`` or ``other``.
+        """
+        if other is None or self.expires <= other.expires:
+            return self
+        return other
+
+    @classmethod
+    def parse(cls, budget, default):
+        """Build a deadline from the time budget given by a client.
+
+        Params:
+            budget (str|None): the number of seconds left to the client, or
+                ``None`` to use the ``default`` one.
+            default (float): number of seconds used without ``budget``.
+
+        Returns:
+            Deadline: the deadline of the request.
+
+        Raises:
+            ValueError: ``budget`` is not a positive number of seconds.
+
+        Examples:
+            >>> 2 < Deadline.parse("3", 10).remaining() <= 3
+            True
+            >>> 9 < Deadline.parse(None, 10).remaining() <= 10
+            True
+            >>> Deadline.parse("-1", 10) # doctest: +IGNORE_EXCEPTION_DETAIL
+            Traceback (most recent call last):
+            ValueError
+        """
+        if budget is None:
+            return cls(default)
+
+        timeout = float(budget)
+        if not 0 < timeout < float("inf"):
+            raise ValueError(
+                "A deadline must be a positive number of seconds, "
+                "not {budget}.".format(budget=budget))
+
+        return cls(timeout)
+
+
+class RetryPolicy(object):
+    """How failed requests are retried: exponential backoff with full jitter.
+
+    Arguments:
+        retries (int): maximum number of retries after the first attempt.
+        backoff (float): base delay (in seconds) before the first retry, it is
+            doubled after each retry.
+        max_backoff (float): maximum delay (in seconds) between two attempts.
+
+    Examples:
+        >>> policy = RetryPolicy(retries=3, backoff=0.1, max_backoff=0.3)
+        >>> 0 <= policy.delay(0) <= 0.1
+        True
+        >>> 0 <= policy.delay(5) <= 0.3
+        True
+    """
+
+    def __init__(self, retries=0, backoff=0.1, max_backoff=2.0):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt):
+        """Random delay to wait before retrying a failed attempt.
+
+        Params:
+            attempt (int): number of the failed attempt, starting from 0.
+
+        Returns:
+            float: the delay in seconds.
+        """
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+class LatencyTracker(object):
+    """Keep the most recent latencies of the requests to each provider.
+
+    Arguments:
+        size (int): number of latencies kept for each provider.
+        min_samples (int): number of latencies needed before computing
+            percentiles.
+
+    Examples:
+        >>> tracker = LatencyTracker(min_samples=10)
+        >>> for ms in range(100):
+        ...     tracker.add("koha", ms / 1000)
+        >>> tracker.percentile("koha", 95)
+        0.095
+        >>> tracker.percentile("unknown", 95) is None
+        True
+    """
+
+    def __init__(self, size=100, min_samples=20):
+        self.min_samples = min_samples
+        self._latencies = defaultdict(lambda: deque(maxlen=size))
+        self._lock = threading.Lock()
+
+    def add(self, key, latency):
+        """Record a latency (in seconds)."""
+        with self._lock:
+            self._latencies[key].append(latency)
+
+    def percentile(self, key, percent):
+        """Percentile of the latencies of a provider.
+
+        Returns:
+            float|None: the percentile in seconds or ``None`` if there are not
+            enough latencies known.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies.get(key, ()))
+
+        if len(latencies) < self.min_samples:
+            return None
+
+        return latencies[min(len(latencies) - 1,
+                             len(latencies) * percent // 100)]
+
+
+class Fetcher(object):
+    """Retrieve remote pages while protecting Mincer from slow or failing
+    providers.
+
+    Each request respects the limits of concurrent requests of its host and
+    its deadline. Connection errors, timeouts and server errors are retried
+    with a jittered exponential backoff. Optionally a second identical request
+    is sent when the first one is slower than 95% of the recent requests to
+    the same provider (hedged request) and the fastest answer is used.
+
+    Arguments:
+        bulkheads (Bulkheads): the limits of concurrent requests to each host.
+        timeout (float): time budget (in seconds) of a page, retries
+            included, when no deadline is given.
+        retry (RetryPolicy|None): how failed requests are retried. ``None``
+            means no retry.
+        hedging (bool): if ``True`` slow requests are hedged.
+        headers (dict|None): headers sent with every request.
+        hedging_workers (int): maximum number of threads sending the
+            requests that may be hedged. When they are all busy, requests are
+            sent by the calling thread without hedging rather than queued.
+    """
+
+    """Percentile of the latencies after which a request is hedged."""
+    HEDGING_PERCENTILE = 95
+
+    def __init__(self, bulkheads, timeout, retry=None, hedging=False,
+                 headers=None, hedging_workers=32):
+        self.bulkheads = bulkheads
+        self.timeout = timeout
+        self.retry = retry or RetryPolicy()
+        self.hedging = hedging
+        self.headers = headers or {}
+        self.hedging_workers = hedging_workers
+        self.latencies = LatencyTracker()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._idle_workers = threading.BoundedSemaphore(hedging_workers)
+
+    def hedging_delay(self, key, deadline):
+        """Delay after which a request must be hedged.
+
+        Returns:
+            float|None: the delay in seconds or ``None`` if the request must
+            not be hedged.
+        """
+        if not self.hedging:
+            return None
+
+        delay = self.latencies.percentile(key, self.HEDGING_PERCENTILE)
+        if delay is None or delay >= deadline.remaining():
+            return None
+
+        return delay
+
+    def check_deadline(self, url, deadline):
+        if deadline.expired():
+            raise DeadlineExceededError(
+                "The deadline of {url} is over.".format(url=url))
+
+    def request_error(self, url, deadline, err):
+        """The error to raise when a request failed."""
+        if deadline.expired():
+            return DeadlineExceededError(
+                "The deadline of {url} was over before it answered.".format(
+                    url=url))
+
+        return RemoteError(
+            "{url} could not be retrieved: {err}".format(url=url, err=err))
+
+    def check_response(self, url, status):
+        if status >= SERVER_ERROR:
+            raise RemoteError(
+                "{url} answered with the server error {status}.".format(
+                    url=url, status=status))
+
+    def attempt(self, url, deadline, key, wait=True):
+        """Request a page once.
+
+        Raises:
+            RemoteError: the request failed.
+            BulkheadFullError: no slot was freed in time for the host.
+        """
+        with self.bulkheads.slot(url, wait=wait, deadline=deadline):
+            self.check_deadline(url, deadline)
+            start = time.monotonic()
+            try:
+                response = requests.get(
+                    url,
+                    headers=self.headers,
+                    timeout=deadline.remaining())
+            except requests.RequestException as e:
+                raise self.request_error(url, deadline, e) from e
+
+        self.check_response(url, response.status_code)
+        self.latencies.add(key, time.monotonic() - start)
+
+        return response.text
+
+    def submit(self, url, deadline, key, wait=True):
+        """Request a page once in a worker.
+
+        Returns:
+            concurrent.futures.Future|None: the result of the request or
+            ``None`` if no worker is idle.
+        """
+        if not self._idle_workers.acquire(blocking=False):
+            return None
+
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.hedging_workers)
+
+        try:
+            future = self._executor.submit(
+                self.attempt, url, deadline, key, wait)
+        except BaseException:
+            self._idle_workers.release()
+            raise
+        future.add_done_callback(lambda _: self._idle_workers.release())
+        return future
+
+    def hedged_attempt(self, url, deadline, key):
+        """Request a page once, hedging the request if it is too slow."""
+        delay = self.hedging_delay(key, deadline)
+        if delay is None:
+            return self.attempt(url, deadline, key)
+
+        first = self.submit(url, deadline, key)
+        if first is None:
+            # Never wait for a worker
+            return self.attempt(url, deadline, key)
+
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+
+        # The hedged request only uses a slot and a worker that are free right
+        # now. The slowest request can not be cancelled and just ends in
+        # background.
+        second = self.submit(url, deadline, key, False)
+        if second is None:
+            return first.result()
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+
+        return first.result()
+
+    def fetch(self, url, key=None, deadline=None):
+        """Retrieve a remote page.
+
+        Params:
+            url (str): the full remote url.
+            key (str|None): the provider the latencies are recorded for.
+            deadline (Deadline|None): the deadline of the request the page is
+                needed for. The page is never given more than ``timeout``
+                seconds from now anyway.
+
+        Returns:
+            str: the content of the page.
+
+        Raises:
+            DeadlineExceededError: the deadline was over before the page was
+                retrieved.
+            RemoteError: the page could not be retrieved.
+            BulkheadFullError: no slot was freed in time for the host.
+        """
+        deadline = Deadline(self.timeout).earliest(deadline)
+
+        attempt = 0
+        while True:
+            try:
+                return self.hedged_attempt(url, deadline, key)
+            except RemoteError:
+                delay = self.retry.delay(attempt)
+                if attempt >= self.retry.retries \
+                        or delay >= deadline.remaining():
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+
+class AsyncFetcher(Fetcher):
+    """Same as :class:`Fetcher` for coroutines running in one event loop.
+
+    Arguments:
+        client (httpx.AsyncClient): the HTTP client to use.
+        bulkheads (AsyncBulkheads): the limits of concurrent requests to each
+            host.
+
+    The other arguments are the ones of :class:`Fetcher`, ``hedging_workers``
+    being useless since the requests are coroutines.
+    """
+
+    def __init__(self, client, bulkheads, timeout, retry=None, hedging=False,
+                 headers=None, hedging_workers=32):
+        super(AsyncFetcher, self).__init__(
+            bulkheads, timeout, retry, hedging, headers, hedging_workers)
+        self.client = client
+
+    async def attempt(self, url, deadline, key, wait=True):
+        # Imported here since only the asynchronous pipeline needs it
+        import httpx
+
+        async with self.bulkheads.slot(url, wait=wait, deadline=deadline):
+            self.check_deadline(url, deadline)
+            start = time.monotonic()
+            try:
+                response = await self.client.get(
+                    url,
+                    headers=self.headers,
+                    timeout=deadline.remaining())
+            except httpx.HTTPError as e:
+                raise self.request_error(url, deadline, e) from e
+
+        self.check_response(url, response.status_code)
+        self.latencies.add(key, time.monotonic() - start)
+
+        return response.text
+
+    async def hedged_attempt(self, url, deadline, key):
+        delay = self.hedging_delay(key, deadline)
+        if delay is None:
+            return await self.attempt(url, deadline, key)
+
+        first = asyncio.ensure_future(self.attempt(url, deadline, key))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+
+        # The hedged request only uses a slot that is free right now
+        second = asyncio.ensure_future(
+            self.attempt(url, deadline, key, wait=False))
+        pending = {first, second}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+        finally:
+            # The slowest request is useless
+            for task in pending:
+                task.cancel()
+
+        return first.result()
+
+    async def fetch(self, url, key=None, deadline=None):
+        deadline = Deadline(self.timeout).earliest(deadline)
+
+        attempt = 0
+        while True:
+            try:
+                return await self.hedged_attempt(url, deadline, key)
+            except RemoteError:
+                delay = self.retry.delay(attempt)
+                if attempt >= self.retry.retries \
+                        or delay >= deadline.remaining():
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
@@ -20,16 +20,57 @@ __license__ = "GNU AGPL V3"
 # To manipulate urls easily
 from urllib.parse import urlparse
 from urllib.parse import urlunparse
+from urllib.parse import urljoin
+from urllib.parse import unquote_plus
+
+# To normalize unicode parameters
+import unicodedata
+
+# To collapse the whitespaces of the results
+import re
 
 # To create decorator easily
 from functools import wraps
 
+# To cache the analysis of selectors
+from functools import lru_cache
+
+# To memoize the extractions of identical pages
+import hashlib
+import inspect
+import threading
+from collections import OrderedDict
+
+# To extract results from big pages on several CPU cores
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
 # To analyse deeply HTML pages or partials
 from pyquery import PyQuery
 
+# To analyse HTML pages without the PyQuery overhead
+import lxml.html
+from lxml import etree
+from pyquery.cssselectpatch import JQueryTranslator
+
+# To analyse JQuery selectors without any page
+from cssselect import parse as parse_selector
+from cssselect import SelectorError
+from cssselect.parser import Class, Hash, CombinedSelector
+
 # For building HTTP response and be able to modify them
 from flask import make_response
 
+# To compress the answers
+import gzip
+
+# Brotli compression is optional
+# See https://github.com/google/brotli
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 
 def once(lst):
     """
@@ -91,7 +132,513 @@ class NoMatchError(Exception):
     pass
 
 
-def extract_content_from_html(selector, expected_content, html):
+class UnknownEngineError(Exception):
+    """
+    Raised by :func:`get_engine` when asked for an engine that does not exist.
+    """
+    pass
+
+
+class HtmlEngine(object):
+    """Interface of the HTML engines used to parse pages and select nodes in
+    them.
+
+    Whatever the engine, the selected nodes are `lxml` elements so that the
+    rest of the processing (link rewriting, serialization...) is shared.
+    """
+
+    """Name of the engine as it can be used in the configuration."""
+    name = None
+
+    def parse(self, html):
+        """Parse an HTML document.
+
+        Arguments:
+            html (str): a string containing an HTML document.
+
+        Returns:
+            the parsed document, only meaningful to :meth:`select_in`.
+        """
+        raise NotImplementedError()
+
+    def select_in(self, document, selector):
+        """Select nodes in a parsed document.
+
+        Arguments:
+            document: a document given by :meth:`parse`.
+            selector (str): a JQuery selector query.
+
+        Returns:
+            list(lxml.etree.Element): the selected nodes in document order.
+        """
+        raise NotImplementedError()
+
+    def select(self, html, selector):
+        """Parse an HTML document and select nodes in it.
+
+        Arguments:
+            html (str): a string containing an HTML document.
+            selector (str): a JQuery selector query.
+
+        Returns:
+            list(lxml.etree.Element): the selected nodes in document order.
+        """
+        return self.select_in(self.parse(html), selector)
+
+    def select_first(self, html, selectors):
+        """Parse an HTML document and select nodes in it with the first
+        selector matching something.
+
+        The document is parsed once whatever the number of selectors tried.
+
+        Arguments:
+            html (str): a string containing an HTML document.
+            selectors (list(str)): JQuery selector queries, in the order they
+                are tried.
+
+        Returns:
+            tuple(int, list(lxml.etree.Element)): the index of the matching
+            selector and the selected nodes, ``(None, [])`` if no selector
+            matched.
+        """
+        document = self.parse(html)
+        for index, selector in enumerate(selectors):
+            matches = self.select_in(document, selector)
+            if matches:
+                return index, matches
+
+        return None, []
+
+    def outer_html(self, element):
+        """Serialize a node without its tail.
+
+        Arguments:
+            element (lxml.etree.Element): the node to serialize.
+
+        Returns:
+            str: the HTML code of the node.
+        """
+        tail = element.tail
+        element.tail = None
+        try:
+            return etree.tostring(element, encoding=str, method="html")
+        finally:
+            element.tail = tail
+
+    def text(self, elements):
+        """Text content of some nodes with all whitespaces squashed.
+
+        Arguments:
+            elements (list(lxml.etree.Element)): the nodes to analyse.
+
+        Returns:
+            str: the text content of all the nodes separated by spaces.
+        """
+        return " ".join(
+            " ".join(element.text_content().split()) for element in elements)
+
+
+class PyQueryEngine(HtmlEngine):
+    """Engine relying on PyQuery, kept for compatibility."""
+
+    name = "pyquery"
+
+    def parse(self, html):
+        return PyQuery(html)
+
+    def select_in(self, document, selector):
+        return list(document(selector))
+
+    def text(self, elements):
+        return PyQuery(elements).text()
+
+
+class LxmlEngine(HtmlEngine):
+    """Engine using lxml directly with selectors compiled to XPath once.
+
+    It understands the same JQuery selector syntax as PyQuery but avoids
+    building PyQuery wrapper objects.
+    """
+
+    name = "lxml"
+
+    def compile(self, selector):
+        """Compile a JQuery selector into an XPath expression, see
+        :func:`compile_selector`."""
+        return compile_selector(selector)
+
+    def parse(self, html):
+        # The lxml parser does not accept empty documents
+        if not html.strip():
+            return None
+
+        return lxml.html.fromstring(html)
+
+    def select_in(self, document, selector):
+        if document is None:
+            return []
+
+        return self.compile(selector)(document)
+
+
+@lru_cache(maxsize=256)
+def compile_selector(selector):
+    """Compile a JQuery selector into an XPath expression.
+
+    The expression can be applied to any node, it selects the node itself
+    and its descendants matching the selector.
+
+    Arguments:
+        selector (str): a JQuery selector query.
+
+    Returns:
+        lxml.etree.XPath: the compiled selector.
+
+    Raises:
+        SelectorError: the selector is not valid.
+
+    Examples:
+        >>> element = lxml.html.fragment_fromstring('<div><b>hip</b></div>')
+        >>> [node.tag for node in compile_selector("b, div")(element)]
+        ['div', 'b']
+    """
+    return etree.XPath(
+        JQueryTranslator().css_to_xpath(
+            selector.replace('[@', '['),
+            prefix='descendant-or-self::'))
+
+
+def parse_selectors(selectors):
+    """Check a semicolon separated list of JQuery selectors.
+
+    Semicolons are used since commas are part of the selector syntax.
+
+    Arguments:
+        selectors (str): the selectors.
+
+    Returns:
+        tuple(str): the selectors.
+
+    Raises:
+        SelectorError: one of the selectors is not valid.
+
+    Examples:
+        >>> parse_selectors("#results .item; table.results td ;")
+        ('#results .item', 'table.results td')
+        >>> parse_selectors("")
+        ()
+    """
+    selectors = tuple(
+        selector.strip() for selector in selectors.split(";")
+        if selector.strip())
+    for selector in selectors:
+        compile_selector(selector)
+
+    return selectors
+
+
+"""All the available engines by name."""
+ENGINES = {engine.name: engine for engine in (PyQueryEngine(), LxmlEngine())}
+
+"""Name of the engine used when none is specified."""
+DEFAULT_ENGINE = PyQueryEngine.name
+
+
+def get_engine(engine=None):
+    """Retrieve an HTML engine.
+
+    Arguments:
+        engine (str|HtmlEngine|None): the name of the engine, an engine or
+            ``None`` (or ``''``) for the default engine.
+
+    Returns:
+        HtmlEngine: the requested engine.
+
+    Raises:
+        UnknownEngineError: there is no engine with this name.
+
+    Examples:
+        >>> get_engine("lxml").name
+        'lxml'
+        >>> get_engine().name
+        'pyquery'
+    """
+    if isinstance(engine, HtmlEngine):
+        return engine
+
+    try:
+        return ENGINES[engine or DEFAULT_ENGINE]
+    except KeyError:
+        raise UnknownEngineError(
+            "Unknown HTML engine {name}. Available engines are: {names}."
+            .format(name=engine, names=", ".join(sorted(ENGINES))))
+
+
+class UnknownNormalizerError(Exception):
+    """Raised by :func:`parse_normalizers` if a normalizer does not exist."""
+    pass
+
+
+def normalize_nfc(text):
+    """Compose the unicode characters of a text.
+
+    Examples:
+        >>> normalize_nfc("e\u0301") == "\u00e9"
+        True
+    """
+    return unicodedata.normalize("NFC", text)
+
+
+def collapse_spaces(text):
+    """Replace any sequence of white spaces in a text by a single space and
+    remove the leading and trailing ones.
+
+    Examples:
+        >>> collapse_spaces("  victor \t hugo ")
+        'victor hugo'
+    """
+    return " ".join(text.split())
+
+
+"""Available normalizers of the parameters of requests by name."""
+NORMALIZERS = {
+    "nfc": normalize_nfc,
+    "spaces": collapse_spaces,
+    "casefold": str.casefold,
+    }
+
+"""Normalizers of the providers without their own normalizers."""
+DEFAULT_NORMALIZERS = ("nfc", "spaces")
+
+
+def parse_normalizers(names):
+    """Check a comma separated list of normalizer names.
+
+    Arguments:
+        names (str): the names of the normalizers, in the order they are
+            applied.
+
+    Returns:
+        tuple(str): the names of the normalizers.
+
+    Raises:
+        UnknownNormalizerError: one of the normalizers does not exist.
+
+    Examples:
+        >>> parse_normalizers("nfc, spaces,casefold")
+        ('nfc', 'spaces', 'casefold')
+        >>> parse_normalizers("")
+        ()
+    """
+    normalizers = tuple(
+        name.strip() for name in names.split(",") if name.strip())
+    for name in normalizers:
+        if name not in NORMALIZERS:
+            raise UnknownNormalizerError(
+                "Unknown normalizer {name}. Available normalizers are: "
+                "{names}.".format(name=name, names=", ".join(sorted(NORMALIZERS))))
+
+    return normalizers
+
+
+def normalize_param(param, normalizers=DEFAULT_NORMALIZERS):
+    """Give a canonical form to the parameter of a request, so that
+    equivalent requests share the same remote url and the same cache entries.
+
+    The parameter is decoded whatever its encoding (``+`` or ``%20`` for
+    spaces...) before the normalizers are applied.
+
+    Arguments:
+        param (str): the parameter, url encoded or not.
+        normalizers (iterable(str)): names of the normalizers to apply, see
+            :data:`NORMALIZERS`.
+
+    Returns:
+        str: the decoded and normalized parameter.
+
+    Examples:
+        >>> normalize_param("Victor++Hugo")
+        'Victor Hugo'
+        >>> normalize_param("victor%20%20hugo ") == normalize_param("victor hugo")
+        True
+        >>> normalize_param("Victor Hugo", ("spaces", "casefold"))
+        'victor hugo'
+    """
+    param = unquote_plus(param)
+    for name in normalizers:
+        param = NORMALIZERS[name](param)
+
+    return param
+
+
+class ExtractionMemo(object):
+    """Bounded memo of the extractions made from identical pages.
+
+    An extraction is identified by the name of the extraction function, a
+    hash of the page and all the other arguments, so the page itself is never
+    kept. Extractions ending with a :class:`NoMatchError` or a
+    :class:`MultipleMatchError` are memoized too. When the memo is full, the
+    least recently used extractions are forgotten.
+
+    Arguments:
+        max_size (int): maximum total size (in characters) of the memoized
+            extractions, ``0`` to disable the memo.
+
+    Examples:
+        >>> memo = ExtractionMemo(max_size=1024)
+        >>> args = {"selector": "#hop", "html": "<div id='hop'></div>"}
+        >>> memo.call("extract", lambda: ["<div id='hop'></div>"], args)
+        ["<div id='hop'></div>"]
+        >>> memo.call("extract", lambda: ["never called"], args)
+        ["<div id='hop'></div>"]
+    """
+
+    """Errors of an extraction that are memoized like its results."""
+    MEMOIZED_ERRORS = (NoMatchError, MultipleMatchError)
+
+    """Size (in characters) counted for each memoized extraction besides its
+    results."""
+    ENTRY_OVERHEAD = 64
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(name, arguments):
+        """Identify an extraction.
+
+        Arguments:
+            name (str): the name of the extraction function.
+            arguments (dict): the arguments of the extraction, the page being
+                ``html``.
+
+        Returns:
+            tuple: the key of the extraction.
+        """
+        items = []
+        for arg, value in sorted(arguments.items()):
+            if arg == "html":
+                value = hashlib.blake2b(
+                    value.encode("utf-8"), digest_size=16).digest()
+            elif isinstance(value, HtmlEngine):
+                value = value.name
+            items.append((arg, value))
+
+        return (name, tuple(items))
+
+    def call(self, name, compute, arguments):
+        """Give the result of an extraction, computing it only if it is not
+        memoized.
+
+        Arguments:
+            name (str): the name of the extraction function.
+            compute (callable): compute the extraction without any argument.
+            arguments (dict): the arguments of the extraction, the page being
+                ``html``.
+
+        Returns:
+            the result of the extraction, its lists are always new copies.
+
+        Raises:
+            NoMatchError, MultipleMatchError: the memoized errors.
+        """
+        if self.max_size <= 0:
+            return compute()
+
+        key = self.key(name, arguments)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None:
+            try:
+                entry = (False, compute())
+            except self.MEMOIZED_ERRORS as e:
+                entry = (True, type(e))
+            self._add(key, entry)
+
+        is_error, result = entry[:2]
+        if is_error:
+            raise result()
+        return self.copy(result)
+
+    @classmethod
+    def copy(cls, result):
+        """Copy the lists of a result so that the memoized one can not be
+        altered."""
+        if isinstance(result, list):
+            return list(result)
+        if isinstance(result, tuple):
+            return tuple(cls.copy(item) for item in result)
+        return result
+
+    @classmethod
+    def result_size(cls, result):
+        """Approximate size of a result made of strings, numbers, lists and
+        tuples."""
+        if isinstance(result, str):
+            return len(result)
+        if isinstance(result, (list, tuple)):
+            return sum(cls.result_size(item) for item in result)
+        return 0
+
+    def _add(self, key, entry):
+        is_error, result = entry[:2]
+        size = self.ENTRY_OVERHEAD
+        if not is_error:
+            size += self.result_size(result)
+        if size > self.max_size:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = entry + (size,)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, _, old_size) = self._entries.popitem(last=False)
+                self.size -= old_size
+
+    def clear(self):
+        """Forget all the extractions."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+"""Memo of the extractions of this process, see :func:`memoized_extraction`."""
+extraction_memo = ExtractionMemo(max_size=32 * 1024 * 1024)
+
+
+def memoized_extraction(extract):
+    """Decorator memoizing an extraction function in :data:`extraction_memo`.
+
+    Arguments:
+        extract (callable): an extraction function with a ``html`` argument.
+
+    Returns:
+        callable: the memoized function.
+    """
+    signature = inspect.signature(extract)
+
+    @wraps(extract)
+    def memoized(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return extraction_memo.call(
+            extract.__name__,
+            lambda: extract(*bound.args, **bound.kwargs),
+            bound.arguments)
+
+    return memoized
+
+
+@memoized_extraction
+def extract_content_from_html(selector, expected_content, html, engine=None):
     """Extract the content of an HTML node from a HTML document according to a
     JQuery selector and a string mattching that content.
 
@@ -101,6 +648,8 @@ def extract_content_from_html(selector, expected_content, html):
         expected_content (str): a string that must be present in the selected
             node.
         html (str): a string containing an HTML document..
+        engine (str|HtmlEngine|None): the HTML engine to use, see
+            :func:`get_engine`.
 
     Returns:
         str: the selected content encapsuled in a div. There
@@ -122,28 +671,29 @@ def extract_content_from_html(selector, expected_content, html):
         Traceback (most recent call last):
         NoMatchError
     """
-    raw_q = PyQuery(html)
-    filtered_q = raw_q(selector)
+    engine = get_engine(engine)
+    matches = engine.select(html, selector)
 
-    # If the first match is empty (meaning no match at all)...
-    if not filtered_q.eq(0):
+    # If we have no match at all...
+    if not matches:
         # ...then it's an error
         raise NoMatchError()
 
     # If we have more than one match...
-    if filtered_q.eq(1):
+    if len(matches) > 1:
         # ...then we only have a match if only one node match the content
         if not once(
-                [(expected_content in e.text) for e in filtered_q if e.text]):
+                [(expected_content in e.text) for e in matches if e.text]):
             raise MultipleMatchError()
 
-    if expected_content not in filtered_q.text():
+    if expected_content not in engine.text(matches):
         raise NoMatchError()
 
     return "<div>{content}</div>".format(content=expected_content)
 
 
-def extract_node_from_html(selector, html, base_url=''):
+@memoized_extraction
+def extract_node_from_html(selector, html, base_url='', engine=None):
     """
     Extract one div from a html document according to a JQuery selector.
 
@@ -156,6 +706,8 @@ def extract_node_from_html(selector, html, base_url=''):
         html (str): a string containing an HTML document.
         base_url (str): an absolute url. If not ``''`` all links are made absolute using this
             url as base.
+        engine (str|HtmlEngine|None): the HTML engine to use, see
+            :func:`get_engine`.
 
     Returns:
         str: the selected div. There could be only one top-level div in the
@@ -176,28 +728,52 @@ def extract_node_from_html(selector, html, base_url=''):
         '<div id="hop"><a href="http://host.org/good/path/relative.html">hip</a></div>'
     """
 
-    raw_q = PyQuery(html)
-    filtered_q = raw_q(selector)
+    engine = get_engine(engine)
+    matches = engine.select(html, selector)
 
-    # If the first match is empty (meaning no match at all)...
-    if not filtered_q.eq(0):
+    # If we have no match at all...
+    if not matches:
         # ...then it's an error
         raise NoMatchError()
 
     # If we have more than one match...
-    if filtered_q.eq(1):
+    if len(matches) > 1:
         # ...then it's an error
         raise MultipleMatchError()
 
-    if not base_url:
-        return filtered_q.outerHtml()
+    if base_url:
+        make_links_absolute(matches, base_url)
+
+    return engine.outer_html(matches[0])
 
-    return filtered_q\
-        .make_links_absolute(base_url)\
-        .outerHtml()
 
+def window(items, offset=0, limit=None):
+    """Select a window of consecutive items.
 
-def extract_all_node_from_html(selector, html, base_url=''):
+    Arguments:
+        items (list): the items.
+        offset (int): number of items skipped.
+        limit (int|None): maximum number of items selected, ``None`` for all
+            the items after the offset.
+
+    Returns:
+        list: the selected items.
+
+    Examples:
+        >>> window([1, 2, 3, 4], offset=1, limit=2)
+        [2, 3]
+        >>> window([1, 2, 3, 4], offset=3)
+        [4]
+        >>> window([1, 2, 3, 4], offset=5, limit=2)
+        []
+    """
+    return items[offset:None if limit is None else offset + limit]
+
+
+@memoized_extraction
+def extract_all_node_from_html(selector, html, base_url='', engine=None,
+                               minify=False, selectors_to_remove='',
+                               offset=0, limit=None):
     """
     Extract all divs from a html document according to a JQuery selector.
 
@@ -210,6 +786,15 @@ def extract_all_node_from_html(selector, html, base_url=''):
         html (str): a string containing an HTML document.
         base_url (str): an absolute url. If not ``''`` all links are made absolute using this
             url as base.
+        engine (str|HtmlEngine|None): the HTML engine to use, see
+            :func:`get_engine`.
+        minify (bool): if ``True`` the divs are minified, see
+            :func:`minify_element`.
+        selectors_to_remove (str): a JQuery selector query of the nodes to
+            remove from the divs, see :func:`remove_nodes`.
+        offset (int): number of divs skipped, see :func:`window`.
+        limit (int|None): maximum number of divs returned. The divs outside
+            of the window are neither trimmed nor serialized.
 
     Returns:
         list(str): the selected divs as a list.
@@ -229,21 +814,731 @@ def extract_all_node_from_html(selector, html, base_url=''):
         >>> PAGE_MULTI = '<!DOCTYPE html><html><div class="hop">hip</div><div class="hop">hiphip</div></html>'
         >>> extract_all_node_from_html(".hop", PAGE_MULTI)
         ['<div class="hop">hip</div>', '<div class="hop">hiphip</div>']
+
+        The same extraction can be done by any engine:
+
+        >>> extract_all_node_from_html(".hop", PAGE_MULTI, engine="lxml")
+        ['<div class="hop">hip</div>', '<div class="hop">hiphip</div>']
+
+        The divs can be minified:
+
+        >>> PAGE_NOISY = '<!DOCTYPE html><html><div id="hop">\\n  <!-- hip -->\\n  hop<script>hup()</script>\\n</div></html>'
+        >>> extract_all_node_from_html("#hop", PAGE_NOISY, minify=True)
+        ['<div id="hop"> hop </div>']
+
+        Some nodes can be removed from the divs:
+
+        >>> PAGE_HOLD = '<!DOCTYPE html><html><div id="hop">hip<a class="hold">Place hold</a></div></html>'
+        >>> extract_all_node_from_html("#hop", PAGE_HOLD, selectors_to_remove=".hold")
+        ['<div id="hop">hip</div>']
+
+        Only a window of the divs can be extracted:
+
+        >>> extract_all_node_from_html(".hop", PAGE_MULTI, offset=1, limit=5)
+        ['<div class="hop">hiphip</div>']
+    """
+
+    return list(iter_all_node_from_html(
+        selector, html, base_url, engine, minify, selectors_to_remove,
+        offset, limit))
+
+
+def iter_all_node_from_html(selector, html, base_url='', engine=None,
+                            minify=False, selectors_to_remove='',
+                            offset=0, limit=None):
+    """
+    Same as :func:`extract_all_node_from_html` but the divs are serialized
+    one by one while they are consumed.
+
+    The document is parsed and searched right away, so a missing match is
+    detected before the first div is produced.
+
+    Returns:
+        iterator(str): the selected divs.
+
+    Raises:
+        NoMatchError: No div matched the selector query in the document.
+
+    Examples:
+        >>> PAGE_MULTI = '<!DOCTYPE html><html><div class="hop">hip</div><div class="hop">hiphip</div></html>'
+        >>> nodes = iter_all_node_from_html(".hop", PAGE_MULTI)
+        >>> next(nodes)
+        '<div class="hop">hip</div>'
+        >>> next(nodes)
+        '<div class="hop">hiphip</div>'
+    """
+    _, nodes = iter_first_nodes_from_html(
+        (selector,), html, base_url, engine, minify, selectors_to_remove,
+        offset, limit)
+
+    return nodes
+
+
+@memoized_extraction
+def extract_first_nodes_from_html(selectors, html, base_url='', engine=None,
+                                  minify=False, selectors_to_remove='',
+                                  offset=0, limit=None):
+    """
+    Same as :func:`extract_all_node_from_html` but several selectors are
+    tried in order on the same parsed document, the first one matching
+    something gives the divs.
+
+    Arguments:
+        selectors (tuple(str)): JQuery selector queries, in the order they
+            are tried.
+
+    Returns:
+        tuple(int, list(str)): the index of the matching selector and the
+        selected divs.
+
+    Raises:
+        NoMatchError: No selector matched anything in the document.
+
+    Examples:
+        >>> PAGE = '<!DOCTYPE html><html><div class="hop">hip</div></html>'
+        >>> extract_first_nodes_from_html(("#hop", ".hop", "div"), PAGE)
+        (1, ['<div class="hop">hip</div>'])
+    """
+    index, nodes = iter_first_nodes_from_html(
+        selectors, html, base_url, engine, minify, selectors_to_remove,
+        offset, limit)
+
+    return index, list(nodes)
+
+
+def iter_first_nodes_from_html(selectors, html, base_url='', engine=None,
+                               minify=False, selectors_to_remove='',
+                               offset=0, limit=None):
+    """
+    Same as :func:`extract_first_nodes_from_html` but the divs are
+    serialized one by one while they are consumed.
+
+    Returns:
+        tuple(int, iterator(str)): the index of the matching selector and the
+        selected divs.
+
+    Raises:
+        NoMatchError: No selector matched anything in the document.
+    """
+    engine = get_engine(engine)
+    index, matches = engine.select_first(html, selectors)
+
+    # If we have no match at all...
+    if not matches:
+        # ...then it's an error
+        raise NoMatchError()
+
+    def serialize():
+        # Links are resolved once for all the elements
+        resolved = {}
+        for element in window(matches, offset, limit):
+            if selectors_to_remove:
+                remove_nodes(element, selectors_to_remove)
+            if minify:
+                minify_element(element)
+            if base_url:
+                make_links_absolute([element], base_url, resolved)
+            yield engine.outer_html(element)
+
+    return index, serialize()
+
+
+"""Fields of a :class:`Record`, in the order they are stored."""
+RECORD_FIELDS = ("title", "author", "call_number", "link", "cover")
+
+"""Attribute giving the value of the fields that are urls, the value of the
+other fields is the text of the node."""
+URL_FIELDS = {"link": "href", "cover": "src"}
+
+
+class Record(object):
+    """A result of a provider reduced to a few typed fields.
+
+    Each field is a string or ``None`` when the result does not have it.
+    Records are stored compactly as lists of values (see :meth:`values`).
+
+    Examples:
+        >>> record = Record(title="Les misérables", author="Victor Hugo")
+        >>> record.to_dict()
+        {'title': 'Les misérables', 'author': 'Victor Hugo'}
+        >>> Record.from_values(record.values()) == record
+        True
     """
+    __slots__ = RECORD_FIELDS
+
+    def __init__(self, **fields):
+        for field in RECORD_FIELDS:
+            setattr(self, field, fields.get(field))
+
+    def values(self):
+        """The values of the fields in the order of :data:`RECORD_FIELDS`."""
+        return [getattr(self, field) for field in RECORD_FIELDS]
+
+    @classmethod
+    def from_values(cls, values):
+        """Build a record from the values given by :meth:`values`."""
+        return cls(**dict(zip(RECORD_FIELDS, values)))
+
+    def to_dict(self):
+        """The fields the record has, ready to be served as JSON."""
+        return {field: getattr(self, field) for field in RECORD_FIELDS
+                if getattr(self, field) is not None}
+
+    def __eq__(self, other):
+        return isinstance(other, Record) and self.values() == other.values()
+
+    def __repr__(self):
+        return "Record({fields})".format(fields=", ".join(
+            "{field}={value!r}".format(field=field, value=value)
+            for field, value in self.to_dict().items()))
+
+
+def extract_field(element, field, selector, base_url=''):
+    """Extract the value of a field of a record from a result.
+
+    Arguments:
+        element (lxml.etree.Element): the node of the result.
+        field (str): one of :data:`RECORD_FIELDS`.
+        selector (str): a JQuery selector query of the node of the field,
+            relative to the result.
+        base_url (str): an absolute url. If not ``''`` the urls are made
+            absolute using this url as base.
+
+    Returns:
+        str|None: the value of the field, ``None`` if the result does not
+        have it.
+    """
+    nodes = compile_selector(selector)(element)
+    if not nodes:
+        return None
+
+    if field in URL_FIELDS:
+        value = nodes[0].get(URL_FIELDS[field])
+        if value and base_url:
+            value = urljoin(base_url, value)
+        return value or None
+
+    return collapse_spaces("".join(nodes[0].itertext())) or None
+
+
+def extract_records_from_html(selector, html, field_selectors, base_url='',
+                              engine=None):
+    """Extract records from the results of a HTML document.
+
+    Each result is selected by a JQuery selector, then each field of its
+    record by its own selector evaluated on the result, without parsing
+    anything again.
+
+    Arguments:
+        selector (str|tuple(str)): a JQuery selector query of the results,
+            or several ones tried in order (see
+            :func:`extract_first_nodes_from_html`).
+        html (str): a string containing an HTML document.
+        field_selectors (dict of str to str): the selectors of the fields of
+            the records, by name of field (see :data:`RECORD_FIELDS`).
+        base_url (str): an absolute url. If not ``''`` the urls are made
+            absolute using this url as base.
+        engine (str|HtmlEngine|None): the HTML engine to use, see
+            :func:`get_engine`.
+
+    Returns:
+        list(Record): the records of the results.
+
+    Raises:
+        NoMatchError: No result matched the selector query in the document.
+
+    Examples:
+        >>> PAGE = '<!DOCTYPE html><html><div class="hop"><b>Hugo</b><a href="/1">Les misérables</a></div></html>'
+        >>> extract_records_from_html(
+        ...     ".hop", PAGE, {"title": "a", "author": "b", "link": "a"},
+        ...     "http://host.org/")
+        [Record(title='Les misérables', author='Hugo', link='http://host.org/1')]
+    """
+    if isinstance(selector, str):
+        selector = (selector,)
+    _, records = extract_first_records_from_html(
+        selector, html, field_selectors, base_url, engine)
+
+    return records
+
+
+def extract_first_records_from_html(selectors, html, field_selectors,
+                                    base_url='', engine=None):
+    """
+    Same as :func:`extract_records_from_html` but the index of the matching
+    selector is given too, like :func:`extract_first_nodes_from_html`.
+
+    Arguments:
+        selectors (tuple(str)): JQuery selector queries of the results, in
+            the order they are tried.
+
+    Returns:
+        tuple(int, list(Record)): the index of the matching selector and the
+        records of the results.
 
-    raw_q = PyQuery(html)
-    filtered_q = raw_q(selector)
+    Raises:
+        NoMatchError: No selector matched anything in the document.
+
+    Examples:
+        >>> PAGE = '<!DOCTYPE html><html><div class="hop">Hugo</div></html>'
+        >>> extract_first_records_from_html(
+        ...     (".hip", ".hop"), PAGE, {"author": "div"})
+        (1, [Record(author='Hugo')])
+    """
+    index, matches = get_engine(engine).select_first(html, selectors)
 
-    # If the first match is empty (meaning no match at all)...
-    if not filtered_q.eq(0):
+    # If we have no match at all...
+    if not matches:
         # ...then it's an error
         raise NoMatchError()
 
-    if not base_url:
-        return [res.outerHtml() for res in filtered_q.items()]
-    else:
-        return [res.make_links_absolute(base_url).outerHtml()
-                for res in filtered_q.items()]
+    return index, [
+        Record(**{
+            field: extract_field(element, field, field_selector, base_url)
+            for field, field_selector in field_selectors.items()})
+        for element in matches]
+
+
+class ExtractionPool(object):
+    """Offload the extraction of results from big pages to a pool of
+    processes.
+
+    Parsing a big page is CPU-bound and holds the GIL for a long time, so the
+    pages bigger than a threshold are analysed in another process while
+    small pages are still analysed directly. The processes are only started
+    when the first big page is met.
+
+    Arguments:
+        processes (int): number of processes of the pool. If ``0`` the pool is
+            disabled and all the pages are analysed directly.
+        threshold (int): size (in characters) from which a page is analysed
+            in the pool.
+
+    Examples:
+        >>> pool = ExtractionPool(processes=0, threshold=0)
+        >>> PAGE = '<!DOCTYPE html><html><div id="hop">hip</div></html>'
+        >>> pool.extract_all_node_from_html("#hop", PAGE)
+        ['<div id="hop">hip</div>']
+    """
+
+    def __init__(self, processes, threshold):
+        self.processes = processes
+        self.threshold = threshold
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def is_offloaded(self, html):
+        """Tell if a page is analysed in the pool.
+
+        Arguments:
+            html (str): a string containing an HTML document.
+
+        Returns:
+            bool: ``True`` if the page is big enough to be analysed in the
+            pool.
+        """
+        return self.processes > 0 and len(html) >= self.threshold
+
+    def extract_all_node_from_html(self, selector, html, base_url='',
+                                   engine=None, minify=False,
+                                   selectors_to_remove='', offset=0,
+                                   limit=None):
+        """Same as :func:`extract_all_node_from_html` but big pages are
+        analysed in the pool.
+
+        The engine must be given by name since it is sent to another
+        process.
+        """
+        return self.extract(
+            extract_all_node_from_html,
+            selector=selector, html=html, base_url=base_url, engine=engine,
+            minify=minify, selectors_to_remove=selectors_to_remove,
+            offset=offset, limit=limit)
+
+    def extract_first_nodes_from_html(self, selectors, html, base_url='',
+                                      engine=None, minify=False,
+                                      selectors_to_remove='', offset=0,
+                                      limit=None):
+        """Same as :func:`extract_first_nodes_from_html` but big pages are
+        analysed in the pool."""
+        return self.extract(
+            extract_first_nodes_from_html,
+            selectors=tuple(selectors), html=html, base_url=base_url,
+            engine=engine, minify=minify,
+            selectors_to_remove=selectors_to_remove, offset=offset,
+            limit=limit)
+
+    def extract(self, function, **arguments):
+        """Call a memoized extraction function, in the pool if the page is
+        big.
+
+        Arguments:
+            function (callable): the extraction function, decorated by
+                :func:`memoized_extraction`.
+            arguments: all the arguments of the function, by name.
+        """
+        if not self.is_offloaded(arguments["html"]):
+            return function(**arguments)
+
+        with self._lock:
+            if self._executor is None:
+                # Forking a multithreaded web server is not safe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context("spawn"))
+
+        # Identical big pages are not even sent to the pool
+        return extraction_memo.call(
+            function.__name__,
+            lambda: self._executor.submit(function, **arguments).result(),
+            arguments)
+
+    def shutdown(self):
+        """Stop the processes of the pool if they were started."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+"""Tags removed with their content by :func:`minify_element`."""
+MINIFIED_TAGS = frozenset({"script", "style"})
+
+"""Tags whose whitespaces are kept by :func:`minify_element`."""
+PREFORMATTED_TAGS = frozenset({"pre", "textarea"})
+
+"""Sequences of whitespaces collapsed by :func:`minify_element`."""
+WHITESPACES = re.compile(r"\s+")
+
+
+def remove_node(node):
+    """Remove a node from its tree but keep the text following it.
+
+    Arguments:
+        node (lxml.etree.Element): the node to remove, not a root.
+    """
+    if node.tail:
+        previous = node.getprevious()
+        if previous is not None:
+            previous.tail = (previous.tail or "") + node.tail
+        else:
+            parent = node.getparent()
+            parent.text = (parent.text or "") + node.tail
+    node.getparent().remove(node)
+
+
+def remove_nodes(element, selector):
+    """Remove the descendants of an HTML node matching a selector, in place.
+
+    The selector is compiled once and applied to the already parsed tree.
+    The text following a removed node is kept.
+
+    Arguments:
+        element (lxml.etree.Element): the node to trim.
+        selector (str): a JQuery selector query of the nodes to remove.
+
+    Examples:
+        >>> element = lxml.html.fragment_fromstring(
+        ...     '<div>Hugo <a class="hold">Place hold</a>- 1862</div>')
+        >>> remove_nodes(element, ".hold")
+        >>> etree.tostring(element, encoding=str, method="html")
+        '<div>Hugo - 1862</div>'
+    """
+    for node in compile_selector(selector)(element):
+        # The node itself is the result, only its content is trimmed
+        if node is not element:
+            remove_node(node)
+
+
+def minify_element(element):
+    """Minify an HTML node in place.
+
+    The comments and the ``script`` and ``style`` nodes are removed and every
+    sequence of whitespaces is collapsed into a single space, except inside
+    ``pre`` and ``textarea`` nodes. It is done on the already parsed tree,
+    just before it is serialized.
+
+    Arguments:
+        element (lxml.etree.Element): the node to minify.
+
+    Examples:
+        >>> element = lxml.html.fragment_fromstring(
+        ...     '<div>\\n  <!-- hip --><b>hop</b>\\n\\n  <pre> a\\n b</pre></div>')
+        >>> minify_element(element)
+        >>> etree.tostring(element, encoding=str, method="html")
+        '<div> <b>hop</b> <pre> a\\n b</pre></div>'
+    """
+    # The tree must not change while it is walked
+    removed = [node for node in element.iterdescendants()
+               if not isinstance(node.tag, str) or node.tag in MINIFIED_TAGS]
+    for node in removed:
+        remove_node(node)
+
+    preformatted = set()
+    for node in element.iter(*PREFORMATTED_TAGS):
+        preformatted.update(node.iter())
+
+    for node in element.iter():
+        if node not in preformatted and node.text:
+            node.text = WHITESPACES.sub(" ", node.text)
+        if node is not element and node.tail \
+                and node.getparent() not in preformatted:
+            node.tail = WHITESPACES.sub(" ", node.tail)
+
+
+"""Schemes of links that must never be made absolute."""
+NOT_RELATIVE_SCHEMES = ('tel:', 'callto:', 'sms:')
+
+
+def make_links_absolute(elements, base_url, resolved=None):
+    """Make all the links of some HTML nodes absolute in a single pass.
+
+    All the subtrees of ``elements`` are walked once and every ``href``,
+    ``src``, ``srcset`` and ``action`` attribute is rewritten. Each distinct
+    link is resolved only once thanks to a memoized resolver, which matters a
+    lot for booklists where the same few links are repeated on every item.
+
+    Arguments:
+        elements (iterable of lxml.etree.Element): the root nodes of the
+            subtrees to modify in place (a :class:`PyQuery` object will do).
+        base_url (str): an absolute url used as base for the links.
+        resolved (dict|None): the links already resolved with the same
+            ``base_url``, shared between successive calls.
+
+    Examples:
+        >>> q = PyQuery('<div><p><a href="a.html">a</a><img src="b.png"></p>'
+        ...             '<p><img srcset="c.png 1x, d.png 2x"></p></div>')
+        >>> make_links_absolute(q("p"), "http://host.org/dir/")
+        >>> print(q.outerHtml())
+        <div><p><a href="http://host.org/dir/a.html">a</a><img src="http://host.org/dir/b.png"></p><p><img srcset="http://host.org/dir/c.png 1x, http://host.org/dir/d.png 2x"></p></div>
+    """
+    if resolved is None:
+        resolved = {}
+
+    def resolve(link):
+        try:
+            return resolved[link]
+        except KeyError:
+            pass
+
+        if link.startswith(NOT_RELATIVE_SCHEMES):
+            absolute = link
+        else:
+            absolute = urljoin(base_url, link.strip())
+        resolved[link] = absolute
+
+        return absolute
+
+    def resolve_srcset(srcset):
+        # A srcset is a comma separated list of "url [descriptor]"
+        candidates = []
+        for candidate in srcset.split(","):
+            parts = candidate.split(None, 1)
+            if not parts:
+                continue
+            parts[0] = resolve(parts[0])
+            candidates.append(" ".join(parts))
+
+        return ", ".join(candidates)
+
+    for element in elements:
+        for node in element.iter():
+            attrib = node.attrib
+            # Comments and processing instructions have no attributes
+            if not attrib:
+                continue
+            for name in ("href", "src", "action"):
+                value = attrib.get(name)
+                if value is not None:
+                    attrib[name] = resolve(value)
+            value = attrib.get("srcset")
+            if value is not None:
+                attrib["srcset"] = resolve_srcset(value)
+
+
+@lru_cache(maxsize=256)
+def selector_tokens(selector):
+    """Compute the raw tokens that must appear in a page for a selector to
+    match.
+
+    Only ids and classes are taken into account, and never the ones inside a
+    negation. A selector made of several comma separated selectors gives one
+    set of tokens per selector.
+
+    Arguments:
+        selector (str): a JQuery selector query.
+
+    Returns:
+        tuple(frozenset(str)) or None: one set of required tokens per
+        alternative of the selector, or ``None`` if the selector can not be
+        analysed.
+
+    Examples:
+        >>> [sorted(tokens) for tokens in selector_tokens("#hop .hip td:not(.hup)")]
+        [['hip', 'hop']]
+        >>> selector_tokens("div:first, .hip") == (frozenset(), frozenset({'hip'}))
+        True
+    """
+    try:
+        parsed = parse_selector(selector)
+    except SelectorError:
+        return None
+
+    def walk(node, tokens):
+        if isinstance(node, Class):
+            tokens.add(node.class_name)
+        elif isinstance(node, Hash):
+            tokens.add(node.id)
+
+        if isinstance(node, CombinedSelector):
+            walk(node.subselector, tokens)
+
+        # Negations only keep their positive part in the selector attribute
+        inner = getattr(node, "selector", None)
+        if inner is not None:
+            walk(inner, tokens)
+
+        return tokens
+
+    return tuple(frozenset(walk(sel.parsed_tree, set())) for sel in parsed)
+
+
+def may_match(selector, html):
+    """Tell if a selector has a chance to match something in a page without
+    parsing the page.
+
+    The raw page is just scanned for the ids and classes used by the selector.
+    A ``False`` answer is certain, a ``True`` answer only means that the page
+    has to be parsed to know for sure.
+
+    Arguments:
+        selector (str): a JQuery selector query.
+        html (str): a string containing an HTML document.
+
+    Returns:
+        bool: ``False`` if the selector can not match anything in the page.
+
+    Examples:
+        >>> PAGE = '<!DOCTYPE html><html><div id="hop">hip</div></html>'
+        >>> may_match("#hop", PAGE)
+        True
+        >>> may_match(".hip", PAGE)
+        True
+        >>> may_match("#hop .hup", PAGE)
+        False
+    """
+    alternatives = selector_tokens(selector)
+
+    if alternatives is None:
+        return True
+
+    return any(all(token in html for token in tokens)
+               for tokens in alternatives)
+
+
+"""Raw tags scanned by :func:`encloses`."""
+RAW_TAG = re.compile(r"<(/?)([a-zA-Z][\w:-]*)[^>]*?(/?)>")
+
+"""Tags that are never closed, see :func:`encloses`."""
+VOID_TAGS = frozenset({
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link",
+    "meta", "source", "track", "wbr"})
+
+
+def encloses(html, token, position):
+    """Tell if the element whose opening tag holds the last occurrence of a
+    token before a position is still open at this position, without parsing
+    the page.
+
+    Only the raw tags between the token and the position are scanned. A
+    ``False`` answer only means that the page has to be parsed to know for
+    sure.
+
+    Arguments:
+        html (str): a string containing an HTML document.
+        token (str): an id or a class.
+        position (int): a position in the page.
+
+    Returns:
+        bool: ``True`` if the position is inside the element.
+
+    Examples:
+        >>> PAGE = '<div class="hop"><p>hip</p></div><p>hup</p>'
+        >>> encloses(PAGE, "hop", PAGE.index("hip"))
+        True
+        >>> encloses(PAGE, "hop", PAGE.index("hup"))
+        False
+    """
+    matches = list(re.finditer(
+        r"(?<![\w-]){}(?![\w-])".format(re.escape(token)),
+        html[:position]))
+    if not matches:
+        return False
+
+    # The token has to be in an opening tag
+    start = matches[-1].start()
+    tag_start = html.rfind("<", 0, start)
+    if tag_start < 0 or ">" in html[tag_start:start]:
+        return False
+
+    depth = 0
+    for tag in RAW_TAG.finditer(html, tag_start, position):
+        closing, name, self_closing = tag.groups()
+        if closing:
+            depth -= 1
+            if depth <= 0:
+                return False
+        elif not self_closing and name.lower() not in VOID_TAGS:
+            depth += 1
+
+    return depth > 0
+
+
+def is_no_result_page(html, result_selector, no_result_selector,
+                      no_result_content):
+    """Tell if a page is obviously a no result page without parsing it.
+
+    This is the case when the result selector can not match anything in the
+    page and the expected no result content appears once and only once in the
+    raw page, inside the elements holding the ids and classes of the no result
+    selector.
+
+    Arguments:
+        html (str): a string containing an HTML document.
+        result_selector (str): the JQuery selector of the results.
+        no_result_selector (str): the JQuery selector of the no result
+            message.
+        no_result_content (str): the no result message.
+
+    Returns:
+        bool: ``True`` if the page is unambiguously a no result page. ``False``
+        means that the page has to be parsed to know what it is.
+
+    Examples:
+        >>> PAGE = '<!DOCTYPE html><html><p class="empty">Nothing</p></html>'
+        >>> is_no_result_page(PAGE, ".results td", "p.empty", "Nothing")
+        True
+        >>> is_no_result_page(PAGE, ".results td", "p.empty", "Something")
+        False
+        >>> is_no_result_page(PAGE, ".results td", "p.full", "Nothing")
+        False
+    """
+    if not no_result_selector or not no_result_content:
+        return False
+
+    if html.count(no_result_content) != 1\
+            or may_match(result_selector, html):
+        return False
+
+    alternatives = selector_tokens(no_result_selector)
+    if alternatives is None:
+        return False
+
+    # Without any id or class, the message can not be located
+    position = html.index(no_result_content)
+    return any(tokens and all(encloses(html, token, position)
+                              for token in tokens)
+               for tokens in alternatives)
 
 
 # Snippet taken from http://flask.pocoo.org/snippets/100/
@@ -261,6 +1556,30 @@ def add_response_headers(headers={}):
     return decorator
 
 
+def sse_event(event, data):
+    """Format a message of a Server-Sent Events stream.
+
+    See `Server-sent events
+    <https://html.spec.whatwg.org/multipage/server-sent-events.html>`_
+
+    Params:
+        event (str): type of the event.
+        data (str): content of the event, each of its lines is sent in a
+            ``data`` field.
+
+    Returns:
+        str: the message, ending with the blank line that dispatches it.
+
+    Examples:
+        >>> sse_event("answer", "<div>\\n1</div>")
+        'event: answer\\ndata: <div>\\ndata: 1</div>\\n\\n'
+    """
+    lines = ["event: {event}".format(event=event)]
+    lines.extend(
+        "data: {line}".format(line=line) for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
 def get_base_url(url):
     """Returns the base url of a given ``url``.
 
@@ -280,3 +1599,76 @@ def get_base_url(url):
     parsed = urlparse(url)
 
     return urlunparse((parsed.scheme, parsed.netloc, '', '', '', ''))
+
+
+"""Content codings Mincer can compress its answers with, by order of
+preference."""
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate_encoding(accept_encoding, encodings=ENCODINGS):
+    """Choose how to compress an answer according to the ``Accept-Encoding``
+    header of the client.
+
+    Params:
+        accept_encoding (str|None): the header of the request.
+        encodings (sequence of str): the available content codings by order
+            of preference.
+
+    Returns:
+        str|None: the content coding preferred by the client among the
+        available ones, ``None`` if the answer must not be compressed.
+
+    Examples:
+        >>> negotiate_encoding("gzip, deflate", ("br", "gzip"))
+        'gzip'
+        >>> negotiate_encoding("gzip, br", ("br", "gzip"))
+        'br'
+        >>> negotiate_encoding("br;q=0.5, gzip;q=0.8", ("br", "gzip"))
+        'gzip'
+        >>> negotiate_encoding("*, gzip;q=0", ("gzip",)) is None
+        True
+        >>> negotiate_encoding(None) is None
+        True
+    """
+    weights = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding] = weight
+
+    best = None
+    for coding in encodings:
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > 0 and (best is None or weight > best[1]):
+            best = (coding, weight)
+
+    return best[0] if best is not None else None
+
+
+def compress(data, encoding):
+    """Compress an answer.
+
+    Params:
+        data (bytes): the body of the answer.
+        encoding (str): one of :data:`ENCODINGS`.
+
+    Returns:
+        bytes: the compressed body.
+
+    Examples:
+        >>> gzip.decompress(compress(b"<div>Hugo</div>", "gzip"))
+        b'<div>Hugo</div>'
+    """
+    if encoding == "br":
+        return brotli.compress(data)
+    return gzip.compress(data, compresslevel=6, mtime=0)
@@ -12,6 +12,12 @@ except Exception as e:
 
 from urllib.parse import unquote_plus
 
+# To simulate a slow server
+from time import sleep
+
+# To count the requests of some pages
+from collections import Counter
+
 # To create a web server c.f. http://flask.pocoo.org/
 from flask import Flask
 
@@ -44,6 +50,28 @@ def serve_any_query(query):
             '<div class="item">Result with japanese 新疆史志</div>'\
             '<div class="item">Result with japanese 永井龍男集</div>'\
             '</div>', OK
+    elif clean_query == "slow search":
+        sleep(2)
+        return '<div class="result"><div class="item">Too late</div></div>', OK
+    elif clean_query == "search with noisy results":
+        return '<div class="result">'\
+            '<div class="item">\n  <!-- first -->\n  Result  number 1\n'\
+            '  <script>track(1)</script>\n</div>'\
+            '<div class="item">\n  <style>.item {}</style>Result number 2</div>'\
+            '</div>', OK
+    elif clean_query == "search with buttons":
+        return '<div class="result">'\
+            '<div class="item">Result number 1 <a class="hold">Place hold</a>'\
+            '<img class="placeholder" src="/none.png"></div>'\
+            '<div class="item"><img src="/cover.png">Result number 2</div>'\
+            '</div>', OK
+    elif clean_query == "search with records":
+        return '<div class="result">'\
+            '<div class="item"><a href="/doc/1">Les misérables</a>'\
+            '<span class="author">Victor Hugo</span>'\
+            '<img src="/covers/1.png"></div>'\
+            '<div class="item"><a href="/doc/2">Notre-Dame de Paris</a></div>'\
+            '</div>', OK
     elif clean_query == "search without result":
         return '<div class="noresult">'\
             'no result'\
@@ -52,5 +80,27 @@ def serve_any_query(query):
     return BAD_REQUEST
 
 
+@app.route("/slow/<string:query>")
+def serve_any_query_slowly(query):
+    sleep(1)
+    return '<div class="result"><div class="item">Slow {query}</div></div>'.format(
+        query=unquote_plus(query)), OK
+
+
+# Number of requests of each counted page
+hits = Counter()
+
+
+@app.route("/counted/<string:query>")
+def serve_any_query_counted(query):
+    hits[unquote_plus(query)] += 1
+    return serve_any_query(query)
+
+
+@app.route("/hits/<string:query>")
+def count_hits(query):
+    return str(hits[unquote_plus(query)]), OK
+
+
 if __name__ == '__main__':
     app.run(host="0.0.0.0", port=5555)
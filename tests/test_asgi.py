@@ -0,0 +1,223 @@
+__author__ = "Pierre-Yves Martin <pym.aldebaran@gmail.com>"
+__copyright__ = "Copyright (C) 2017 GIP BULAC"
+__license__ = "GNU AGPL V3"
+
+# This file is part of Mincer.
+#
+# Mincer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mincer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Mincer.  If not, see <http://www.gnu.org/licenses/>.
+
+# To manipulate path
+import os
+
+# To run coroutines
+import asyncio
+
+# To wait a little bit for thing to settle...
+from time import sleep
+
+# To translate query from natural text to url encoded
+from urllib.parse import quote_plus
+
+# To start and stop fake server
+from subprocess import Popen
+
+# Convenient constant for HTTP status codes
+try:
+    # Python 3.5+ only
+    from HTTPStatus import OK, NOT_FOUND, BAD_REQUEST
+except Exception as e:
+    from http.client import OK, NOT_FOUND, BAD_REQUEST
+
+# Asynchronous HTTP client able to query an ASGI application directly
+import httpx
+
+# Module we are going to test
+import mincer
+import mincer.asgi
+from mincer import Provider, HtmlClasses
+
+# Helpers to analyse HTML contents
+from tests.utils import (
+    is_div,
+    is_html5_page,
+    all_div_content,
+    is_substring_in)
+
+# Database fixtures
+from tests.test_mincer import client, tmp_db_uri, tmp_db, config
+
+# Test framework that helps you write better programs !
+import pytest
+
+
+def asgi_get(*urls):
+    """Query concurrently the ASGI application of Mincer.
+
+    Params:
+        urls (str): the urls to query.
+
+    Returns:
+        list(httpx.Response): the answers in the same order as the urls.
+    """
+    async def get_all():
+        application = mincer.asgi.Application(mincer.app)
+        transport = httpx.ASGITransport(app=application)
+        async with httpx.AsyncClient(
+                transport=transport, base_url="http://mincer") as client:
+            responses = await asyncio.gather(*[client.get(url) for url in urls])
+        await application.close()
+        return responses
+
+    return asyncio.run(get_all())
+
+
+class TestAsgiWithFakeProvider(object):
+    @pytest.fixture(scope='class')
+    def fake_serv(self):
+        # Set the path of the server (depends of how the tests are launched)
+        path = "tests/fakeprov.py"
+        if not os.path.exists(path):
+            path = os.path.join("..", path)
+
+        fake_server = Popen(path)
+        # Wait for the process to start
+        sleep(2)
+
+        yield fake_server
+
+        fake_server.terminate()
+
+    @pytest.fixture
+    def fake_prov(self):
+        # Create the providers
+        fake_provider = Provider(
+            name="fake server",
+            remote_url="http://0.0.0.0:5555/fake/{param}",
+            result_selector=".result .item",
+            no_result_selector=".noresult",
+            no_result_content="no result")
+
+        # Add them to the database
+        mincer.db.session.add(fake_provider)
+
+        # Commit the transaction
+        mincer.db.session.commit()
+
+        return fake_provider
+
+    def _build_url_from_query(self, query):
+        return '/providers/fake-server/{query}'.format(query=quote_plus(query))
+
+    def test_return_result_partial_if_result_are_found(self, client, tmp_db, fake_serv, fake_prov):
+        QUERY = "search with multiple results"
+        response, = asgi_get(self._build_url_from_query(QUERY))
+
+        # We have an answer...
+        assert response.status_code == OK
+
+        # Any web page can use this content
+        assert response.headers["Access-Control-Allow-Origin"] == "*"
+
+        # ...containing a <div> with correct class and id
+        assert is_div(
+            response.text,
+            cls_name=HtmlClasses.RESULT,
+            id_name="fake-server")
+
+        # And we have the correct books in it
+        results = all_div_content(
+            response.text,
+            query=HtmlClasses.result_item_query())
+        assert is_substring_in("Result number 1", results)
+        assert is_substring_in("Result number 2", results)
+        assert is_substring_in("Result number 3", results)
+
+    def test_return_a_no_result_partial_if_no_result_are_found(self, client, tmp_db, fake_serv, fake_prov):
+        response, = asgi_get(self._build_url_from_query("search without result"))
+
+        assert response.status_code == OK
+        assert is_div(
+            response.text,
+            cls_name=HtmlClasses.NO_RESULT,
+            id_name="fake-server")
+
+    def test_same_answers_as_the_wsgi_application(self, client, tmp_db, fake_serv, fake_prov):
+        QUERIES = [
+            "canary",
+            "search with links",
+            "search with unicode 龍 車 日",
+            "search without result"]
+        URLS = [self._build_url_from_query(q) for q in QUERIES]
+
+        responses = asgi_get(*URLS)
+
+        for url, response in zip(URLS, responses):
+            assert response.text == client.get(url).get_data(as_text=True)
+
+    def test_answers_are_compressed(self, client, tmp_db, fake_serv, fake_prov, config):
+        # Compress all the answers whatever their size
+        config(MINCER_COMPRESSION_MIN_SIZE=0)
+        URL = self._build_url_from_query("search with multiple results")
+
+        response, = asgi_get(URL)
+
+        # httpx accepts gzip answers and decompresses them
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.text == client.get(URL).get_data(as_text=True)
+
+    def test_a_window_of_the_results_is_given(self, client, tmp_db, fake_serv, fake_prov):
+        URL = self._build_url_from_query("search with multiple results")
+
+        response, = asgi_get(URL + "?offset=1&limit=1")
+
+        assert response.status_code == OK
+        assert response.text == client.get(
+            URL + "?offset=1&limit=1").get_data(as_text=True)
+        assert "Result number 2" in response.text
+        assert "Result number 1" not in response.text
+
+        response, = asgi_get(URL + "?limit=-1")
+        assert response.status_code == BAD_REQUEST
+
+    def test_concurrent_requests_fetch_the_page_once(self, client, tmp_db, fake_serv, fake_prov):
+        fake_prov.remote_url = "http://0.0.0.0:5555/counted/{param}"
+        mincer.db.session.commit()
+
+        responses = asgi_get(
+            *[self._build_url_from_query("search with multiple results")] * 5)
+
+        assert all(response.status_code == OK for response in responses)
+        assert all("Result number 3" in response.text for response in responses)
+        hits = httpx.get(
+            "http://0.0.0.0:5555/hits/search with multiple results").text
+        assert hits == "1"
+
+    def test_return_not_found_for_inexistant_providers_query(self, client, tmp_db, fake_serv, fake_prov):
+        response, = asgi_get('/providers/dummy/canary')
+
+        assert response.status_code == NOT_FOUND
+
+    def test_other_pages_are_served_by_flask(self, client, tmp_db, fake_serv, fake_prov):
+        response, = asgi_get('/status/fake-server')
+
+        assert response.status_code == OK
+        assert is_html5_page(response.text)
+
+    def test_limits_are_shared_with_flask(self, client):
+        application = mincer.asgi.Application(mincer.app)
+        try:
+            bulkheads = application.get_fetcher().bulkheads
+            assert bulkheads.semaphore("0.0.0.0:5555") is mincer.get_bulkheads().semaphore("0.0.0.0:5555")
+        finally:
+            asyncio.run(application.close())
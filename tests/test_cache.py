@@ -0,0 +1,330 @@
+__author__ = "Pierre-Yves Martin <pym.aldebaran@gmail.com>"
+__copyright__ = "Copyright (C) 2017 GIP BULAC"
+__license__ = "GNU AGPL V3"
+
+# This file is part of Mincer.
+#
+# Mincer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mincer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Mincer.  If not, see <http://www.gnu.org/licenses/>.
+
+# To let the entries expire
+from time import sleep, monotonic
+
+# To serve a stand-in of a Redis server
+import socketserver
+import threading
+import re
+
+# Module to test
+# (mincer.cache is shadowed by the cache of the application in mincer)
+from mincer.cache import MemoryCache, SqliteCache, RedisCache, CacheReplyError
+from mincer.cache import UnknownCacheBackendError, from_url
+
+# Test framework that helps you write better programs !
+import pytest
+
+
+class RespServer(object):
+    """A local stand-in of a Redis server, knowing just enough commands for
+    :class:`mincer.cache.RedisCache`."""
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+        # The next reply, whatever the command
+        self.reply = None
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    args = []
+                    for _ in range(int(line[1:])):
+                        length = int(self.rfile.readline()[1:])
+                        args.append(self.rfile.read(length + 2)[:-2].decode())
+                    self.wfile.write(server.execute(*args))
+
+        self.tcp = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.tcp.daemon_threads = True
+        self.port = self.tcp.server_address[1]
+        threading.Thread(target=self.tcp.serve_forever, daemon=True).start()
+
+    @staticmethod
+    def bulk(value):
+        if value is None:
+            return b"$-1\r\n"
+        data = value.encode()
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    def execute(self, command, *args):
+        with self.lock:
+            if self.reply is not None:
+                reply, self.reply = self.reply, None
+                return reply
+
+            now = monotonic()
+            for key in [k for k, (_, exp) in self.entries.items() if exp <= now]:
+                del self.entries[key]
+
+            if command == "GET":
+                value, _ = self.entries.get(args[0], (None, None))
+                return self.bulk(value)
+            if command == "SET":
+                self.entries[args[0]] = (args[1], now + int(args[3]) / 1000)
+                return b"+OK\r\n"
+            if command == "DEL":
+                removed = sum(self.entries.pop(key, None) is not None for key in args)
+                return b":%d\r\n" % removed
+            if command == "SCAN":
+                # Only prefix patterns are used
+                prefix = re.sub(r"\\(.)", r"\1", args[2][:-1])
+                keys = [key for key in self.entries if key.startswith(prefix)]
+                return b"*2\r\n" + self.bulk("0") + b"*%d\r\n" % len(keys)\
+                    + b"".join(self.bulk(key) for key in keys)
+            if command == "STRLEN":
+                value, _ = self.entries.get(args[0], ("", None))
+                return b":%d\r\n" % len(value.encode())
+            if command == "PTTL":
+                if args[0] not in self.entries:
+                    return b":-2\r\n"
+                return b":%d\r\n" % int((self.entries[args[0]][1] - now) * 1000)
+            return b"-ERR unknown command\r\n"
+
+    def close(self):
+        self.tcp.shutdown()
+        self.tcp.server_close()
+
+
+@pytest.fixture
+def resp_server():
+    server = RespServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def new_cache(request, tmpdir):
+    """Build caches of each backend sharing the same storage."""
+    if request.param == "memory":
+        shared = MemoryCache(ttl=10, max_entries=10)
+        yield lambda: shared
+    elif request.param == "sqlite":
+        path = tmpdir.join("cache.db").strpath
+        yield lambda: SqliteCache(path, ttl=10, max_entries=10)
+    else:
+        server = RespServer()
+        yield lambda: RedisCache("127.0.0.1", server.port, ttl=10)
+        server.close()
+
+
+class TestCacheBackends(object):
+    def test_entries_can_be_retrieved(self, new_cache):
+        cache = new_cache()
+        cache.set("key", "value")
+        cache.set("list", ["result", "<div>1</div>"])
+
+        assert cache.get("key") == "value"
+        assert list(cache.get("list")) == ["result", "<div>1</div>"]
+        assert cache.get("unknown") is None
+
+    def test_entries_expire(self, new_cache):
+        cache = new_cache()
+        cache.set("key", "value", ttl=0.1)
+        cache.set("long", "value")
+
+        sleep(0.2)
+
+        assert cache.get("key") is None
+        assert cache.get("long") == "value"
+
+    def test_null_ttl_forgets_the_entry(self, new_cache):
+        cache = new_cache()
+        cache.set("key", "value")
+        cache.set("key", "value", ttl=0)
+
+        assert cache.get("key") is None
+
+    def test_entries_can_be_deleted(self, new_cache):
+        cache = new_cache()
+        cache.set("key", "value")
+        cache.set("other", "value")
+
+        cache.delete("key")
+        assert cache.get("key") is None
+        assert len(cache) == 1
+
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_entries_can_be_listed(self, new_cache):
+        cache = new_cache()
+        cache.set("page:koha:1", "value")
+        cache.set("page:koha:2", "value")
+        cache.set("page:kohaa:1", "value")
+        cache.set("page:*:1", "value")
+
+        assert sorted(cache.keys("page:koha:")) == ["page:koha:1", "page:koha:2"]
+        assert cache.keys("page:*") == ["page:*:1"]
+        assert len(cache.keys()) == 4
+
+    def test_entries_can_be_described(self, new_cache):
+        cache = new_cache()
+        cache.set("key", "value")
+        cache.get("key")
+
+        info = cache.info("key")
+        assert info["key"] == "key"
+        assert info["size"] > 0
+        assert 0 < info["expires"] <= 10
+        assert info["hits"] in (1, None)
+        assert cache.info("unknown") is None
+
+    def test_entries_can_be_deleted_by_prefix(self, new_cache):
+        cache = new_cache()
+        cache.set("page:koha:1", "value")
+        cache.set("result:koha:1", "value")
+
+        assert cache.delete_prefix("page:") == 1
+        assert cache.get("page:koha:1") is None
+        assert cache.get("result:koha:1") == "value"
+
+    def test_entries_are_shared(self, new_cache):
+        # e.g. by two workers
+        new_cache().set("key", "value")
+
+        assert new_cache().get("key") == "value"
+
+
+class TestMemoryCache(object):
+    def test_recently_used_entries_are_kept(self):
+        cache = MemoryCache(ttl=10, max_entries=2)
+        cache.set("first", 1)
+        cache.set("second", 2)
+
+        # Using the first entry makes the second the least recently used
+        cache.get("first")
+        cache.set("third", 3)
+
+        assert cache.get("first") == 1
+        assert cache.get("second") is None
+
+    def test_big_entries_are_compressed(self):
+        cache = MemoryCache(ttl=10, max_entries=100, max_size=10000)
+        page = "<div class='item'>Result</div>" * 2000
+
+        for i in range(5):
+            cache.set(str(i), page)
+
+        # Much more than max_size uncompressed
+        assert len(cache) == 5
+        assert cache.size <= 10000
+        assert cache.get("0") == page
+
+    def test_size_is_bounded(self):
+        cache = MemoryCache(ttl=10, max_entries=100, max_size=100, compress_threshold=1000)
+
+        for i in range(10):
+            cache.set(str(i), "x" * 30)
+
+        assert cache.size <= 100
+        assert cache.get("0") is None
+        assert cache.get("9") == "x" * 30
+
+        cache.clear()
+        assert cache.size == 0
+
+
+class TestSqliteCache(object):
+    def test_size_is_bounded(self, tmpdir):
+        cache = SqliteCache(tmpdir.join("cache.db").strpath, ttl=10, max_entries=5)
+
+        for i in range(SqliteCache.EVICTION_PERIOD):
+            cache.set(str(i), "value", ttl=10 + i)
+
+        assert len(cache) == 5
+        # The entries closest to their expiration were forgotten
+        assert cache.get("0") is None
+        assert cache.get(str(SqliteCache.EVICTION_PERIOD - 1)) == "value"
+
+    def test_reads_do_not_write(self, tmpdir):
+        cache = SqliteCache(tmpdir.join("cache.db").strpath, ttl=10, max_entries=5)
+        cache.set("key", "value")
+        changes = cache.connection().total_changes
+
+        assert cache.get("key") == "value"
+        assert cache.get("key") == "value"
+        assert cache.connection().total_changes == changes
+
+        # The hits are written when they are needed
+        assert cache.info("key")["hits"] == 2
+
+
+class TestRedisCache(object):
+    def test_unreachable_server_is_an_empty_cache(self):
+        cache = RedisCache("127.0.0.1", 1, ttl=10, timeout=0.1)
+        cache.set("key", "value")
+
+        assert cache.get("key") is None
+        assert cache.keys() == []
+        assert cache.info("key") is None
+        assert cache.delete_prefix("") == 0
+        assert len(cache) == 0
+
+    def test_keys_are_prefixed(self, resp_server):
+        cache = RedisCache("127.0.0.1", resp_server.port, ttl=10)
+        cache.set("key", "value")
+
+        assert list(resp_server.entries) == ["mincer:key"]
+
+    @pytest.mark.parametrize("reply", [b"?what\r\n", b":many\r\n", b"\r\n"])
+    def test_unexpected_reply_closes_the_connection(self, resp_server, reply):
+        cache = RedisCache("127.0.0.1", resp_server.port, ttl=10)
+        cache.set("key", "value")
+
+        resp_server.reply = reply
+        assert cache.get("key") is None
+        assert cache._local.connection is None
+
+        assert cache.get("key") == "value"
+
+    def test_error_reply_keeps_the_connection(self, resp_server):
+        cache = RedisCache("127.0.0.1", resp_server.port, ttl=10)
+        cache.set("key", "value")
+        connection = cache._local.connection
+
+        with pytest.raises(CacheReplyError):
+            cache.command("HELLO")
+        assert cache._local.connection is connection
+        assert cache.get("key") == "value"
+
+
+class TestFromUrl(object):
+    def test_sqlite_url(self, tmpdir):
+        path = tmpdir.join("cache.db").strpath
+        cache = from_url("sqlite:///" + path, ttl=10, max_entries=10)
+
+        assert isinstance(cache, SqliteCache)
+        assert cache.path == path
+
+    def test_redis_url(self):
+        cache = from_url("redis://cache.host:6380/2", ttl=10, max_entries=10)
+
+        assert isinstance(cache, RedisCache)
+        assert (cache.host, cache.port, cache.db) == ("cache.host", 6380, 2)
+
+    def test_unknown_backend(self):
+        with pytest.raises(UnknownCacheBackendError):
+            from_url("memcached://localhost", ttl=10, max_entries=10)
@@ -0,0 +1,52 @@
+__author__ = "Pierre-Yves Martin <pym.aldebaran@gmail.com>"
+__copyright__ = "Copyright (C) 2017 GIP BULAC"
+__license__ = "GNU AGPL V3"
+
+# This file is part of Mincer.
+#
+# Mincer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mincer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Mincer.  If not, see <http://www.gnu.org/licenses/>.
+
+# To increment the counters concurrently
+import threading
+
+# Module to test
+from mincer.metrics import Metrics, Outcome
+
+
+class TestMetrics(object):
+    def test_unknown_counter_is_zero(self):
+        assert Metrics().get("outcome", "koha-search", Outcome.RESULT) == 0
+
+    def test_counters_are_thread_safe(self):
+        metrics = Metrics()
+
+        def incr_many():
+            for _ in range(1000):
+                metrics.incr("outcome", "koha-search", Outcome.RESULT)
+
+        threads = [threading.Thread(target=incr_many) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert metrics.get("outcome", "koha-search", Outcome.RESULT) == 8000
+
+    def test_reset_clears_all_the_counters(self):
+        metrics = Metrics()
+        metrics.incr("outcome", "koha-search", Outcome.BUSY, amount=3)
+
+        metrics.reset()
+
+        assert metrics.snapshot() == {}
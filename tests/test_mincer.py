@@ -33,19 +33,30 @@ from urllib.parse import quote_plus
 
 # To start and stop fake server
 from subprocess import Popen
+import sys
+
+# To query the servers started by the tests
+import requests
+
+# To read the compressed answers
+import gzip
+from concurrent.futures import ThreadPoolExecutor
 
 # Convenient constant for HTTP status codes
 try:
     # Python 3.5+ only
-    from HTTPStatus import OK, NOT_FOUND, BAD_REQUEST
+    from HTTPStatus import OK, NOT_FOUND, BAD_REQUEST, BAD_GATEWAY, SERVICE_UNAVAILABLE, GATEWAY_TIMEOUT, INTERNAL_SERVER_ERROR
 except Exception as e:
-    from http.client import OK, NOT_FOUND, BAD_REQUEST
+    from http.client import OK, NOT_FOUND, BAD_REQUEST, BAD_GATEWAY, SERVICE_UNAVAILABLE, GATEWAY_TIMEOUT, INTERNAL_SERVER_ERROR
 
 # To access real url
 from flask import url_for
 
 # Module we are going to test
 import mincer
+
+# To alter the schema of the database
+import sqlalchemy
 from mincer import (
     Provider,
     Dependency,
@@ -109,10 +120,44 @@ def tmp_db(tmp_db_uri):
 @pytest.fixture
 def client():
     """Returns a test client for the mincer Flask app."""
+    # Every test starts with an empty cache
+    mincer.cache = None
+
     with mincer.app.app_context():
         yield mincer.app.test_client()
 
 
+def reset_shared_tools():
+    """Forget the shared tools of the application, so that they are built
+    again from its configuration on their next use."""
+    if mincer.extraction_pool is not None:
+        mincer.extraction_pool.shutdown()
+    mincer.extraction_pool = None
+    mincer.bulkheads = None
+    mincer.fetcher = None
+    mincer.cache = None
+    mincer.peer_group = None
+
+
+@pytest.fixture
+def config():
+    """Returns a function changing the configuration of the mincer Flask app,
+    e.g. config(MINCER_HOST_WAIT=0)."""
+    OLD_VALUES = {}
+
+    def configure(**values):
+        for key, value in values.items():
+            OLD_VALUES.setdefault(key, mincer.app.config[key])
+            mincer.app.config[key] = value
+        reset_shared_tools()
+
+    yield configure
+
+    # Some cleanup: when messing with the config, always give it back in its original state.
+    mincer.app.config.update(OLD_VALUES)
+    reset_shared_tools()
+
+
 @pytest.fixture
 def bulac_prov(tmp_db):
     """Add BULAC specific providers to the database."""
@@ -167,10 +212,34 @@ class TestWebInterface(object):
             # Do we have new provider link?
             assert url_for("provider_new") in links
 
+            # Do we have the search link?
+            assert url_for("search_page") in links
+
             # Do we have admin links?
             assert url_for("status") in links
             assert url_for("admin") in links
 
+    def test_has_search_page(self, client, tmp_db):
+        response = client.get('/search')
+
+        # We have an answer...
+        assert response.status_code == OK
+
+        # ...it's an HTML page
+        assert response.mimetype == "text/html"
+
+        # Let's convert it for easy inspection
+        data = response.get_data(as_text=True)
+
+        # Test if we recieved a full HTML page
+        assert is_html5_page(data)
+
+        assert has_page_title(data, "Mincer Search")
+        assert has_header_title(data, "Mincer")
+        assert has_header_subtitle(data, "Search")
+
+        assert has_form(data)
+
     def test_has_status_page(self, client, tmp_db, bulac_prov):
         response = client.get('/status')
 
@@ -343,6 +412,18 @@ class TestWebInterface(object):
         assert bootstrap_css.url == SENT_DATA["bootstrap-css"]
         assert bootstrap_css.sha == SENT_DATA["bootstrap-css-sha"]
 
+    def test_missing_columns_are_explained(self, client, tmp_db, bulac_prov, caplog):
+        # A database created by an older version of Mincer
+        mincer.db.session.execute(sqlalchemy.text(
+            "ALTER TABLE provider DROP COLUMN fallback_result_selectors"))
+        mincer.db.session.commit()
+
+        response = client.get("/status/koha-search")
+
+        assert response.status_code == INTERNAL_SERVER_ERROR
+        assert "no such column" in caplog.text
+        assert "add the missing columns" in caplog.text
+
     def test_has_new_provider_page(self, client, tmp_db):
         response = client.get('/provider/new')
 
@@ -372,6 +453,16 @@ class TestWebInterface(object):
         assert form_groups["Result selector"] == ""
         assert form_groups["No result selector"] == ""
         assert form_groups["No result content"] == ""
+        assert form_groups["Html engine"] == ""
+        assert form_groups["Param normalizers"] == ""
+        assert form_groups["Minify"] == ""
+        assert form_groups["Selectors to remove"] == ""
+        assert form_groups["Fallback result selectors"] == ""
+        assert form_groups["Title selector"] == ""
+        assert form_groups["Author selector"] == ""
+        assert form_groups["Call number selector"] == ""
+        assert form_groups["Link selector"] == ""
+        assert form_groups["Cover selector"] == ""
 
         # Do we have a button to validate the form ?
         assert has_form_submit_button(data)
@@ -411,6 +502,70 @@ class TestWebInterface(object):
         assert new.no_result_selector == SENT_DATA["no-result-selector"]
         assert new.no_result_content == SENT_DATA["no-result-content"]
 
+    @pytest.mark.parametrize("options, expected", [
+        ({"minify": "1"}, {"minify": True}),
+        ({"selectors-to-remove": ".hold, img.placeholder"},
+         {"selectors_to_remove": ".hold, img.placeholder"}),
+        ({"fallback-result-selectors": "#results .item; table td"},
+         {"result_selectors": ("ccc", "#results .item", "table td")}),
+        ({"title-selector": "a", "call-number-selector": ".cote"},
+         {"field_selectors": {"title": "a", "call_number": ".cote"}}),
+        ({"html-engine": "lxml"}, {"html_engine": "lxml", "engine": "lxml"}),
+        ({"param-normalizers": "nfc,casefold"},
+         {"param_normalizers": "nfc,casefold", "normalizers": ("nfc", "casefold")}),
+        ])
+    def test_post_new_provider_with_options(self, client, tmp_db, options, expected):
+        SENT_DATA = {
+            "name": "aaa",
+            "remote-url": "bbb",
+            "result-selector": "ccc",
+            "no-result-selector": "ddd",
+            "no-result-content": "eee",
+            }
+        SENT_DATA.update(options)
+        assert client.post('/provider', data=SENT_DATA).status_code == OK
+
+        new = Provider.query.filter(Provider.name == SENT_DATA['name']).one()
+        for attribute, value in expected.items():
+            assert getattr(new, attribute) == value
+
+    @pytest.mark.parametrize("options", [
+        {"minify": "yes"},
+        {"selectors-to-remove": ".hold >"},
+        {"fallback-result-selectors": "td; tr >"},
+        {"title-selector": "a", "cover-selector": "img >"},
+        {"html-engine": "dummy"},
+        {"param-normalizers": "nfc,dummy"},
+        ])
+    def test_post_new_provider_with_invalid_options_fails(self, client, tmp_db, options):
+        SENT_DATA = {
+            "name": "aaa",
+            "remote-url": "bbb",
+            "result-selector": "ccc",
+            "no-result-selector": "ddd",
+            "no-result-content": "eee",
+            }
+        SENT_DATA.update(options)
+        assert client.post('/provider', data=SENT_DATA).status_code == BAD_REQUEST
+        assert Provider.query.filter(Provider.name == SENT_DATA['name']).count() == 0
+
+    def test_post_existing_provider_edits_it(self, client, tmp_db):
+        SENT_DATA = {
+            "name": "aaa",
+            "remote-url": "bbb",
+            "result-selector": "ccc",
+            "no-result-selector": "ddd",
+            "no-result-content": "eee",
+            }
+        client.post('/provider', data=SENT_DATA)
+
+        SENT_DATA["result-selector"] = "fff"
+        response = client.post('/provider', data=SENT_DATA)
+        assert response.status_code == OK
+
+        edited = Provider.query.filter(Provider.name == SENT_DATA['name']).one()
+        assert edited.result_selector == "fff"
+
     def test_return_not_found_for_inexistant_providers_status(self, client, tmp_db, bulac_prov):
         URL = "/status/dummy"
 
@@ -749,6 +904,28 @@ class TestDatabase(object):
         assert Dependency.query.all() is not None
 
 
+class TestSharedTools(object):
+    def test_concurrent_first_requests_share_the_bulkheads(self, monkeypatch):
+        created = []
+
+        class SlowBulkheads(mincer.remote.Bulkheads):
+            def __init__(self, *args, **kwargs):
+                created.append(self)
+                # Leave time to the other threads to ask for them
+                sleep(0.1)
+                super(SlowBulkheads, self).__init__(*args, **kwargs)
+
+        monkeypatch.setattr(mincer.remote, "Bulkheads", SlowBulkheads)
+        monkeypatch.setattr(mincer, "bulkheads", None)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(
+                lambda _: mincer.get_bulkheads(), range(8)))
+
+        assert len(created) == 1
+        assert all(result is created[0] for result in results)
+
+
 class TestWithFakeProvider(object):
     @pytest.fixture(scope='class')
     def fake_serv(self):
@@ -987,3 +1164,650 @@ class TestWithFakeProvider(object):
         assert is_substring_in(fake_prov.name, prov_data)
         REMOTE_URL = fake_prov.remote_url.format(param=quote_plus(QUERY))
         assert is_substring_in(REMOTE_URL, prov_data)
+
+    @pytest.mark.parametrize("engine", sorted(mincer.utils.ENGINES))
+    def test_all_engines_give_the_same_results(self, client, tmp_db, fake_serv, fake_prov, engine):
+        fake_prov.html_engine = engine
+        mincer.db.session.commit()
+
+        QUERY = "search with links"
+        URL = self._build_url_from_query(QUERY)
+        response = client.get(URL)
+
+        # We have an answer...
+        assert response.status_code == OK
+
+        # Let's convert it for easy inspection
+        data = response.get_data(as_text=True)
+
+        # ...containing a <div> with correct class and id
+        assert is_div(
+            data,
+            cls_name=HtmlClasses.RESULT,
+            id_name=fake_prov.slug)
+
+        # And we have the correct results in it
+        results = all_div_content(
+            data,
+            query=HtmlClasses.result_item_query())
+        assert len(results) == 4
+        for l in all_links(data):
+            assert is_absolute_url(l)
+
+    def test_results_can_be_extracted_in_another_process(self, client, tmp_db, fake_serv, fake_prov, config):
+        # Every page will be analysed in another process
+        config(MINCER_EXTRACTION_PROCESSES=1, MINCER_EXTRACTION_THRESHOLD=0)
+        QUERY = "search with multiple results"
+        URL = self._build_url_from_query(QUERY)
+        response = client.get(URL)
+
+        # We have an answer...
+        assert response.status_code == OK
+
+        # Let's convert it for easy inspection
+        data = response.get_data(as_text=True)
+
+        # And we have the correct books in it
+        results = all_div_content(
+            data,
+            query=HtmlClasses.result_item_query())
+        assert is_substring_in("Result number 1", results)
+        assert is_substring_in("Result number 3", results)
+
+    def test_return_service_unavailable_if_remote_host_is_busy(self, client, tmp_db, fake_serv, fake_prov, config):
+        # Do not wait for a busy host
+        config(MINCER_HOST_WAIT=0)
+        bulkheads = mincer.get_bulkheads()
+        URL = self._build_url_from_query("canary")
+        REMOTE_URL = fake_prov.remote_url.format(param="canary")
+
+        # Use all the slots of the fake server
+        slots = [bulkheads.slot(REMOTE_URL)
+                 for _ in range(bulkheads.capacity_for("0.0.0.0:5555"))]
+        for slot in slots:
+            slot.__enter__()
+        try:
+            response = client.get(URL)
+        finally:
+            for slot in slots:
+                slot.__exit__(None, None, None)
+
+        assert response.status_code == SERVICE_UNAVAILABLE
+
+        # Once the host is free again everything is back to normal
+        assert client.get(URL).status_code == OK
+
+    def test_return_bad_gateway_if_remote_page_fails(self, client, tmp_db, fake_serv, fake_prov):
+        # The fake server fails on unknown queries
+        URL = self._build_url_from_query("unknown query")
+        response = client.get(URL)
+
+        assert response.status_code == BAD_GATEWAY
+
+    @pytest.fixture
+    def metrics(self):
+        mincer.metrics.reset()
+        yield mincer.metrics
+        mincer.metrics.reset()
+
+    def test_return_gateway_timeout_once_the_deadline_is_exceeded(self, client, tmp_db, fake_serv, fake_prov, metrics):
+        # The fake server takes 2 seconds to answer this query
+        URL = self._build_url_from_query("slow search")
+
+        response = client.get(URL + "?deadline=0.5")
+        assert response.status_code == GATEWAY_TIMEOUT
+
+        response = client.get(URL, headers={"X-Mincer-Deadline": "0.5"})
+        assert response.status_code == GATEWAY_TIMEOUT
+
+        assert metrics.get("outcome", "fake-server", "deadline_exceeded") == 2
+
+    def test_generous_deadline_does_not_change_the_result(self, client, tmp_db, fake_serv, fake_prov):
+        URL = self._build_url_from_query("canary")
+
+        response = client.get(URL + "?deadline=30")
+        assert response.status_code == OK
+        assert b"canary" in response.data
+
+    @pytest.mark.parametrize("deadline", ["abc", "0", "-1", "nan", "inf"])
+    def test_return_bad_request_for_an_invalid_deadline(self, client, tmp_db, fake_serv, fake_prov, deadline):
+        URL = self._build_url_from_query("canary")
+
+        response = client.get(URL, query_string={"deadline": deadline})
+        assert response.status_code == BAD_REQUEST
+
+    def test_outcomes_are_published_as_metrics(self, client, tmp_db, fake_serv, fake_prov, metrics):
+        client.get(self._build_url_from_query("canary"))
+        client.get(self._build_url_from_query("search with multiple results"))
+        client.get(self._build_url_from_query("search without result"))
+
+        response = client.get("/metrics")
+        assert response.status_code == OK
+        assert response.get_json()["outcome"] == {
+            "fake-server": {"result": 2, "no_result": 1}}
+
+    @pytest.fixture
+    def slow_prov(self):
+        slow_provider = Provider(
+            # Sorted before the fake server
+            name="a slow server",
+            remote_url="http://0.0.0.0:5555/slow/{param}",
+            result_selector=".result .item",
+            no_result_selector=".noresult",
+            no_result_content="no result")
+        mincer.db.session.add(slow_provider)
+        mincer.db.session.commit()
+
+        return slow_provider
+
+    def test_search_returns_the_answers_of_all_the_providers(self, client, tmp_db, fake_serv, fake_prov, slow_prov):
+        response = client.get("/search/canary")
+
+        assert response.status_code == OK
+        assert mincer.PENDING_HEADER not in response.headers
+        data = response.get_data(as_text=True)
+        assert has_div_with_class(data, cls_name=HtmlClasses.RESULT, id_name=fake_prov.slug)
+        assert has_div_with_class(data, cls_name=HtmlClasses.RESULT, id_name=slow_prov.slug)
+
+    def test_search_returns_partial_results_at_the_deadline(self, client, tmp_db, fake_serv, fake_prov, slow_prov):
+        URL = "/search/canary?providers=fake-server,a-slow-server&deadline=0.5"
+        response = client.get(URL)
+
+        # The fast provider answered, the slow one is still searching...
+        assert response.status_code == OK
+        assert response.headers[mincer.PENDING_HEADER] == slow_prov.slug
+        data = response.get_data(as_text=True)
+        assert has_div_with_class(data, cls_name=HtmlClasses.RESULT, id_name=fake_prov.slug)
+        assert has_div_with_class(data, cls_name=HtmlClasses.PENDING, id_name=slow_prov.slug)
+
+        # ...in the background to fill the cache for the next request
+        sleep(1.5)
+        response = client.get(URL)
+        assert mincer.PENDING_HEADER not in response.headers
+        data = response.get_data(as_text=True)
+        assert has_div_with_class(data, cls_name=HtmlClasses.RESULT, id_name=slow_prov.slug)
+        assert "Slow canary" in data
+
+    def test_search_shows_the_providers_in_error(self, client, tmp_db, fake_serv, fake_prov):
+        response = client.get("/search/unknown query?providers=fake-server")
+
+        assert response.status_code == OK
+        assert has_div_with_class(response.get_data(as_text=True),
+            cls_name=HtmlClasses.ERROR,
+            id_name=fake_prov.slug)
+
+    def test_search_return_not_found_for_inexistant_providers(self, client, tmp_db, fake_serv, fake_prov):
+        response = client.get("/search/canary?providers=fake-server,nobody")
+
+        assert response.status_code == NOT_FOUND
+
+    def _stream_events(self, response):
+        """Type and data of the events of a Server-Sent Events stream."""
+        events = []
+        for message in response.get_data(as_text=True).split("\n\n"):
+            if not message:
+                continue
+            lines = message.split("\n")
+            events.append((
+                lines[0][len("event: "):],
+                "\n".join(l[len("data: "):] for l in lines[1:])))
+        return events
+
+    def test_search_stream_sends_the_answers_as_they_are_ready(self, client, tmp_db, fake_serv, fake_prov, slow_prov):
+        response = client.get("/search/canary/stream")
+
+        assert response.status_code == OK
+        assert response.mimetype == "text/event-stream"
+
+        # The fast provider comes first even if it is not the first one in
+        # the search
+        events = self._stream_events(response)
+        assert [event for event, _ in events] == ["answer", "answer", "end"]
+        assert has_div_with_class(events[0][1], cls_name=HtmlClasses.RESULT, id_name=fake_prov.slug)
+        assert has_div_with_class(events[1][1], cls_name=HtmlClasses.RESULT, id_name=slow_prov.slug)
+
+    def test_search_stream_sends_the_pending_providers_at_the_deadline(self, client, tmp_db, fake_serv, fake_prov, slow_prov):
+        response = client.get("/search/canary/stream?deadline=0.5")
+
+        events = self._stream_events(response)
+        assert [event for event, _ in events] == ["answer", "pending", "end"]
+        assert has_div_with_class(events[1][1], cls_name=HtmlClasses.PENDING, id_name=slow_prov.slug)
+
+    def test_results_can_be_streamed(self, client, tmp_db, fake_serv, fake_prov):
+        URL = self._build_url_from_query("search with links")
+        response = client.get(URL + "?stream=1")
+
+        assert response.status_code == OK
+        assert response.is_streamed
+
+        # The streamed answer has the same results as the usual one...
+        data = response.get_data(as_text=True)
+        assert is_div(data, cls_name=HtmlClasses.RESULT, id_name=fake_prov.slug)
+        results = all_div_content(
+            data,
+            query=HtmlClasses.result_item_query())
+        assert len(results) == 4
+        for l in all_links(data):
+            assert is_absolute_url(l)
+
+        # ...and it is kept in cache
+        cached = client.get(URL).get_data(as_text=True)
+        assert all_div_content(
+            cached,
+            query=HtmlClasses.result_item_query()) == results
+
+    def test_no_result_can_be_streamed(self, client, tmp_db, fake_serv, fake_prov):
+        URL = self._build_url_from_query("search without result")
+        response = client.get(URL + "?stream=1")
+
+        assert response.status_code == OK
+        assert is_div(
+            response.get_data(as_text=True),
+            cls_name=HtmlClasses.NO_RESULT,
+            id_name=fake_prov.slug)
+
+    def test_equivalent_params_share_the_same_answer(self, client, tmp_db, fake_serv, fake_prov, metrics):
+        first = client.get(self._build_url_from_query("search with multiple results"))
+        assert first.status_code == OK
+
+        # Same query with other spaces and another encoding
+        URL = "/providers/fake-server/search%20with++multiple%20results%20"
+        second = client.get(URL)
+        assert second.status_code == OK
+        assert second.data == first.data
+
+        # The second answer came from the cache
+        response = client.get("/metrics")
+        counters = response.get_json()["cache"]["fake-server"]
+        assert (counters["miss"], counters["hit"]) == (1, 1)
+        assert response.get_json()["cache_hit_rate"] == {"fake-server": 0.5}
+
+    def test_hit_rates_without_page_request(self, client, metrics):
+        # Only the answers came from the cache
+        metrics.incr("cache", "fake-server", "result_hit")
+
+        assert mincer.cache_hit_rates() == ({"fake-server": None}, None)
+        response = client.get("/metrics")
+        assert response.status_code == OK
+        assert client.get("/admin/cache").status_code == OK
+
+    def test_params_can_be_case_folded(self, client, tmp_db, fake_serv, fake_prov):
+        fake_prov.param_normalizers = "nfc,spaces,casefold"
+        mincer.db.session.commit()
+
+        response = client.get(self._build_url_from_query("CaNaRy"))
+
+        assert response.status_code == OK
+        assert "Pew Pew" in response.get_data(as_text=True)
+
+    def test_failures_are_cached_for_a_short_time(self, client, tmp_db, fake_serv, fake_prov, metrics):
+        URL = self._build_url_from_query("unknown query")
+
+        assert client.get(URL).status_code == BAD_GATEWAY
+        assert metrics.get("cache", "fake-server", "error_hit") == 0
+
+        # The failing provider is not queried again
+        assert client.get(URL).status_code == BAD_GATEWAY
+        assert metrics.get("cache", "fake-server", "error_hit") == 1
+
+    def test_no_result_answers_have_their_own_ttl(self, client, tmp_db, fake_serv, fake_prov, metrics, config):
+        # Never keep a no result answer
+        config(MINCER_CACHE_NO_RESULT_TTL=0)
+        client.get(self._build_url_from_query("search without result"))
+        client.get(self._build_url_from_query("search without result"))
+        client.get(self._build_url_from_query("canary"))
+        client.get(self._build_url_from_query("canary"))
+
+        assert metrics.get("cache", "fake-server", "miss") == 3
+        assert metrics.get("cache", "fake-server", "hit") == 1
+
+    def test_selectors_change_does_not_fetch_the_page_again(self, client, tmp_db, fake_serv, fake_prov, metrics):
+        URL = self._build_url_from_query("search with multiple results")
+        assert len(all_div_content(
+            client.get(URL).get_data(as_text=True),
+            query=HtmlClasses.result_item_query())) == 3
+
+        # Only keep the first result
+        fake_prov.result_selector = ".result .item:first"
+        mincer.db.session.commit()
+
+        data = client.get(URL).get_data(as_text=True)
+        results = all_div_content(data, query=HtmlClasses.result_item_query())
+        assert len(results) == 1
+
+        # The page came from the cache but it was analysed again
+        assert metrics.get("cache", "fake-server", "hit") == 1
+        assert metrics.get("cache", "fake-server", "result_miss") == 2
+
+    def test_identical_pages_are_analysed_once(self, client, tmp_db, fake_serv, fake_prov, metrics):
+        # Two different urls giving the same page
+        client.get(self._build_url_from_query("canary"))
+        fake_prov.remote_url = "http://0.0.0.0:5555/fake/{param}?again"
+        mincer.db.session.commit()
+        client.get(self._build_url_from_query("canary"))
+
+        assert metrics.get("cache", "fake-server", "miss") == 2
+        assert metrics.get("cache", "fake-server", "result_hit") == 1
+
+    def test_cache_can_be_shared_between_workers(self, client, tmp_db, fake_serv, fake_prov, metrics, config, tmpdir):
+        # A cache file shared by every worker
+        config(MINCER_CACHE_URL="sqlite:///" + tmpdir.join("cache.db").strpath)
+        URL = self._build_url_from_query("canary")
+        expected = client.get(URL).get_data(as_text=True)
+
+        # Another worker has its own cache object on the same storage
+        mincer.cache = None
+
+        assert client.get(URL).get_data(as_text=True) == expected
+        assert metrics.get("cache", "fake-server", "hit") == 1
+
+    @pytest.fixture
+    def peer_group(self, tmpdir, tmp_db_uri):
+        """Start two instances of Mincer sharing their remote pages and the
+        test database."""
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        urls = ["http://127.0.0.1:5561", "http://127.0.0.1:5562"]
+
+        instances = []
+        for url in urls:
+            settings = tmpdir.join("{port}.cfg".format(port=url[-4:]))
+            settings.write(
+                "SQLALCHEMY_DATABASE_URI = {uri!r}\n"
+                "MINCER_PEERS = {urls!r}\n"
+                "MINCER_PEER_URL = {url!r}\n".format(
+                    uri=tmp_db_uri, urls=urls, url=url))
+            env = dict(os.environ, MINCER_SETTINGS=settings.strpath)
+            instances.append(Popen(
+                [sys.executable, "-m", "flask", "--app", "mincer", "run",
+                 "--port", url[-4:]],
+                cwd=root, env=env))
+
+        # Wait for the instances to start
+        for url in urls:
+            for _ in range(50):
+                try:
+                    requests.get(url + "/metrics")
+                    break
+                except requests.ConnectionError:
+                    sleep(0.1)
+
+        yield urls
+
+        for instance in instances:
+            instance.terminate()
+            instance.wait()
+
+    def test_peers_fetch_each_page_once(self, client, tmp_db, fake_serv, fake_prov, peer_group):
+        fake_prov.remote_url = "http://0.0.0.0:5555/counted/{param}"
+        mincer.db.session.commit()
+
+        urls = [url + self._build_url_from_query("canary") for url in peer_group] * 5
+        with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+            responses = list(executor.map(requests.get, urls))
+
+        assert all(response.status_code == OK for response in responses)
+        assert all("Pew Pew" in response.text for response in responses)
+
+        # The owner of the page is the only one to query the remote host
+        assert requests.get("http://0.0.0.0:5555/hits/canary").text == "1"
+
+    def test_peers_only_get_pages_of_the_provider(self, client, tmp_db, fake_serv, fake_prov):
+        response = client.get("/peers/fake-server/page?url=http://0.0.0.0:5555/fake/canary")
+        assert response.status_code == OK
+        assert "Pew Pew" in response.get_data(as_text=True)
+
+        response = client.get("/peers/fake-server/page?url=http://elsewhere.org/")
+        assert response.status_code == NOT_FOUND
+
+    def test_cache_can_be_inspected(self, client, tmp_db, fake_serv, fake_prov, metrics):
+        client.get(self._build_url_from_query("canary"))
+        client.get(self._build_url_from_query("canary"))
+
+        report = client.get("/admin/cache").get_json()
+
+        assert report["hit_rate"] == 0.5
+        summary = report["providers"]["fake-server"]
+        assert summary["entries"] == 2
+        assert summary["hit_rate"] == 0.5
+        assert summary["size"] > 0
+
+        keys = [entry["key"] for entry in report["entries"]]
+        assert "page:fake-server:http://0.0.0.0:5555/fake/canary" in keys
+
+        report = client.get("/admin/cache?prefix=page:").get_json()
+        assert len(report["entries"]) == 1
+
+    def test_cache_can_be_purged(self, client, tmp_db, fake_serv, fake_prov, metrics):
+        client.get(self._build_url_from_query("canary"))
+
+        response = client.post("/admin/cache/purge", data={"provider": "fake-server"})
+        assert response.get_json() == {"purged": 2}
+
+        client.get(self._build_url_from_query("canary"))
+        assert metrics.get("cache", "fake-server", "miss") == 2
+
+        assert client.post("/admin/cache/purge").status_code == BAD_REQUEST
+
+    def test_cache_is_purged_when_the_provider_is_edited(self, client, tmp_db, fake_serv, fake_prov, metrics):
+        client.get(self._build_url_from_query("canary"))
+
+        client.post('/provider', data={
+            "name": fake_prov.name,
+            "remote-url": fake_prov.remote_url,
+            "result-selector": ".result",
+            "no-result-selector": fake_prov.no_result_selector,
+            "no-result-content": fake_prov.no_result_content,
+            })
+
+        assert client.get("/admin/cache?provider=fake-server").get_json()["entries"] == []
+
+    def test_cache_is_purged_when_the_provider_is_removed(self, client, tmp_db, fake_serv, fake_prov):
+        client.get(self._build_url_from_query("canary"))
+
+        client.get("/remove/fake-server")
+
+        assert client.get("/admin/cache?provider=fake-server").get_json()["entries"] == []
+
+    def test_cache_can_be_managed_from_the_command_line(self, client, tmp_db, fake_serv, fake_prov, config, tmpdir):
+        config(MINCER_CACHE_URL="sqlite:///" + tmpdir.join("cache.db").strpath)
+        client.get(self._build_url_from_query("canary"))
+        runner = mincer.app.test_cli_runner()
+
+        result = runner.invoke(args=["cachestats", "--provider", "fake-server"])
+        assert "page:fake-server:http://0.0.0.0:5555/fake/canary" in result.output
+        assert "fake-server: 2 entries" in result.output
+
+        result = runner.invoke(args=["cachepurge", "--prefix", "page:"])
+        assert "1 entries purged" in result.output
+
+    def test_answers_are_compressed_for_the_clients_accepting_it(self, client, tmp_db, fake_serv, fake_prov, config):
+        # Compress all the answers whatever their size
+        config(MINCER_COMPRESSION_MIN_SIZE=0)
+        URL = self._build_url_from_query("search with multiple results")
+        expected = client.get(URL).get_data()
+
+        response = client.get(URL, headers={"Accept-Encoding": "gzip, deflate"})
+
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in response.headers["Vary"]
+        assert gzip.decompress(response.get_data()) == expected
+
+        response = client.get("/metrics", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["Content-Encoding"] == "gzip"
+
+    def test_compressed_answers_are_cached(self, client, tmp_db, fake_serv, fake_prov, config, monkeypatch):
+        config(MINCER_COMPRESSION_MIN_SIZE=0)
+        URL = self._build_url_from_query("search with multiple results")
+        calls = []
+        compress = mincer.utils.compress
+        monkeypatch.setattr(
+            mincer.utils, "compress", lambda *args: calls.append(args) or compress(*args))
+
+        first = client.get(URL, headers={"Accept-Encoding": "gzip"}).get_data()
+        second = client.get(URL, headers={"Accept-Encoding": "gzip"}).get_data()
+
+        assert first == second
+        assert len(calls) == 1
+        assert len(mincer.get_cache().keys("encoded:fake-server:gzip:")) == 1
+
+    def test_small_answers_are_not_compressed(self, client, tmp_db, fake_serv, fake_prov):
+        response = client.get(
+            self._build_url_from_query("canary"), headers={"Accept-Encoding": "gzip"})
+
+        assert "Content-Encoding" not in response.headers
+
+    def test_results_can_be_minified(self, client, tmp_db, fake_serv, fake_prov):
+        URL = self._build_url_from_query("search with noisy results")
+        noisy = client.get(URL).get_data(as_text=True)
+        assert "<script>" in noisy
+
+        fake_prov.minify = True
+        mincer.db.session.commit()
+
+        data = client.get(URL).get_data(as_text=True)
+        results = all_div_content(data, query=HtmlClasses.result_item_query())
+        assert len(results) == 2
+        assert "<script>" not in data
+        assert "<!--" not in data
+        assert "  " not in data
+        assert "Result  number 1" not in data and "Result number 1" in data
+
+    def test_nodes_can_be_removed_from_the_results(self, client, tmp_db, fake_serv, fake_prov):
+        fake_prov.selectors_to_remove = ".hold, img.placeholder"
+        mincer.db.session.commit()
+
+        data = client.get(self._build_url_from_query("search with buttons")).get_data(as_text=True)
+
+        results = all_div_content(data, query=HtmlClasses.result_item_query())
+        assert len(results) == 2
+        assert "Place hold" not in data
+        assert "placeholder" not in data
+        assert "cover.png" in data
+        assert is_substring_in("Result number 1", results)
+
+    def test_results_can_be_extracted_as_records(self, client, tmp_db, fake_serv, fake_prov):
+        URL = self._build_url_from_query("search with records") + "/records"
+        # No field selector, no record and no remote page
+        fake_prov.remote_url = "http://0.0.0.0:5555/counted/{param}"
+        mincer.db.session.commit()
+        assert client.get(URL).status_code == NOT_FOUND
+        assert requests.get("http://0.0.0.0:5555/hits/search with records").text == "0"
+
+        fake_prov.title_selector = "a"
+        fake_prov.author_selector = ".author"
+        fake_prov.link_selector = "a"
+        fake_prov.cover_selector = "img"
+        mincer.db.session.commit()
+
+        response = client.get(URL)
+        assert response.status_code == OK
+        assert response.headers["Access-Control-Allow-Origin"] == "*"
+        assert response.get_json() == {
+            "outcome": "result",
+            "records": [
+                {"title": "Les misérables",
+                 "author": "Victor Hugo",
+                 "link": "http://0.0.0.0:5555/doc/1",
+                 "cover": "http://0.0.0.0:5555/covers/1.png"},
+                {"title": "Notre-Dame de Paris",
+                 "link": "http://0.0.0.0:5555/doc/2"},
+                ]}
+
+        # The records are kept in cache
+        assert client.get(URL).get_json() == response.get_json()
+        assert [k for k in mincer.get_cache().keys("records:fake-server:")]
+
+        # A window of the records can be given
+        window = client.get(URL + "?offset=1&limit=1").get_json()
+        assert window["records"] == response.get_json()["records"][1:]
+        assert client.get(URL + "?limit=-1").status_code == BAD_REQUEST
+
+    def test_a_window_of_the_results_is_given(self, client, tmp_db, fake_serv, fake_prov):
+        URL = self._build_url_from_query("search with multiple results")
+
+        data = client.get(URL + "?limit=2").get_data(as_text=True)
+        results = all_div_content(data, query=HtmlClasses.result_item_query())
+        assert len(results) == 2
+        assert is_substring_in("Result number 1", results)
+        assert is_substring_in("Result number 2", results)
+
+        data = client.get(URL + "?offset=2").get_data(as_text=True)
+        results = all_div_content(data, query=HtmlClasses.result_item_query())
+        assert len(results) == 1
+        assert is_substring_in("Result number 3", results)
+
+        # Streamed answers have the same window
+        data = client.get(URL + "?offset=1&limit=1&stream=1").get_data(as_text=True)
+        results = all_div_content(data, query=HtmlClasses.result_item_query())
+        assert len(results) == 1
+        assert is_substring_in("Result number 2", results)
+
+    @pytest.mark.parametrize("window", ["limit=-1", "offset=-1", "limit=ten"])
+    def test_invalid_windows_are_refused(self, client, tmp_db, fake_prov, window):
+        URL = self._build_url_from_query("search with multiple results")
+
+        assert client.get(URL + "?" + window).status_code == BAD_REQUEST
+
+    def test_windows_are_taken_from_the_cached_results(self, client, tmp_db, fake_serv, fake_prov, metrics):
+        URL = self._build_url_from_query("search with multiple results")
+        full = client.get(URL).get_data(as_text=True)
+
+        data = client.get(URL + "?offset=1&limit=1").get_data(as_text=True)
+        results = all_div_content(data, query=HtmlClasses.result_item_query())
+        assert len(results) == 1
+        assert is_substring_in("Result number 2", results)
+        assert results[0] in full
+
+        # The window was not extracted again
+        counters = client.get("/metrics").get_json()["cache"]["fake-server"]
+        assert (counters["result_miss"], counters["result_hit"]) == (1, 1)
+        assert not [k for k in mincer.get_cache().keys("result:")
+                    if k.endswith(":1:1")]
+
+        # A window extracted alone is kept in cache too
+        client.get(self._build_url_from_query("canary") + "?limit=1")
+        assert [k for k in mincer.get_cache().keys("result:")
+                if k.endswith(":0:1")]
+
+    def test_fallback_result_selectors_are_tried_in_order(self, client, tmp_db, fake_serv, fake_prov, metrics):
+        # The result selector may match the raw pages but matches nothing
+        fake_prov.result_selector = ".result .item b"
+        fake_prov.fallback_result_selectors = "#results .item; .result .item"
+        mincer.db.session.commit()
+
+        data = client.get(self._build_url_from_query("canary")).get_data(as_text=True)
+        assert is_div(data, cls_name=HtmlClasses.RESULT, id_name=fake_prov.slug)
+        assert "Pew Pew" in data
+
+        # The matching selector is now tried first
+        data = client.get(self._build_url_from_query("search with multiple results")).get_data(as_text=True)
+        results = all_div_content(data, query=HtmlClasses.result_item_query())
+        assert len(results) == 3
+
+        snapshot = client.get("/metrics").get_json()
+        assert snapshot["selector"]["fake-server"] == {".result .item": 2}
+        # Only the first search tried the result selector for nothing, the
+        # second fallback selector could not match the raw pages at all
+        assert snapshot["selector_misses"]["fake-server"] == 1
+
+    def test_records_count_the_matching_selectors(self, client, tmp_db, fake_serv, fake_prov, metrics):
+        fake_prov.result_selector = ".result .item b"
+        fake_prov.fallback_result_selectors = ".result .item"
+        fake_prov.title_selector = "a"
+        mincer.db.session.commit()
+
+        URL = self._build_url_from_query("search with records") + "/records"
+        assert client.get(URL).get_json()["outcome"] == "result"
+
+        snapshot = client.get("/metrics").get_json()
+        assert snapshot["selector"]["fake-server"] == {".result .item": 1}
+        assert snapshot["selector_misses"]["fake-server"] == 1
+
+    def test_records_of_a_search_without_result(self, client, tmp_db, fake_serv, fake_prov):
+        fake_prov.title_selector = "a"
+        mincer.db.session.commit()
+
+        response = client.get(
+            self._build_url_from_query("search without result") + "/records")
+
+        assert response.get_json() == {"outcome": "no_result", "records": []}
@@ -0,0 +1,182 @@
+__author__ = "Pierre-Yves Martin <pym.aldebaran@gmail.com>"
+__copyright__ = "Copyright (C) 2017 GIP BULAC"
+__license__ = "GNU AGPL V3"
+
+# This file is part of Mincer.
+#
+# Mincer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mincer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Mincer.  If not, see <http://www.gnu.org/licenses/>.
+
+# To run concurrent calls
+import threading
+import asyncio
+from time import sleep, time
+
+# Module to test
+from mincer.peers import HashRing, SingleFlight, AsyncSingleFlight, PeerGroup, PeerUnavailableError, PeerConfigurationError
+from mincer.remote import Deadline, DeadlineExceededError
+
+# Test framework that helps you write better programs !
+import pytest
+
+NODES = ["http://mincer{i}:5000".format(i=i) for i in range(4)]
+KEYS = ["page:http://host.org/{i}".format(i=i) for i in range(1000)]
+
+
+class TestHashRing(object):
+    def test_keys_are_shared_between_nodes(self):
+        ring = HashRing(NODES)
+        owners = [ring.owner(key) for key in KEYS]
+
+        for node in NODES:
+            assert owners.count(node) > len(KEYS) / len(NODES) / 2
+
+    def test_a_new_node_only_takes_keys_from_the_others(self):
+        ring = HashRing(NODES)
+        bigger = HashRing(NODES + ["http://mincer4:5000"])
+
+        moved = [key for key in KEYS if ring.owner(key) != bigger.owner(key)]
+
+        assert all(bigger.owner(key) == "http://mincer4:5000" for key in moved)
+        assert len(moved) < len(KEYS) / 3
+
+    def test_empty_ring_has_no_owner(self):
+        assert HashRing([]).owner("key") is None
+
+
+class TestSingleFlight(object):
+    def test_concurrent_calls_are_shared(self):
+        flight = SingleFlight()
+        calls = []
+
+        def slow_call():
+            calls.append(1)
+            sleep(0.2)
+            return "page"
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(flight.do("key", slow_call)))
+            for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == ["page"] * 5
+        assert len(calls) == 1
+
+    def test_errors_are_raised_and_forgotten(self):
+        flight = SingleFlight()
+
+        def failing_call():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            flight.do("key", failing_call)
+
+        # The next call is a new one
+        assert flight.do("key", lambda: "page") == "page"
+
+
+    def test_a_short_deadline_of_the_first_caller_is_not_shared(self):
+        flight = SingleFlight()
+        calls = []
+
+        def fetch(deadline):
+            calls.append(deadline)
+            sleep(0.3)
+            if deadline.expired():
+                raise DeadlineExceededError("too late")
+            return "page"
+
+        results = {}
+
+        def ask(name, deadline):
+            try:
+                results[name] = flight.do("key", fetch, deadline, deadline=deadline)
+            except DeadlineExceededError:
+                results[name] = "deadline exceeded"
+
+        hurried = threading.Thread(target=ask, args=("hurried", Deadline(0.1)))
+        patient = threading.Thread(target=ask, args=("patient", Deadline(30)))
+        hurried.start()
+        sleep(0.05)
+        patient.start()
+        hurried.join()
+        patient.join()
+
+        assert results == {"hurried": "deadline exceeded", "patient": "page"}
+        # The patient caller made the call again with its own deadline
+        assert len(calls) == 2
+
+    def test_waiting_callers_give_up_at_their_deadline(self):
+        flight = SingleFlight()
+        leader = threading.Thread(
+            target=flight.do, args=("key", sleep, 0.5))
+        leader.start()
+        sleep(0.05)
+
+        start = time()
+        with pytest.raises(DeadlineExceededError):
+            flight.do("key", lambda: "page", deadline=Deadline(0.1))
+        assert time() - start < 0.4
+
+        leader.join()
+
+
+class TestAsyncSingleFlight(object):
+    def test_a_short_deadline_of_the_first_caller_is_not_shared(self):
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def fetch(deadline):
+            calls.append(deadline)
+            await asyncio.sleep(0.3)
+            if deadline.expired():
+                raise DeadlineExceededError("too late")
+            return "page"
+
+        async def ask(deadline, delay=0):
+            await asyncio.sleep(delay)
+            try:
+                return await flight.do("key", fetch, deadline, deadline=deadline)
+            except DeadlineExceededError:
+                return "deadline exceeded"
+
+        async def ask_all():
+            return await asyncio.gather(
+                ask(Deadline(0.1)), ask(Deadline(30), 0.05))
+
+        assert asyncio.run(ask_all()) == ["deadline exceeded", "page"]
+        assert len(calls) == 2
+
+
+class TestPeerGroup(object):
+    def test_unreachable_owner_is_unavailable(self):
+        group = PeerGroup("http://127.0.0.1:1", ["http://127.0.0.1:1", "http://127.0.0.1:2"])
+
+        with pytest.raises(PeerUnavailableError):
+            group.fetch("http://127.0.0.1:2/peers/fake/page", {}, Deadline(1))
+
+    def test_keys_are_owned_by_the_listed_instances(self):
+        group = PeerGroup(NODES[0] + "/", NODES)
+        owners = {group.owner(key) for key in KEYS}
+
+        assert owners == {None} | set(NODES[1:])
+
+    @pytest.mark.parametrize("self_url", [None, "", "http://mincer9:5000"])
+    def test_instance_must_be_in_the_group(self, self_url):
+        with pytest.raises(PeerConfigurationError):
+            PeerGroup(self_url, NODES)
@@ -0,0 +1,346 @@
+__author__ = "Pierre-Yves Martin <pym.aldebaran@gmail.com>"
+__copyright__ = "Copyright (C) 2017 GIP BULAC"
+__license__ = "GNU AGPL V3"
+
+# This file is part of Mincer.
+#
+# Mincer is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Mincer is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Mincer.  If not, see <http://www.gnu.org/licenses/>.
+
+# To run coroutines
+import asyncio
+
+# To block some threads on a slow host
+import threading
+
+# To measure durations
+import time
+
+# To send concurrent requests
+from concurrent.futures import ThreadPoolExecutor
+
+# To serve some flaky remote pages
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Asynchronous HTTP client
+import httpx
+
+# Module we are going to test
+from mincer import remote
+
+# Unittesting module made simple !
+import pytest
+
+
+class TestBulkheads(object):
+    SLOW = "http://slow.org/page.html"
+    FAST = "http://fast.org/page.html"
+
+    def test_slow_host_does_not_block_other_hosts(self):
+        bulkheads = remote.Bulkheads(capacity=2, timeout=0)
+        release = threading.Event()
+        started = threading.Barrier(3)
+
+        def slow_request():
+            with bulkheads.slot(self.SLOW):
+                started.wait()
+                release.wait()
+
+        threads = [threading.Thread(target=slow_request) for _ in range(2)]
+        for t in threads:
+            t.start()
+        started.wait()
+
+        try:
+            # The slow host has no slot left...
+            with pytest.raises(remote.BulkheadFullError):
+                with bulkheads.slot(self.SLOW):
+                    pass
+
+            # ...but the other hosts keep all theirs
+            with bulkheads.slot(self.FAST):
+                with bulkheads.slot(self.FAST):
+                    pass
+        finally:
+            release.set()
+            for t in threads:
+                t.join()
+
+    def test_waiting_for_a_slot_stops_at_the_deadline(self):
+        bulkheads = remote.Bulkheads(capacity=1, timeout=10)
+
+        with bulkheads.slot(self.SLOW):
+            start = time.monotonic()
+            with pytest.raises(remote.DeadlineExceededError):
+                with bulkheads.slot(self.SLOW, deadline=remote.Deadline(0.1)):
+                    pass
+            assert time.monotonic() - start < 1
+
+    def test_slot_is_released_on_error(self):
+        bulkheads = remote.Bulkheads(capacity=1, timeout=0)
+
+        with pytest.raises(ValueError):
+            with bulkheads.slot(self.SLOW):
+                raise ValueError()
+
+        with bulkheads.slot(self.SLOW):
+            pass
+
+    def test_specific_host_capacity(self):
+        bulkheads = remote.Bulkheads(
+            capacity=1, capacities={"slow.org": 3}, timeout=0)
+
+        assert bulkheads.capacity_for("slow.org") == 3
+        assert bulkheads.capacity_for("fast.org") == 1
+
+
+class TestAsyncBulkheads(object):
+    SLOW = "http://slow.org/page.html"
+    FAST = "http://fast.org/page.html"
+
+    def test_slow_host_does_not_block_other_hosts(self):
+        bulkheads = remote.AsyncBulkheads(capacity=1, timeout=0.1)
+
+        async def scenario():
+            async with bulkheads.slot(self.SLOW):
+                with pytest.raises(remote.BulkheadFullError):
+                    async with bulkheads.slot(self.SLOW):
+                        pass
+                async with bulkheads.slot(self.FAST):
+                    pass
+
+        asyncio.run(scenario())
+
+    def test_waiting_for_a_slot_stops_at_the_deadline(self):
+        bulkheads = remote.AsyncBulkheads(capacity=1, timeout=10)
+
+        async def scenario():
+            async with bulkheads.slot(self.SLOW):
+                start = time.monotonic()
+                with pytest.raises(remote.DeadlineExceededError):
+                    async with bulkheads.slot(
+                            self.SLOW, deadline=remote.Deadline(0.1)):
+                        pass
+                assert time.monotonic() - start < 1
+
+        asyncio.run(scenario())
+
+    def test_waiting_request_gets_the_freed_slot(self):
+        bulkheads = remote.AsyncBulkheads(capacity=1, timeout=1)
+        order = []
+
+        async def request(name, duration):
+            async with bulkheads.slot(self.SLOW):
+                order.append(name)
+                await asyncio.sleep(duration)
+
+        async def scenario():
+            await asyncio.gather(request("first", 0.05), request("second", 0))
+
+        asyncio.run(scenario())
+
+        assert order == ["first", "second"]
+
+    def test_slots_can_be_shared_with_threads(self):
+        bulkheads = remote.Bulkheads(capacity=1, timeout=10)
+        shared = remote.AsyncBulkheads.sharing(bulkheads)
+
+        async def scenario():
+            with bulkheads.slot(self.SLOW):
+                with pytest.raises(remote.DeadlineExceededError):
+                    async with shared.slot(
+                            self.SLOW, deadline=remote.Deadline(0.05)):
+                        pass
+                with pytest.raises(remote.BulkheadFullError):
+                    async with shared.slot(self.SLOW, wait=False):
+                        pass
+
+            async with shared.slot(self.SLOW):
+                with pytest.raises(remote.BulkheadFullError):
+                    with bulkheads.slot(self.SLOW, wait=False):
+                        pass
+
+        asyncio.run(scenario())
+
+    def test_shared_slot_is_awaited(self):
+        bulkheads = remote.Bulkheads(capacity=1, timeout=10)
+        shared = remote.AsyncBulkheads.sharing(bulkheads)
+        slot = bulkheads.slot(self.SLOW)
+        slot.__enter__()
+        threading.Timer(0.05, slot.__exit__, (None, None, None)).start()
+
+        async def scenario():
+            async with shared.slot(self.SLOW):
+                return "request"
+
+        assert asyncio.run(scenario()) == "request"
+
+
+class FlakyServer(object):
+    """A local HTTP server whose answers are scripted.
+
+    Arguments:
+        answers (list(tuple(int, float))): status and delay (in seconds) of
+            each successive answer. The last one is repeated forever.
+    """
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.requests = 0
+        lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with lock:
+                    index = min(server.requests, len(server.answers) - 1)
+                    server.requests += 1
+                status, delay = server.answers[index]
+                time.sleep(delay)
+                self.send_response(status)
+                self.end_headers()
+                self.wfile.write("answer {n}".format(n=index).encode())
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = "http://127.0.0.1:{port}/page".format(
+            port=self.httpd.server_address[1])
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def flaky_server(request):
+    server = FlakyServer(request.param)
+    yield server
+    server.close()
+
+
+def new_fetcher(asynchronous, timeout=5, retries=2, hedging=False):
+    """Build a sync or async fetcher with a quick retry policy."""
+    retry = remote.RetryPolicy(retries=retries, backoff=0.01, max_backoff=0.05)
+    if asynchronous:
+        return remote.AsyncFetcher(
+            httpx.AsyncClient(),
+            remote.AsyncBulkheads(capacity=2, timeout=1),
+            timeout=timeout, retry=retry, hedging=hedging)
+    return remote.Fetcher(
+        remote.Bulkheads(capacity=2, timeout=1),
+        timeout=timeout, retry=retry, hedging=hedging)
+
+
+def fetch(fetcher, url, key=None, deadline=None):
+    """Fetch a page synchronously whatever the fetcher."""
+    if not isinstance(fetcher, remote.AsyncFetcher):
+        return fetcher.fetch(url, key=key, deadline=deadline)
+
+    async def fetch_and_close():
+        try:
+            return await fetcher.fetch(url, key=key, deadline=deadline)
+        finally:
+            await fetcher.client.aclose()
+
+    return asyncio.run(fetch_and_close())
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+class TestFetcher(object):
+    @pytest.mark.parametrize("flaky_server", [[(500, 0), (503, 0), (200, 0)]], indirect=True)
+    def test_server_errors_are_retried(self, flaky_server, asynchronous):
+        fetcher = new_fetcher(asynchronous, retries=2)
+
+        assert fetch(fetcher, flaky_server.url) == "answer 2"
+        assert flaky_server.requests == 3
+
+    @pytest.mark.parametrize("flaky_server", [[(500, 0)]], indirect=True)
+    def test_fail_once_all_retries_are_used(self, flaky_server, asynchronous):
+        fetcher = new_fetcher(asynchronous, retries=2)
+
+        with pytest.raises(remote.RemoteError):
+            fetch(fetcher, flaky_server.url)
+        assert flaky_server.requests == 3
+
+    @pytest.mark.parametrize("flaky_server", [[(404, 0), (200, 0)]], indirect=True)
+    def test_client_errors_are_not_retried(self, flaky_server, asynchronous):
+        fetcher = new_fetcher(asynchronous, retries=2)
+
+        assert fetch(fetcher, flaky_server.url) == "answer 0"
+        assert flaky_server.requests == 1
+
+    def test_connection_errors_are_retried(self, asynchronous):
+        fetcher = new_fetcher(asynchronous, retries=1)
+
+        with pytest.raises(remote.RemoteError):
+            fetch(fetcher, "http://127.0.0.1:1/page")
+
+    @pytest.mark.parametrize("flaky_server", [[(200, 1)]], indirect=True)
+    def test_deadline_is_respected(self, flaky_server, asynchronous):
+        fetcher = new_fetcher(asynchronous, retries=5)
+
+        start = time.monotonic()
+        with pytest.raises(remote.DeadlineExceededError):
+            fetch(fetcher, flaky_server.url, deadline=remote.Deadline(0.2))
+        assert time.monotonic() - start < 0.8
+
+    @pytest.mark.parametrize("flaky_server", [[(200, 0)]], indirect=True)
+    def test_expired_deadline_does_not_reach_the_remote_host(self, flaky_server, asynchronous):
+        fetcher = new_fetcher(asynchronous)
+
+        with pytest.raises(remote.DeadlineExceededError):
+            fetch(fetcher, flaky_server.url, deadline=remote.Deadline(0))
+        assert flaky_server.requests == 0
+
+    @pytest.mark.parametrize("flaky_server", [[(200, 1), (200, 0)]], indirect=True)
+    def test_slow_requests_are_hedged(self, flaky_server, asynchronous):
+        fetcher = new_fetcher(asynchronous, hedging=True)
+        # The provider usually answers quickly
+        for _ in range(fetcher.latencies.min_samples):
+            fetcher.latencies.add("koha", 0.05)
+
+        start = time.monotonic()
+        assert fetch(fetcher, flaky_server.url, key="koha") == "answer 1"
+        assert time.monotonic() - start < 0.8
+        assert flaky_server.requests == 2
+
+    @pytest.mark.parametrize("flaky_server", [[(200, 0.3), (200, 0)]], indirect=True)
+    def test_requests_are_not_hedged_without_known_latencies(self, flaky_server, asynchronous):
+        fetcher = new_fetcher(asynchronous, hedging=True)
+
+        assert fetch(fetcher, flaky_server.url, key="koha") == "answer 0"
+        assert flaky_server.requests == 1
+
+
+class TestHedgingWorkers(object):
+    @pytest.mark.parametrize("flaky_server", [[(200, 0.5)]], indirect=True)
+    def test_busy_workers_are_not_waited_for(self, flaky_server):
+        fetcher = remote.Fetcher(
+            remote.Bulkheads(capacity=4, timeout=1),
+            timeout=5, hedging=True, hedging_workers=1)
+        for _ in range(fetcher.latencies.min_samples):
+            fetcher.latencies.add("koha", 0.05)
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            pages = list(executor.map(
+                lambda _: fetcher.fetch(flaky_server.url, key="koha"),
+                range(3)))
+        # The requests without worker are sent right away, never hedged
+        assert len(pages) == 3
+        assert time.monotonic() - start < 0.9
+        assert flaky_server.requests == 3
@@ -23,6 +23,9 @@ import mincer
 # Unittesting module made simple !
 import pytest
 
+# To analyse deeply HTML pages or partials
+from pyquery import PyQuery
+
 # Some useful func to analyse strings and determine if they are HTML
 from tests.utils import is_div
 
@@ -172,3 +175,422 @@ class TestExtractNodeFromHtml(object):
         # The function should fail if trying to extract a not unique div
         with pytest.raises(mincer.utils.NoMatchError):
             mincer.utils.extract_node_from_html(QUERY, PAGE)
+
+
+class TestExtractAllNodeFromHtml(object):
+    PAGE = """<!DOCTYPE html><html><body>
+        <div class="hop">1</div><div class="hop">2</div>
+        <div class="hop">3</div><div class="hop">4</div>
+    </body></html>"""
+
+    def test_a_window_of_the_divs_is_extracted(self):
+        res = mincer.utils.extract_all_node_from_html(
+            ".hop", self.PAGE, offset=1, limit=2)
+
+        assert res == ['<div class="hop">2</div>', '<div class="hop">3</div>']
+
+    def test_a_window_after_the_divs_is_empty(self):
+        assert mincer.utils.extract_all_node_from_html(
+            ".hop", self.PAGE, offset=10) == []
+
+    def test_the_divs_after_the_window_are_not_serialized(self):
+        class CountingEngine(mincer.utils.LxmlEngine):
+            serialized = 0
+
+            def outer_html(self, element):
+                CountingEngine.serialized += 1
+                return super().outer_html(element)
+
+        nodes = mincer.utils.iter_all_node_from_html(
+            ".hop", self.PAGE, engine=CountingEngine(), limit=1)
+
+        assert list(nodes) == ['<div class="hop">1</div>']
+        assert CountingEngine.serialized == 1
+
+
+class TestMakeLinksAbsolute(object):
+    BASE_URL = "http://host.org/good/path/"
+
+    def test_rewrite_all_link_attributes(self):
+        PAGE = """<div class="item">
+            <a href="doc.html">doc</a>
+            <img src="/cover.png" srcset="small.png 1x, /big.png 2x">
+            <form action="search"></form>
+        </div>"""
+        q = PyQuery(PAGE)
+
+        mincer.utils.make_links_absolute(q(".item"), self.BASE_URL)
+
+        assert q("a").attr("href") == "http://host.org/good/path/doc.html"
+        assert q("img").attr("src") == "http://host.org/cover.png"
+        assert q("img").attr("srcset") == \
+            "http://host.org/good/path/small.png 1x, http://host.org/big.png 2x"
+        assert q("form").attr("action") == "http://host.org/good/path/search"
+
+    def test_leave_absolute_and_special_links_untouched(self):
+        PAGE = """<div class="item">
+            <a href="http://other.org/doc.html">doc</a>
+            <a href="tel:+33123456789">phone</a>
+        </div>"""
+        q = PyQuery(PAGE)
+
+        mincer.utils.make_links_absolute(q(".item"), self.BASE_URL)
+
+        hrefs = [a.get("href") for a in q("a")]
+        assert hrefs == ["http://other.org/doc.html", "tel:+33123456789"]
+
+    def test_only_matched_subtrees_are_modified(self):
+        PAGE = """<div>
+            <div class="item"><a href="in.html">in</a></div>
+            <div class="other"><a href="out.html">out</a></div>
+        </div>"""
+        q = PyQuery(PAGE)
+
+        mincer.utils.make_links_absolute(q(".item"), self.BASE_URL)
+
+        assert q(".item a").attr("href") == "http://host.org/good/path/in.html"
+        assert q(".other a").attr("href") == "out.html"
+
+
+class TestRemoveNodes(object):
+    def test_matching_descendants_are_removed(self):
+        PAGE = """<div class="item">Victor Hugo
+            <div class="hold"><a class="hold">Place hold</a></div> 1862
+        </div>"""
+        q = PyQuery(PAGE)
+
+        mincer.utils.remove_nodes(q(".item")[0], ".hold")
+
+        assert q(".item").text() == "Victor Hugo 1862"
+
+    def test_the_node_itself_is_kept(self):
+        q = PyQuery('<div class="item"><b class="item">Hugo</b></div>')
+
+        mincer.utils.remove_nodes(q("div")[0], ".item")
+
+        assert q("div").outer_html() == '<div class="item"></div>'
+
+
+class TestMinifyElement(object):
+    def test_removed_nodes_keep_the_following_text(self):
+        PAGE = """<div class="item">
+            <script>track()</script> Victor <!-- author --> Hugo
+            <b>Les <style>b {}</style>misérables</b>
+        </div>"""
+        q = PyQuery(PAGE)
+
+        mincer.utils.minify_element(q(".item")[0])
+
+        assert q(".item").outer_html() == \
+            '<div class="item"> Victor Hugo <b>Les misérables</b> </div>'
+
+    def test_preformatted_text_is_kept(self):
+        PAGE = """<div class="item">
+            <pre>  Victor
+  Hugo</pre> <textarea>  Les  misérables </textarea>
+        </div>"""
+        q = PyQuery(PAGE)
+
+        mincer.utils.minify_element(q(".item")[0])
+
+        assert q("pre").text(squash_space=False) == "  Victor\n  Hugo"
+        assert q("textarea").text(squash_space=False) == "  Les  misérables "
+
+    @pytest.mark.parametrize("engine", sorted(mincer.utils.ENGINES))
+    def test_engines_minify_the_same_way(self, engine):
+        PAGE = """<html><body><div class="item">
+            <!-- hip --> hop <script>hup()</script>
+        </div></body></html>"""
+
+        assert mincer.utils.extract_all_node_from_html(
+            ".item", PAGE, engine=engine, minify=True) == \
+            ['<div class="item"> hop </div>']
+
+
+class TestExtractRecordsFromHtml(object):
+    PAGE = """<!DOCTYPE html><html><body>
+        <div class="item">
+            <a class="title" href="/doc/1">Les  misérables</a>
+            <span class="author">Victor Hugo</span>
+            <img src="covers/1.png">
+        </div>
+        <div class="item"><a class="title" href="/doc/2">Notre-Dame</a></div>
+    </body></html>"""
+    FIELDS = {
+        "title": ".title",
+        "author": ".author",
+        "link": "a.title",
+        "cover": "img",
+        }
+
+    @pytest.mark.parametrize("engine", sorted(mincer.utils.ENGINES))
+    def test_fields_are_extracted_from_each_result(self, engine):
+        records = mincer.utils.extract_records_from_html(
+            ".item", self.PAGE, self.FIELDS, "http://host.org/", engine)
+
+        assert [r.to_dict() for r in records] == [
+            {"title": "Les misérables",
+             "author": "Victor Hugo",
+             "link": "http://host.org/doc/1",
+             "cover": "http://host.org/covers/1.png"},
+            {"title": "Notre-Dame", "link": "http://host.org/doc/2"},
+            ]
+
+    def test_records_survive_their_values(self):
+        records = mincer.utils.extract_records_from_html(
+            ".item", self.PAGE, self.FIELDS)
+
+        assert [mincer.utils.Record.from_values(r.values()) for r in records] \
+            == records
+        assert records[1].call_number is None
+
+    def test_no_result_is_an_error(self):
+        with pytest.raises(mincer.utils.NoMatchError):
+            mincer.utils.extract_records_from_html(
+                ".nothing", self.PAGE, self.FIELDS)
+
+
+class TestMayMatch(object):
+    PAGE = """<!DOCTYPE html>
+        <html lang="fr">
+            <body>
+                <div id="results"><p class="item">du contenu</p></div>
+            </body>
+        </html>"""
+
+    def test_may_match_if_all_tokens_are_present(self):
+        assert mincer.utils.may_match("#results p.item", self.PAGE)
+
+    def test_can_not_match_if_a_token_is_missing(self):
+        assert not mincer.utils.may_match("#results p.cible", self.PAGE)
+
+    def test_negated_tokens_are_not_required(self):
+        assert mincer.utils.may_match("#results p:not(.cible)", self.PAGE)
+
+    def test_any_alternative_may_match(self):
+        assert mincer.utils.may_match("#ailleurs, .item", self.PAGE)
+
+    def test_unparsable_selector_may_always_match(self):
+        assert mincer.utils.may_match("#results >>> p", self.PAGE)
+
+
+class TestIsNoResultPage(object):
+    PAGE = """<!DOCTYPE html>
+        <html lang="fr">
+            <body>
+                <div class="span12"><p>Aucune réponse trouvée.</p></div>
+            </body>
+        </html>"""
+
+    def test_detect_unambiguous_no_result_page(self):
+        assert mincer.utils.is_no_result_page(
+            self.PAGE, "#results .item", ".span12 p", "Aucune réponse trouvée.")
+
+    def test_page_with_possible_results_is_ambiguous(self):
+        assert not mincer.utils.is_no_result_page(
+            self.PAGE, ".span12", ".span12 p", "Aucune réponse trouvée.")
+
+    def test_page_without_message_is_not_a_no_result_page(self):
+        assert not mincer.utils.is_no_result_page(
+            self.PAGE, "#results .item", ".span12 p", "Pas de résultat.")
+
+    def test_provider_without_no_result_message_never_matches(self):
+        assert not mincer.utils.is_no_result_page(
+            self.PAGE, "#results .item", "", "")
+
+    def test_message_outside_the_no_result_selector_is_ambiguous(self):
+        PAGE = """<!DOCTYPE html>
+            <html lang="fr">
+                <body>
+                    <div class="span12"><p>Des livres</p></div>
+                    <div class="help"><p>Aucune réponse trouvée.</p></div>
+                </body>
+            </html>"""
+        assert not mincer.utils.is_no_result_page(
+            PAGE, "#results .item", ".span12 p", "Aucune réponse trouvée.")
+
+    def test_message_without_located_selector_is_ambiguous(self):
+        assert not mincer.utils.is_no_result_page(
+            self.PAGE, "#results .item", "div p", "Aucune réponse trouvée.")
+
+
+class TestHtmlEngines(object):
+    PAGE = """<!DOCTYPE html>
+        <html lang="fr">
+            <body>
+                <div id="usershelves"><table class="searchresults">
+                    <tr><td class="select">x</td><td>Premier <a href="a.html">livre</a></td></tr>
+                    <tr><td class="select">x</td><td>Second <a href="b.html">livre</a></td></tr>
+                </table></div>
+                <div class="span12"><p>Aucune   réponse
+                    trouvée.</p></div>
+            </body>
+        </html>"""
+
+    @pytest.mark.parametrize("selector", [
+        "#usershelves .searchresults tr td:not(.select)",
+        "#usershelves td:first",
+        "tr:eq(1) td",
+        ])
+    def test_engines_extract_the_same_nodes(self, selector):
+        results = {
+            name: mincer.utils.extract_all_node_from_html(
+                selector, self.PAGE, "http://host.org/", engine=name)
+            for name in mincer.utils.ENGINES}
+
+        assert len(set(map(tuple, results.values()))) == 1
+
+    @pytest.mark.parametrize("engine", sorted(mincer.utils.ENGINES))
+    def test_engines_squash_spaces_in_content(self, engine):
+        res = mincer.utils.extract_content_from_html(
+            ".span12 p", "Aucune réponse trouvée.", self.PAGE, engine=engine)
+
+        assert is_div(res)
+
+    @pytest.mark.parametrize("engine", sorted(mincer.utils.ENGINES))
+    def test_engines_fail_on_empty_page(self, engine):
+        with pytest.raises(mincer.utils.NoMatchError):
+            mincer.utils.extract_all_node_from_html("td", "", engine=engine)
+
+    def test_unknown_engine_is_an_error(self):
+        with pytest.raises(mincer.utils.UnknownEngineError):
+            mincer.utils.get_engine("dummy")
+
+    @pytest.mark.parametrize("engine", sorted(mincer.utils.ENGINES))
+    def test_fallback_selectors_share_one_parsed_document(self, engine):
+        engine = mincer.utils.get_engine(engine)
+        parsed = []
+
+        class CountingEngine(type(engine)):
+            def parse(self, html):
+                parsed.append(html)
+                return super().parse(html)
+
+        index, matches = CountingEngine().select_first(
+            self.PAGE, ["#shelves td", ".nothing", ".searchresults td.select"])
+
+        assert (index, len(matches)) == (2, 2)
+        assert len(parsed) == 1
+
+    @pytest.mark.parametrize("engine", sorted(mincer.utils.ENGINES))
+    def test_first_matching_selector_gives_the_divs(self, engine):
+        index, res = mincer.utils.extract_first_nodes_from_html(
+            (".nothing", ".span12 p", "td"), self.PAGE, engine=engine)
+
+        assert index == 1
+        assert len(res) == 1 and "Aucune" in res[0]
+
+        with pytest.raises(mincer.utils.NoMatchError):
+            mincer.utils.extract_first_nodes_from_html(
+                (".nothing", "#none"), self.PAGE, engine=engine)
+
+    def test_invalid_selectors_are_refused(self):
+        with pytest.raises(mincer.utils.SelectorError):
+            mincer.utils.parse_selectors("td; tr >")
+
+
+class TestExtractionPool(object):
+    PAGE = """<!DOCTYPE html>
+        <html lang="fr">
+            <body>
+                <div class="item"><a href="a.html">Premier</a></div>
+                <div class="item"><a href="b.html">Second</a></div>
+            </body>
+        </html>"""
+
+    @pytest.fixture
+    def pool(self):
+        # Every extraction really goes through the pool
+        OLD_SIZE = mincer.utils.extraction_memo.max_size
+        mincer.utils.extraction_memo.max_size = 0
+
+        pool = mincer.utils.ExtractionPool(processes=1, threshold=100)
+        yield pool
+        pool.shutdown()
+
+        mincer.utils.extraction_memo.max_size = OLD_SIZE
+
+    def test_only_big_pages_are_offloaded(self, pool):
+        assert pool.is_offloaded(self.PAGE)
+        assert not pool.is_offloaded("<p>small</p>")
+
+    def test_disabled_pool_never_offloads(self):
+        pool = mincer.utils.ExtractionPool(processes=0, threshold=0)
+
+        assert not pool.is_offloaded(self.PAGE)
+
+    @pytest.mark.parametrize("engine", sorted(mincer.utils.ENGINES))
+    def test_offloaded_extraction_gives_same_result(self, pool, engine):
+        res = pool.extract_all_node_from_html(
+            ".item", self.PAGE, "http://host.org/", engine)
+
+        assert res == mincer.utils.extract_all_node_from_html(
+            ".item", self.PAGE, "http://host.org/", engine)
+
+    def test_offloaded_extraction_raises_errors(self, pool):
+        with pytest.raises(mincer.utils.NoMatchError):
+            pool.extract_all_node_from_html(".cible", self.PAGE)
+
+
+class TestExtractionMemo(object):
+    PAGE = '<!DOCTYPE html><html><div class="hop">hip</div><div class="hop">hiphip</div></html>'
+
+    @pytest.fixture
+    def memo(self):
+        return mincer.utils.ExtractionMemo(max_size=1024)
+
+    def test_identical_pages_are_extracted_once(self, memo):
+        computed = []
+        original = mincer.utils.extract_all_node_from_html.__wrapped__
+
+        def compute(**arguments):
+            computed.append(arguments)
+            return original(**arguments)
+
+        args = dict(selector=".hop", html=self.PAGE, base_url="", engine=None)
+        first = memo.call("extract", lambda: compute(**args), args)
+        # Same page in another string
+        same_args = dict(args, html="".join(list(self.PAGE)))
+        second = memo.call("extract", lambda: compute(**same_args), same_args)
+
+        assert first == second
+        assert len(computed) == 1
+
+    def test_extraction_functions_are_memoized(self):
+        mincer.utils.extraction_memo.clear()
+
+        mincer.utils.extract_all_node_from_html(".hop", self.PAGE)
+
+        assert mincer.utils.extraction_memo.size > 0
+
+    def test_other_arguments_are_part_of_the_key(self, memo):
+        args = dict(selector=".hop", html=self.PAGE)
+        memo.call("extract", lambda: ["a"], args)
+
+        assert memo.call("extract", lambda: ["b"], dict(args, selector="div")) == ["b"]
+        assert memo.call("other", lambda: ["c"], args) == ["c"]
+
+    def test_errors_are_memoized(self, memo):
+        def fail():
+            raise mincer.utils.NoMatchError()
+
+        args = dict(selector=".cible", html=self.PAGE)
+        with pytest.raises(mincer.utils.NoMatchError):
+            memo.call("extract", fail, args)
+        with pytest.raises(mincer.utils.NoMatchError):
+            memo.call("extract", lambda: ["never computed"], args)
+
+    def test_results_can_not_be_altered(self, memo):
+        args = dict(selector=".hop", html=self.PAGE)
+        memo.call("extract", lambda: ["a"], args).append("b")
+
+        assert memo.call("extract", lambda: [], args) == ["a"]
+
+    def test_memory_is_bounded(self, memo):
+        for i in range(100):
+            memo.call("extract", lambda: ["x" * 100], dict(html=str(i)))
+
+        assert memo.size <= memo.max_size
+        # The oldest extractions were forgotten
+        assert memo.call("extract", lambda: ["new"], dict(html="0")) == ["new"]
+        assert memo.call("extract", lambda: ["new"], dict(html="99")) == ["x" * 100]
@@ -91,7 +91,7 @@ def is_div(partial, cls_name=None, id_name=None):
     return div_ok and cls_ok and id_ok
 
 
-def has_div_with_class(partial, cls_name):
+def has_div_with_class(partial, cls_name, id_name=None):
     """Helper function to detect if a particular div with the specified class
     is present in the partial.
 
@@ -99,6 +99,8 @@ def has_div_with_class(partial, cls_name):
         partial (str): an HTML content (partial HTML code) page to test.
         class_name (str): the name of the class that the div in `partial` must
             have.
+        id_name (str|None): if not `None` the name of the id that the div
+            in `partial` must have.
 
     Returns:
         bool: True if `partial` contains at least one div with the provided
@@ -129,9 +131,20 @@ def has_div_with_class(partial, cls_name):
 
         >>> has_div_with_class('<span class="toto">Plop</span>', "toto")
         False
+
+        It can also check the id of the div:
+
+        >>> has_div_with_class('<div class="toto" id="a">1</div><div class="toto" id="b">2</div>', "toto", "b")
+        True
+
+        >>> has_div_with_class('<div class="toto" id="a">Plop</div>', "toto", "b")
+        False
     """
     d = PyQuery(partial)
-    if d("div.{cls_name}".format(cls_name=cls_name)):
+    query = "div.{cls_name}".format(cls_name=cls_name)
+    if id_name:
+        query += "#{id_name}".format(id_name=id_name)
+    if d(query):
         return True
     else:
         return False